@@ -0,0 +1,3 @@
+"""
+Нагрузочные бенчмарки слоя хранения (запуск: python -m benchmarks.<имя>)
+"""
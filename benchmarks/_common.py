@@ -0,0 +1,57 @@
+import os
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+# Бенчмарки не обращаются к Telegram, но config.py требует токен
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+
+BENCH_DIR = tempfile.mkdtemp(prefix='familybot-bench-')
+os.environ['DATABASE_URL'] = os.path.join(BENCH_DIR, 'shopping.db')
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    """Сводка задержек в миллисекундах"""
+    ordered = sorted(samples)
+    return {
+        'ops': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+    }
+
+
+def print_summary(title: str, summary: Dict[str, float]):
+    print(
+        f"{title:<28} ops={summary['ops']:<6} "
+        f"mean={summary['mean_ms']:.2f}ms p50={summary['p50_ms']:.2f}ms p95={summary['p95_ms']:.2f}ms"
+    )
+
+
+@contextmanager
+def timed(samples: List[float]):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.append(time.perf_counter() - started)
+
+
+class CommitPerWrite:
+    """Запись без группировки: каждое изменение - отдельная транзакция и commit"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def submit(self, job, *args):
+        async def commit_job(db):
+            result = await job(db, *args)
+            await db.commit()
+            return result
+
+        return await self.pool.write(commit_job)
+
+    async def stop(self):
+        pass
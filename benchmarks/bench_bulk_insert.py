@@ -0,0 +1,53 @@
+"""
+Добавление 1000 продуктов: разбор вставленного списка и запись
+по одному add_product против одного executemany (add_multiple_products).
+
+    python -m benchmarks.bench_bulk_insert --items 1000
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks._common import BENCH_DIR  # noqa: F401 - настраивает окружение
+
+from database import Database, init_db, close_db
+from utils.product_parser import parse_product_list
+
+
+def make_pasted_list(items: int) -> str:
+    units = ['1 кг', '500 г', '2 л', '10', '3 шт']
+    return '\n'.join(f"Продукт {i} {units[i % len(units)]}" for i in range(items))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000)
+    args = parser.parse_args()
+
+    await init_db()
+    text = make_pasted_list(args.items)
+
+    started = time.perf_counter()
+    products = parse_product_list(text)
+    parse_elapsed = time.perf_counter() - started
+    print(f"📝 Разбор {len(products)} строк: {parse_elapsed * 1000:.1f} мс")
+
+    list_id = await Database.get_or_create_list(1, 'По одному')
+    started = time.perf_counter()
+    for product in products:
+        await Database.add_product(list_id, product['name'], product['quantity'])
+    one_by_one = time.perf_counter() - started
+    print(f"{'add_product x ' + str(len(products)):<32} {one_by_one * 1000:8.1f} мс")
+
+    list_id = await Database.get_or_create_list(1, 'Одним сообщением')
+    started = time.perf_counter()
+    await Database.add_multiple_products(list_id, products)
+    bulk = time.perf_counter() - started
+    print(f"{'add_multiple_products (executemany)':<32} {bulk * 1000:8.1f} мс "
+          f"(в {one_by_one / bulk:.0f} раз быстрее)")
+
+    await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+"""
+Движки доступа к SQLite под одной нагрузкой: aiosqlite (переход в поток
+соединения на каждый execute/fetch) против sqlite3 на общем пуле потоков
+(вся операция Database - один переход).
+
+    python -m benchmarks.bench_engine --users 50 --clicks 40
+"""
+import argparse
+import asyncio
+import time
+from typing import List
+
+from benchmarks._common import latency_summary, print_summary, timed
+
+import database
+from config import DATABASE_URL, DB_READERS, SQLITE_PRAGMAS, SQLITE_CACHED_STATEMENTS, \
+    DB_WRITE_BATCH_WINDOW_MS, DB_WRITE_BATCH_MAX
+from database import Database, init_db, close_db
+from storage.pool import ConnectionPool
+from storage.threaded_pool import ThreadedPool
+from storage.write_queue import WriteQueue
+
+
+async def simulate_user(user_id: int, clicks: int, samples: List[float]):
+    """Пользователь открывает список, смотрит счетчики и отмечает товары"""
+    list_id = await Database.get_or_create_list(user_id)
+
+    for click in range(clicks):
+        # Отметка сбрасывает кэш списка, поэтому каждое чтение идет в базу
+        with timed(samples):
+            products = await Database.get_products(list_id)
+            await Database.get_list_stats(list_id)
+
+        with timed(samples):
+            await Database.toggle_product_bought(products[click % len(products)]['id'])
+
+
+async def run(label: str, pool, users: int, clicks: int):
+    shard = database.shards[0]
+    shard.pool = pool
+    shard.write_queue = WriteQueue(pool, DB_WRITE_BATCH_WINDOW_MS / 1000, DB_WRITE_BATCH_MAX)
+    await pool.open()
+
+    samples: List[float] = []
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(user_id, clicks, samples) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+
+    await close_db()
+    print_summary(label, latency_summary(samples))
+    print(f"{'':<28} {len(samples) / elapsed:,.0f} оп/с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--clicks', type=int, default=40)
+    args = parser.parse_args()
+
+    await init_db()
+    for user_id in range(1, args.users + 1):
+        await Database.add_user(user_id, f"user{user_id}", "Bench")
+        list_id = await Database.get_or_create_list(user_id)
+        await Database.add_multiple_products(
+            list_id, [{'name': f"Продукт {i}", 'quantity': '1'} for i in range(10)]
+        )
+    await close_db()
+
+    print(f"👥 Пользователей: {args.users}, кликов на пользователя: {args.clicks}")
+    await run("aiosqlite", ConnectionPool(DATABASE_URL, DB_READERS, SQLITE_PRAGMAS), args.users, args.clicks)
+    await run("sqlite3, пул потоков",
+              ThreadedPool(DATABASE_URL, DB_READERS, SQLITE_PRAGMAS, SQLITE_CACHED_STATEMENTS),
+              args.users, args.clicks)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+"""
+Задержка операций Database при одновременных пользователях:
+соединение на каждый вызов (как раньше) против общего пула
+без профиля PRAGMA и с профилем из config.SQLITE_PRAGMAS (WAL и т.д.).
+
+    python -m benchmarks.bench_pool --users 20 --clicks 25
+"""
+import argparse
+import asyncio
+from typing import List
+
+from benchmarks._common import CommitPerWrite, latency_summary, print_summary, timed
+
+import aiosqlite
+
+import database
+from config import DATABASE_URL, DB_READERS, SQLITE_PRAGMAS
+from database import Database, init_db
+from storage.pool import ConnectionPool
+
+
+class ConnectionPerCall:
+    """Прежнее поведение: новое соединение aiosqlite на каждый метод"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def read(self, job):
+        async with aiosqlite.connect(self.path) as connection:
+            return await job(connection)
+
+    write = read
+
+
+async def simulate_user(user_id: int, clicks: int, samples: List[float]):
+    """Один пользователь: открывает список и отмечает товары"""
+    await Database.add_user(user_id, f"user{user_id}", "Bench")
+    list_id = await Database.get_or_create_list(user_id)
+    for i in range(5):
+        await Database.add_product(list_id, f"Продукт {i}", '1')
+
+    for click in range(clicks):
+        # Клик "Мой список" - два обращения к базе
+        with timed(samples):
+            list_id = await Database.get_or_create_list(user_id)
+            products = await Database.get_products(list_id)
+
+        with timed(samples):
+            await Database.toggle_product_bought(products[click % len(products)]['id'])
+
+
+async def run(label: str, backend, users: int, clicks: int, user_offset: int):
+    shard = database.shards[0]
+    shard.pool = backend
+    shard.write_queue = CommitPerWrite(backend)
+    await backend.open()
+    samples: List[float] = []
+    try:
+        await asyncio.gather(*(
+            simulate_user(user_offset + u, clicks, samples) for u in range(users)
+        ))
+    finally:
+        await backend.close()
+    print_summary(label, latency_summary(samples))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--clicks', type=int, default=25)
+    args = parser.parse_args()
+
+    # Схему создаем без профиля PRAGMA: режим WAL сохраняется в файле базы
+    # и включится только на последнем прогоне
+    database.shards[0].pool = ConnectionPool(DATABASE_URL, DB_READERS)
+    await init_db()
+    await database.shards[0].pool.close()
+
+    print(f"👥 Пользователей: {args.users}, кликов на пользователя: {args.clicks}")
+    await run("соединение на вызов", ConnectionPerCall(DATABASE_URL), args.users, args.clicks, 1_000)
+    await run("пул, без PRAGMA", ConnectionPool(DATABASE_URL, DB_READERS),
+              args.users, args.clicks, 2_000)
+    await run(f"пул, WAL + {DB_READERS} читателя", ConnectionPool(DATABASE_URL, DB_READERS, SQLITE_PRAGMAS),
+              args.users, args.clicks, 3_000)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
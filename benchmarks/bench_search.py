@@ -0,0 +1,56 @@
+"""
+Подсказки товаров (inline-режим): задержка поиска по префиксу в словаре
+FTS5 при тысячах прошлых товаров у каждого из многих пользователей.
+
+    python -m benchmarks.bench_search --users 50 --names 3000
+"""
+import argparse
+import asyncio
+import random
+from typing import List
+
+from benchmarks._common import latency_summary, print_summary, timed
+
+import database
+from database import Database, init_db, close_db
+
+WORDS = ['Молоко', 'Молочный', 'Сыр', 'Хлеб', 'Творог', 'Кефир', 'Яблоки', 'Печенье', 'Паста', 'Помидоры']
+PREFIXES = ['м', 'мол', 'молоч', 'сыр 1', 'п', 'пече', 'т', 'хлеб 2', 'кеф', 'ябл']
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--names', type=int, default=3000, help="прошлых товаров на пользователя")
+    parser.add_argument('--queries', type=int, default=2000)
+    args = parser.parse_args()
+
+    await init_db()
+    list_ids = []
+    for user_id in range(1, args.users + 1):
+        list_id = await Database.get_or_create_list(user_id)
+        names = [f"{WORDS[i % len(WORDS)]} {i}" for i in range(args.names)]
+        for start in range(0, len(names), 300):
+            await Database.add_multiple_products(
+                list_id, [{'name': name, 'quantity': '1'} for name in names[start:start + 300]]
+            )
+        # В списке остаются только подсказки - товары уходят в историю
+        await Database.clear_all_products(list_id)
+        list_ids.append(list_id)
+
+    print(f"👥 Пользователей: {args.users}, названий у каждого: {args.names}")
+    for cached in (False, True):
+        samples: List[float] = []
+        for _ in range(args.queries):
+            list_id = random.choice(list_ids)
+            if not cached:
+                database.products_cache.invalidate(list_id)
+            with timed(samples):
+                await Database.search_product_names(list_id, random.choice(PREFIXES))
+        print_summary("поиск из кэша" if cached else "поиск в FTS5", latency_summary(samples))
+
+    await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+Пропускная способность записи при нескольких процессах бота:
+одна база против N шардов по хэшу user_id.
+
+Каждый процесс - отдельный экземпляр Database со своими пулами; процессы
+одновременно добавляют товары своим пользователям. С одним файлом все они
+ждут одну блокировку записи SQLite, с шардами - только процессы,
+попавшие в один файл.
+
+    python -m benchmarks.bench_shards --processes 4 --shards 1 2 4 --synchronous FULL
+
+Прирост пропускной способности шардами этот бенчмарк пока не подтвердил:
+на машине с одним ядром 4 процесса с synchronous=FULL дали x0.81 для 2 шардов
+и x0.66 для 4 шардов к одной базе - запись упирается в процессор, а лишние
+файлы только добавляют fsync. Шарды разделяют блокировку записи между
+пользователями; имеет ли это смысл по скорости, нужно проверять этим же
+запуском на многоядерной машине с медленным диском.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+
+from benchmarks._common import BENCH_DIR
+
+
+def configure(database_url: str, shards: int, synchronous: str):
+    # Окружение задаем до импорта config: каждый процесс читает свое число шардов
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['DATABASE_SHARDS'] = str(shards)
+    os.environ['SQLITE_SYNCHRONOUS'] = synchronous
+
+
+def worker(database_url: str, shards: int, synchronous: str, user_ids: list, writes: int, barrier, results):
+    configure(database_url, shards, synchronous)
+    asyncio.run(run_worker(user_ids, writes, barrier, results))
+
+
+async def run_worker(user_ids: list, writes: int, barrier, results):
+    from database import Database, init_db, close_db
+
+    await init_db()
+    list_ids = [await Database.get_or_create_list(user_id) for user_id in user_ids]
+
+    async def family_member(list_id: int):
+        for i in range(writes):
+            await Database.add_product(list_id, f"Продукт {i}", '1')
+
+    # Все процессы начинают запись одновременно
+    barrier.wait()
+    started = time.monotonic()
+    await asyncio.gather(*(family_member(list_id) for list_id in list_ids))
+    results.put((started, time.monotonic()))
+
+    await close_db()
+
+
+def prepare(database_url: str, shards: int, synchronous: str):
+    """Создать схему во всех шардах до старта процессов, чтобы миграции не гонялись"""
+    configure(database_url, shards, synchronous)
+
+    async def run():
+        from database import init_db, close_db
+        await init_db()
+        await close_db()
+
+    asyncio.run(run())
+
+
+def measure(shards: int, processes: int, users: int, writes: int, synchronous: str) -> float:
+    context = multiprocessing.get_context('spawn')
+    database_url = os.path.join(BENCH_DIR, f'shards{shards}', 'shopping.db')
+    os.makedirs(os.path.dirname(database_url), exist_ok=True)
+
+    setup = context.Process(target=prepare, args=(database_url, shards, synchronous))
+    setup.start()
+    setup.join()
+
+    barrier = context.Barrier(processes)
+    results = context.Queue()
+    workers = [
+        context.Process(target=worker, args=(
+            database_url, shards, synchronous,
+            list(range(p * users + 1, (p + 1) * users + 1)),
+            writes, barrier, results
+        ))
+        for p in range(processes)
+    ]
+    for process in workers:
+        process.start()
+
+    spans = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+
+    elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+    total = processes * users * writes
+    print(f"шардов: {shards:<3} {total} записей за {elapsed:.2f}с = {total / elapsed:,.0f} оп/с")
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--users', type=int, default=20, help="пользователей на процесс")
+    parser.add_argument('--writes', type=int, default=50, help="добавлений товара на пользователя")
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--synchronous', default='NORMAL',
+                        help="PRAGMA synchronous (FULL - каждый commit ждет fsync)")
+    args = parser.parse_args()
+
+    print(f"⚙️ Процессов: {args.processes}, пользователей на процесс: {args.users}, "
+          f"записей: {args.writes}, synchronous={args.synchronous}")
+    baseline = None
+    for shards in args.shards:
+        throughput = measure(shards, args.processes, args.users, args.writes, args.synchronous)
+        baseline = baseline or throughput
+        print(f"   x{throughput / baseline:.2f} к первому прогону")
+
+
+if __name__ == '__main__':
+    main()
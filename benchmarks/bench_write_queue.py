@@ -0,0 +1,74 @@
+"""
+Пропускная способность записи при одновременных отметках товаров:
+commit на каждое изменение против групповой фиксации (WriteQueue).
+
+    python -m benchmarks.bench_write_queue --users 50 --toggles 40 --synchronous FULL
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks._common import CommitPerWrite
+
+import database
+from config import DATABASE_URL, DB_READERS, SQLITE_PRAGMAS, DB_WRITE_BATCH_WINDOW_MS, DB_WRITE_BATCH_MAX
+from database import Database, init_db, close_db
+from storage.pool import ConnectionPool
+from storage.write_queue import WriteQueue
+
+
+async def prepare_users(users: int, products_per_user: int) -> list:
+    product_ids = []
+    for user_id in range(1, users + 1):
+        await Database.add_user(user_id, f"user{user_id}", "Bench")
+        list_id = await Database.get_or_create_list(user_id)
+        for i in range(products_per_user):
+            await Database.add_product(list_id, f"Продукт {i}", '1')
+        product_ids.append([p['id'] for p in await Database.get_products(list_id)])
+    return product_ids
+
+
+async def run(label: str, writes, product_ids: list, toggles: int):
+    database.shards[0].write_queue = writes
+
+    async def family_member(ids):
+        for i in range(toggles):
+            await Database.toggle_product_bought(ids[i % len(ids)])
+
+    started = time.perf_counter()
+    await asyncio.gather(*(family_member(ids) for ids in product_ids))
+    elapsed = time.perf_counter() - started
+    await writes.stop()
+
+    total = len(product_ids) * toggles
+    print(f"{label:<28} {total} изменений за {elapsed:.2f}с = {total / elapsed:,.0f} оп/с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--toggles', type=int, default=40)
+    parser.add_argument('--synchronous', default=SQLITE_PRAGMAS['synchronous'],
+                        help="PRAGMA synchronous для прогона (FULL показывает стоимость fsync)")
+    args = parser.parse_args()
+
+    pragmas = dict(SQLITE_PRAGMAS, synchronous=args.synchronous)
+    shard = database.shards[0]
+    shard.pool = ConnectionPool(DATABASE_URL, DB_READERS, pragmas)
+    shard.write_queue = WriteQueue(shard.pool, DB_WRITE_BATCH_WINDOW_MS / 1000, DB_WRITE_BATCH_MAX)
+
+    await init_db()
+    product_ids = await prepare_users(args.users, 5)
+    await shard.write_queue.stop()
+
+    print(f"👥 Участников: {args.users}, отметок на участника: {args.toggles}, synchronous={args.synchronous}")
+    await run("commit на каждое изменение", CommitPerWrite(shard.pool), product_ids, args.toggles)
+    await run("групповая фиксация",
+              WriteQueue(shard.pool, DB_WRITE_BATCH_WINDOW_MS / 1000, DB_WRITE_BATCH_MAX),
+              product_ids, args.toggles)
+
+    await close_db()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
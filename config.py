@@ -24,4 +24,124 @@ if not BOT_TOKEN:
 if not PERPLEXITY_API_KEY:
     print("⚠️ PERPLEXITY_API_KEY не найден - AI функции будут недоступны")
 
-DATABASE_URL = os.getenv("DATABASE_URL", "shopping.db")
\ No newline at end of file
+DATABASE_URL = os.getenv("DATABASE_URL", "shopping.db")
+
+# Число файлов SQLite, между которыми распределяются пользователи (хэш user_id).
+# По умолчанию 1 - одна база DATABASE_URL; шарды включаются только явно. Прироста
+# скорости они пока не показали: benchmarks/bench_shards (4 процесса, 1 ядро,
+# synchronous=FULL) дал x0.81 для 2 шардов и x0.66 для 4 к одной базе - включайте
+# после замера на своей машине. После включения шардов или смены их числа (в том
+# числе уменьшения) init_db переносит сохраненных пользователей в их шарды,
+# предварительно сняв снимки всех файлов.
+DATABASE_SHARDS = max(1, int(os.getenv("DATABASE_SHARDS", "1")))
+
+# Пул соединений с SQLite: одно соединение-писатель и несколько читателей
+DB_READERS = int(os.getenv("DB_READERS", "3"))
+
+# Движок доступа к SQLite:
+#   aiosqlite - поток на соединение, каждый execute/fetch - отдельный переход в поток;
+#   sqlite3   - общий пул потоков, операция Database целиком выполняется за один переход
+DB_ENGINE = os.getenv("DB_ENGINE", "aiosqlite")
+if DB_ENGINE not in ("aiosqlite", "sqlite3"):
+    raise ValueError(f"❌ Неизвестный DB_ENGINE: {DB_ENGINE} (допустимо: aiosqlite, sqlite3)")
+
+# Кэш подготовленных выражений на соединение движка sqlite3 (в sqlite3 по умолчанию 128)
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+
+# Профиль PRAGMA, применяемый к каждому соединению SQLite
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    'synchronous': os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    'busy_timeout': int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    'mmap_size': int(os.getenv("SQLITE_MMAP_SIZE", str(64 * 1024 * 1024))),
+    'cache_size': int(os.getenv("SQLITE_CACHE_SIZE", "-16000")),  # отрицательное значение - в КиБ
+    'temp_store': os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# Групповая фиксация изменений: окно сбора и максимальный размер пачки
+DB_WRITE_BATCH_WINDOW_MS = float(os.getenv("DB_WRITE_BATCH_WINDOW_MS", "2"))
+DB_WRITE_BATCH_MAX = int(os.getenv("DB_WRITE_BATCH_MAX", "100"))
+
+# Сколько списков держать в кэше продуктов (вытеснение LRU)
+PRODUCTS_CACHE_MAX_LISTS = int(os.getenv("PRODUCTS_CACHE_MAX_LISTS", "1000"))
+# Сколько чтений одного списка (страницы, префиксы поиска) держать в кэше (вытеснение LRU)
+PRODUCTS_CACHE_MAX_KEYS = int(os.getenv("PRODUCTS_CACHE_MAX_KEYS", "32"))
+
+# Сколько пользователей держать в кэше user_id -> list_id (вытеснение LRU)
+LIST_CACHE_MAX_USERS = int(os.getenv("LIST_CACHE_MAX_USERS", "10000"))
+
+# Архив покупок: купленные товары через ARCHIVE_AFTER_HOURS после отметки переносятся
+# из products в purchase_history фоновой задачей пачками по ARCHIVE_BATCH_SIZE
+ARCHIVE_AFTER_HOURS = float(os.getenv("ARCHIVE_AFTER_HOURS", "24"))
+ARCHIVE_INTERVAL_SEC = float(os.getenv("ARCHIVE_INTERVAL_SEC", "600"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+# Снимки базы онлайн-бэкапом SQLite: каталог, период (0 - только по команде /backup),
+# сколько последних снимков хранить и сжимать ли их gzip
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(DATABASE_URL) or ".", "backups"))
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_COMPRESS = os.getenv("BACKUP_COMPRESS", "1").lower() in ("1", "true", "yes")
+# Копирование порциями: страниц за шаг и пауза между шагами, чтобы не задерживать запись
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))
+BACKUP_STEP_PAUSE_MS = float(os.getenv("BACKUP_STEP_PAUSE_MS", "5"))
+
+# Обслуживание базы (incremental_vacuum, ANALYZE, PRAGMA optimize): период проверки,
+# сколько секунд без записей считать простоем и максимум страниц за один проход (0 - все)
+MAINTENANCE_INTERVAL_SEC = float(os.getenv("MAINTENANCE_INTERVAL_SEC", "3600"))
+MAINTENANCE_IDLE_SEC = float(os.getenv("MAINTENANCE_IDLE_SEC", "30"))
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", "2000"))
+
+# Общие списки: изменения копятся FANOUT_COALESCE_MS и расходятся по открытым экранам
+# участников одной правкой на экран, не чаще FANOUT_EDITS_PER_SEC правок в секунду на бота
+# (Telegram ограничивает бота примерно 30 сообщениями в секунду)
+FANOUT_COALESCE_MS = float(os.getenv("FANOUT_COALESCE_MS", "1500"))
+FANOUT_EDITS_PER_SEC = float(os.getenv("FANOUT_EDITS_PER_SEC", "20"))
+
+# Журнал изменений списков в памяти: событий на список и сколько списков хранить (вытеснение LRU)
+LIST_EVENTS_PER_LIST = int(os.getenv("LIST_EVENTS_PER_LIST", "100"))
+LIST_EVENTS_MAX_LISTS = int(os.getenv("LIST_EVENTS_MAX_LISTS", "1000"))
+
+# Кэш ответов AI: LRU в памяти на AI_CACHE_MAX_ENTRIES ответов и копия в файле SQLite
+# AI_CACHE_PATH (пустое значение - только память), чтобы ответы переживали перезапуск
+AI_CACHE_MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "500"))
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", os.path.join(os.path.dirname(DATABASE_URL) or ".", "ai_cache.db"))
+AI_CACHE_MAX_PERSISTED = int(os.getenv("AI_CACHE_MAX_PERSISTED", "5000"))
+# Срок жизни ответа по намерению вопроса (часы, 0 - не кэшировать): рецепт не меняется неделями,
+# а ответы про сезон, цены и акции (AI_CACHE_FRESH_TTL_HOURS) быстро устаревают
+AI_CACHE_TTL_HOURS = {
+    intent: float(os.getenv(f"AI_CACHE_TTL_{intent.upper()}_HOURS", default))
+    for intent, default in (('recipe', '168'), ('advice', '72'), ('shopping', '24'), ('general', '12'))
+}
+AI_CACHE_FRESH_TTL_HOURS = float(os.getenv("AI_CACHE_FRESH_TTL_HOURS", "6"))
+
+# Модели Perplexity по порядку подстраховки: основная и запасные
+AI_MODELS = [model.strip() for model in os.getenv(
+    "AI_MODELS", "sonar-pro,sonar,sonar-reasoning,sonar-deep-research"
+).split(",") if model.strip()]
+# Если основная модель не ответила за AI_HEDGE_DELAY_SEC, параллельно спрашиваем следующую;
+# берем первый хороший ответ. Таймаут каждой модели (AI_MODEL_TIMEOUTS="sonar=15,sonar-pro=25",
+# по умолчанию AI_MODEL_TIMEOUT_SEC) и общий бюджет вопроса AI_TOTAL_BUDGET_SEC
+AI_HEDGE_DELAY_SEC = float(os.getenv("AI_HEDGE_DELAY_SEC", "4"))
+AI_MODEL_TIMEOUT_SEC = float(os.getenv("AI_MODEL_TIMEOUT_SEC", "20"))
+AI_MODEL_TIMEOUTS = {
+    model.strip(): float(seconds)
+    for model, seconds in (
+        item.split("=", 1) for item in os.getenv(
+            "AI_MODEL_TIMEOUTS", "sonar-pro=25,sonar=15,sonar-reasoning=25,sonar-deep-research=30"
+        ).split(",") if "=" in item
+    )
+}
+AI_TOTAL_BUDGET_SEC = float(os.getenv("AI_TOTAL_BUDGET_SEC", "30"))
+
+# Потоковый ответ AI: заглушка сразу и ее правки накопленным текстом не чаще раза в
+# AI_STREAM_EDIT_INTERVAL_SEC (Telegram ограничивает частоту правок в одном чате)
+AI_STREAM = os.getenv("AI_STREAM", "1").lower() in ("1", "true", "yes")
+AI_STREAM_EDIT_INTERVAL_SEC = float(os.getenv("AI_STREAM_EDIT_INTERVAL_SEC", "1.2"))
+
+# Очередь к AI: не больше AI_MAX_CONCURRENT запросов к API одновременно, ожидающие
+# получают место по кругу между пользователями. Сверх AI_MAX_QUEUED вопросов в очереди
+# и AI_MAX_PER_USER вопросов одного пользователя новые вопросы отклоняются сразу
+AI_MAX_CONCURRENT = int(os.getenv("AI_MAX_CONCURRENT", "4"))
+AI_MAX_QUEUED = int(os.getenv("AI_MAX_QUEUED", "50"))
+AI_MAX_PER_USER = int(os.getenv("AI_MAX_PER_USER", "2"))
@@ -1,191 +1,796 @@
-import aiosqlite
-from typing import List, Optional, Dict
-from config import DATABASE_URL
+import asyncio
+import os
+import secrets
+import time
+from typing import Callable, List, Optional, Dict, Sequence, Tuple
+from config import (
+    DATABASE_URL, DATABASE_SHARDS, DB_ENGINE, DB_READERS, SQLITE_CACHED_STATEMENTS, SQLITE_PRAGMAS, DB_WRITE_BATCH_WINDOW_MS, DB_WRITE_BATCH_MAX,
+    PRODUCTS_CACHE_MAX_LISTS, PRODUCTS_CACHE_MAX_KEYS, LIST_CACHE_MAX_USERS, ARCHIVE_AFTER_HOURS, ARCHIVE_INTERVAL_SEC, ARCHIVE_BATCH_SIZE,
+    BACKUP_DIR, BACKUP_INTERVAL_HOURS, BACKUP_KEEP, BACKUP_COMPRESS, BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE_MS,
+    MAINTENANCE_INTERVAL_SEC, MAINTENANCE_IDLE_SEC, MAINTENANCE_VACUUM_PAGES, LIST_EVENTS_MAX_LISTS, LIST_EVENTS_PER_LIST
+)
+from storage import backup, list_stats, maintenance, rebalance
+from storage.cache import ListCache, LRUCache
+from storage.change_feed import ChangeFeed, ListEvent
+from storage.migrations import migrate
+from storage.pool import ConnectionPool
+from storage.products import COUNT_PRODUCT_NAME, INSERT_PRODUCT, RESTORE_DELETE, RESTORE_PRODUCTS, product_row
+from storage.shards import Shard, ShardRouter, reserve_id_range, shard_path
+from storage.threaded_pool import ThreadedPool
+from storage.write_queue import WriteQueue
+from utils.periodic import PeriodicTask
+from utils.product_parser import normalize_name
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+
+def _create_shard(index: int) -> Shard:
+    # Пул соединений шарда и очередь изменений продуктов с групповой фиксацией поверх его писателя
+    path = shard_path(DATABASE_URL, index)
+    if DB_ENGINE == 'sqlite3':
+        shard_pool = ThreadedPool(path, DB_READERS, SQLITE_PRAGMAS, SQLITE_CACHED_STATEMENTS)
+    else:
+        shard_pool = ConnectionPool(path, DB_READERS, SQLITE_PRAGMAS)
+    return Shard(index, shard_pool, WriteQueue(shard_pool, DB_WRITE_BATCH_WINDOW_MS / 1000, DB_WRITE_BATCH_MAX))
+
+
+# Файлы базы: открываются в init_db, закрываются в close_db.
+# При DATABASE_SHARDS = 1 это единственная база DATABASE_URL.
+shards = ShardRouter([_create_shard(index) for index in range(DATABASE_SHARDS)])
+
+# Кэш содержимого списков; каждое изменение списка сбрасывает его запись
+products_cache = ListCache('db.products_cache', PRODUCTS_CACHE_MAX_LISTS, PRODUCTS_CACHE_MAX_KEYS)
+
+# Журнал изменений списков: читатели забирают только события после последнего увиденного номера
+list_events = ChangeFeed('db.list_events', LIST_EVENTS_MAX_LISTS, LIST_EVENTS_PER_LIST)
+
+# Кому сообщать об изменении списка (например, рассылка обновлений участникам общего списка).
+# Обработчик получает list_id, вызывается синхронно и не должен ждать ввода-вывода
+list_change_listeners: List[Callable[[int], None]] = []
+
+DEFAULT_LIST_NAME = 'Основной список'
+
+# Длина кода приглашения в байтах (в ссылке - 12 символов base64)
+INVITE_CODE_BYTES = 9
+
+# Кэш (user_id, название списка) -> list_id, прогревается при запуске
+list_ids_cache = LRUCache('db.list_ids_cache', LIST_CACHE_MAX_USERS)
+
+# Незавершенные поиски списка: одновременные первые запросы пользователя ждут один результат
+_pending_list_lookups: Dict[tuple, asyncio.Future] = {}
+
+# Общий список, к которому присоединился пользователь (строка участника лежит в шарде пользователя).
+# Общий список у пользователя один: присоединение к новому выводит из прежнего
+_SHARED_LIST_QUERY = (
+    "SELECT list_id FROM list_members WHERE user_id = {user_id} AND role = 'member' "
+    "ORDER BY joined_at DESC LIMIT 1"
+)
+
+# Ключ позиции товара в списке: (is_bought, added_at, id)
+PageKey = Tuple[int, str, int]
+
+# Товары после ключа в порядке списка: остаток той же группы (купленные/некупленные)
+# ищется по индексу строковым сравнением, следующая группа - отдельным диапазоном
+_PAGE_FORWARD_QUERY = '''
+                      SELECT *
+                      FROM (SELECT id, name, quantity, is_bought, added_at
+                            FROM products
+                            WHERE list_id = :list_id AND is_bought = :is_bought
+                              AND (added_at, id) < (:added_at, :id)
+                            ORDER BY added_at DESC, id DESC
+                            LIMIT :limit)
+                      UNION ALL
+                      SELECT *
+                      FROM (SELECT id, name, quantity, is_bought, added_at
+                            FROM products
+                            WHERE list_id = :list_id AND is_bought > :is_bought
+                            ORDER BY is_bought ASC, added_at DESC, id DESC
+                            LIMIT :limit)
+                      ORDER BY is_bought ASC, added_at DESC, id DESC
+                      LIMIT :limit
+                      '''
+
+# Товары перед ключом, от ближайшего к началу списка
+_PAGE_BACKWARD_QUERY = '''
+                       SELECT *
+                       FROM (SELECT id, name, quantity, is_bought, added_at
+                             FROM products
+                             WHERE list_id = :list_id AND is_bought = :is_bought
+                               AND (added_at, id) > (:added_at, :id)
+                             ORDER BY added_at ASC, id ASC
+                             LIMIT :limit)
+                       UNION ALL
+                       SELECT *
+                       FROM (SELECT id, name, quantity, is_bought, added_at
+                             FROM products
+                             WHERE list_id = :list_id AND is_bought < :is_bought
+                             ORDER BY is_bought DESC, added_at ASC, id ASC
+                             LIMIT :limit)
+                       ORDER BY is_bought DESC, added_at ASC, id ASC
+                       LIMIT :limit
+                       '''
+
+
+def _list_changed(list_id: int, kind: str, product_id: Optional[int] = None,
+                  is_bought: Optional[bool] = None, count: int = 1):
+    """Список изменился: записать событие в журнал, сбросить кэш и сообщить подписчикам"""
+    list_events.append(list_id, kind, product_id, is_bought, count)
+    products_cache.invalidate(list_id)
+    for listener in list_change_listeners:
+        try:
+            listener(list_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработчика изменения списка {list_id}: {e}")
+
+
+# Некупленный товар с тем же названием в том же списке: снять отметку с купленного
+# простым UPDATE нельзя - два некупленных с одним названием запрещает уникальный индекс
+_UNBOUGHT_TWIN = (
+    'SELECT 1 FROM products AS unbought WHERE unbought.list_id = products.list_id '
+    'AND unbought.normalized_name = products.normalized_name AND unbought.is_bought = 0'
+)
+
+# Первый по id купленный товар с тем же названием
+_FIRST_BOUGHT_TWIN = (
+    'SELECT MIN(bought.id) FROM products AS bought WHERE bought.list_id = products.list_id '
+    'AND bought.normalized_name = products.normalized_name AND bought.is_bought = 1'
+)
+
+# Столбцы товара, которые сохраняются в purchase_history
+_ARCHIVED_COLUMNS = 'list_id, name, quantity, amount, unit, added_at, bought_at'
+
+
+async def _archive_rows(db, rows) -> int:
+    """Дописать удаленные из products купленные товары в историю покупок"""
+    if rows:
+        await db.executemany(
+            'INSERT INTO purchase_history (list_id, name, quantity, amount, unit, added_at, bought_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))',
+            rows
+        )
+    return len(rows)
+
+
 async def init_db():
-    """Инициализация базы данных с таблицами"""
+    """Инициализация базы данных: пулы соединений и миграции схемы каждого шарда"""
     try:
-        async with aiosqlite.connect(DATABASE_URL) as db:
-            # Включаем поддержку внешних ключей
-            await db.execute('PRAGMA foreign_keys = ON')
-
-            # Таблица пользователей
-            await db.execute('''
-                             CREATE TABLE IF NOT EXISTS users
-                             (
-                                 user_id    INTEGER PRIMARY KEY,
-                                 username   TEXT,
-                                 first_name TEXT,
-                                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                             )
-                             ''')
-
-            # Таблица списков покупок
-            await db.execute('''
-                             CREATE TABLE IF NOT EXISTS shopping_lists
-                             (
-                                 id         INTEGER PRIMARY KEY AUTOINCREMENT,
-                                 user_id    INTEGER NOT NULL,
-                                 name       TEXT      DEFAULT 'Основной список',
-                                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                 FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-                             )
-                             ''')
-
-            # Таблица продуктов
-            await db.execute('''
-                             CREATE TABLE IF NOT EXISTS products
-                             (
-                                 id        INTEGER PRIMARY KEY AUTOINCREMENT,
-                                 list_id   INTEGER NOT NULL,
-                                 name      TEXT    NOT NULL,
-                                 quantity  TEXT      DEFAULT '1',
-                                 is_bought INTEGER   DEFAULT 0,
-                                 added_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                                 FOREIGN KEY (list_id) REFERENCES shopping_lists (id) ON DELETE CASCADE
-                             )
-                             ''')
+        for shard in shards:
+            await shard.pool.open()
 
-            await db.commit()
-            logger.info("✅ База данных инициализирована")
+            async def prepare(db) -> int:
+                # Создаем или обновляем схему на месте
+                version = await migrate(db)
+                await reserve_id_range(db, shard.index)
+                return version
+
+            version = await shard.pool.write(prepare)
+
+            logger.info(f"✅ База данных {shard.pool.path} инициализирована (схема v{version})")
+
+        await rebalance_shards()
+        await warm_list_cache()
 
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации БД: {e}")
         raise
 
 
+async def rebalance_shards() -> int:
+    """Перенести пользователей, лежащих не в своем шарде, в шард по их хэшу; вернуть их число.
+
+    Нужно после включения шардов в существующей базе или смены их числа: иначе
+    такие пользователи попали бы в пустой шард и "потеряли" списки. Файлы
+    шардов с номером DATABASE_SHARDS и выше (число шардов уменьшили) тоже
+    открываются, и все их пользователи переезжают в оставшиеся шарды. Перед
+    переносом снимаются снимки всех файлов.
+    """
+    retired = []
+    while os.path.exists(shard_path(DATABASE_URL, len(shards) + len(retired))):
+        retired.append(_create_shard(len(shards) + len(retired)))
+
+    try:
+        plan = []
+        # При одном шарде все пользователи дома - читаем только лишние файлы
+        sources = [*shards, *retired] if len(shards) > 1 else retired
+        for shard in sources:
+            if shard in retired:
+                await shard.pool.open()
+                await shard.pool.write(migrate)
+
+            async def find(db, index=shard.index):
+                return await rebalance.misplaced_users(db, index, len(shards))
+
+            homes = await shard.pool.read(find)
+            plan.extend((shard, user_id, home) for user_id, home in homes.items())
+
+        if plan:
+            logger.warning(f"🔀 Пользователей не в своем шарде: {len(plan)}, переносим (перед этим - снимок баз)")
+            await backup_databases(extra_shards=retired)
+
+        for shard, user_id, home in plan:
+            async def move(db, user_id=user_id, home=home, index=shard.index):
+                return await rebalance.move_user(db, shards[home].pool.path, user_id, index, len(shards))
+
+            await shard.pool.write(move)
+
+        for shard in retired:
+            logger.warning(
+                f"🗄 Файл {shard.pool.path} вне DATABASE_SHARDS={len(shards)} пуст, его можно удалить"
+            )
+    finally:
+        for shard in retired:
+            await shard.pool.close()
+
+    # Строки участников общих списков в других шардах ссылаются на старые id. Журнал
+    # переноса очищается только после перенумерации во всех шардах: прерванный
+    # запуск доделает ее при следующем
+    remap = {}
+    for shard in shards:
+        remap.update(await shard.pool.read(rebalance.moved_lists))
+    if remap:
+        async def renumber(db):
+            return await rebalance.remap_lists(db, remap)
+
+        for shard in shards:
+            await shard.pool.write(renumber)
+        for shard in shards:
+            await shard.pool.write(rebalance.forget_moved_lists)
+
+    if plan or remap:
+        logger.info(f"🔀 Перенесено пользователей: {len(plan)}, списков: {len(remap)}")
+    return len(plan)
+
+
+async def warm_list_cache():
+    """Прогреть кэш основных списков последними активными пользователями"""
+    async def recent_lists(db):
+        # Участник общего списка открывает общий список вместо своего
+        cursor = await db.execute(
+            f'''
+            SELECT user_id,
+                   COALESCE(({_SHARED_LIST_QUERY.format(user_id='l.user_id')}), MIN(id))
+            FROM shopping_lists l
+            WHERE name = ?
+            GROUP BY user_id
+            ORDER BY MAX(id) DESC
+            LIMIT ?
+            ''',
+            (DEFAULT_LIST_NAME, LIST_CACHE_MAX_USERS // len(shards) + 1)
+        )
+        return await cursor.fetchall()
+
+    rows = []
+    for shard in shards:
+        rows.extend(await shard.pool.read(recent_lists))
+
+    # Самые свежие кладем последними, чтобы они вытеснялись позже всех
+    for user_id, list_id in reversed(rows):
+        list_ids_cache.put((user_id, DEFAULT_LIST_NAME), list_id)
+
+    logger.info(f"🔥 Кэш списков прогрет: {len(rows)} пользователей")
+
+
+async def archive_bought_products(max_age_hours: float = ARCHIVE_AFTER_HOURS,
+                                  batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Перенести купленные давнее max_age_hours товары всех шардов в purchase_history.
+
+    Перенос идет пачками по batch_size в порядке bought_at: каждая пачка - одна
+    короткая операция очереди записи, поэтому изменения пользователей не ждут
+    конца всего архивирования.
+    """
+    async def archive_batch(db):
+        cursor = await db.execute(
+            f'''
+            DELETE FROM products
+            WHERE id IN (SELECT id
+                         FROM products
+                         WHERE is_bought = 1 AND bought_at < datetime('now', ?)
+                         ORDER BY bought_at, id
+                         LIMIT ?)
+            RETURNING {_ARCHIVED_COLUMNS}
+            ''',
+            (f'{-max_age_hours:+} hours', batch_size)
+        )
+        rows = await cursor.fetchall()
+        await _archive_rows(db, rows)
+        return {row[0] for row in rows}, len(rows)
+
+    archived = 0
+    for shard in shards:
+        while True:
+            list_ids, count = await shard.write_queue.submit(archive_batch)
+            for list_id in list_ids:
+                _list_changed(list_id, 'archive')
+            archived += count
+            if count < batch_size:
+                break
+
+    if archived:
+        logger.info(f"📦 В историю покупок перенесено товаров: {archived}")
+    return archived
+
+
+async def backup_databases(compress: bool = BACKUP_COMPRESS, extra_shards: Sequence[Shard] = ()) -> List[Dict]:
+    """Снять снимки всех шардов (и extra_shards) в BACKUP_DIR и удалить снимки сверх BACKUP_KEEP"""
+    snapshots = []
+    for shard in [*shards, *extra_shards]:
+        taken = await backup.snapshot(
+            shard.pool.path, BACKUP_DIR, BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE_MS / 1000, compress
+        )
+        removed = backup.prune_snapshots(BACKUP_DIR, shard.pool.path, BACKUP_KEEP)
+        logger.info(
+            f"💾 Снимок {taken['path']}: {taken['size'] / 1024:.0f} КиБ за {taken['seconds']:.2f} с"
+            + (f", удалено старых: {len(removed)}" if removed else "")
+        )
+        snapshots.append(taken)
+    return snapshots
+
+
+async def run_maintenance(idle_seconds: float = MAINTENANCE_IDLE_SEC) -> List[Dict]:
+    """Обслужить шарды, в которые не писали idle_seconds: вернуть свободные страницы и обновить статистику.
+
+    Занятые шарды пропускаются до следующего запуска, чтобы обслуживание
+    не задерживало запись пользователей.
+    """
+    async def maintain(db) -> Dict:
+        return await maintenance.run(db, MAINTENANCE_VACUUM_PAGES)
+
+    reports = []
+    for shard in shards:
+        if time.monotonic() - shard.write_queue.last_commit_at < idle_seconds:
+            logger.info(f"🧽 Обслуживание {shard.pool.path} отложено: база не простаивает")
+            continue
+
+        report = await shard.pool.write(maintain)
+        report['path'] = shard.pool.path
+        logger.info(
+            f"🧽 Обслуживание {shard.pool.path} за {report['seconds'] * 1000:.0f} мс: "
+            f"освобождено {report['reclaimed_pages']} страниц ({report['reclaimed_bytes'] / 1024:.0f} КиБ) "
+            f"за {report['vacuum_seconds'] * 1000:.0f} мс, свободных осталось {report['free_pages']}"
+        )
+        reports.append(report)
+    return reports
+
+
+# Фоновые задачи базы, запускаются в start_background_tasks
+archiver = PeriodicTask('db.archiver', ARCHIVE_INTERVAL_SEC, archive_bought_products)
+backup_task = PeriodicTask('db.backup', BACKUP_INTERVAL_HOURS * 3600, backup_databases)
+maintenance_task = PeriodicTask('db.maintenance', MAINTENANCE_INTERVAL_SEC, run_maintenance)
+
+
+def start_background_tasks():
+    """Запустить фоновые задачи базы (после init_db)"""
+    archiver.start()
+    maintenance_task.start()
+    if BACKUP_INTERVAL_HOURS > 0:
+        backup_task.start()
+
+
+async def close_db():
+    """Остановить фоновые задачи, дописать очереди изменений и закрыть пулы соединений всех шардов"""
+    await archiver.stop()
+    await backup_task.stop()
+    await maintenance_task.stop()
+    for shard in shards:
+        await shard.write_queue.stop()
+        await shard.pool.close()
+
+
 class Database:
     @staticmethod
     async def add_user(user_id: int, username: str = None, first_name: str = None):
         """Добавить пользователя в систему"""
-        try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                cursor = await db.execute(
-                    'SELECT user_id FROM users WHERE user_id = ?',
-                    (user_id,)
-                )
-                existing_user = await cursor.fetchone()
+        async def insert(db) -> int:
+            cursor = await db.execute(
+                'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?) '
+                'ON CONFLICT (user_id) DO NOTHING',
+                (user_id, username or '', first_name or 'Пользователь')
+            )
+            await db.commit()
+            return cursor.rowcount
 
-                if not existing_user:
-                    await db.execute(
-                        'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
-                        (user_id, username or '', first_name or 'Пользователь')
-                    )
-                    await db.commit()
-                    logger.info(f"👤 Пользователь {user_id} добавлен")
+        try:
+            if await shards.for_user(user_id).pool.write(insert) > 0:
+                logger.info(f"👤 Пользователь {user_id} добавлен")
 
         except Exception as e:
             logger.error(f"❌ Ошибка добавления пользователя: {e}")
 
     @staticmethod
-    async def get_or_create_list(user_id: int, list_name: str = 'Основной список') -> Optional[int]:
+    async def get_or_create_list(user_id: int, list_name: str = DEFAULT_LIST_NAME) -> Optional[int]:
         """Получить или создать список покупок"""
+        key = (user_id, list_name)
+
+        list_id = list_ids_cache.get(key)
+        if list_id is not None:
+            return list_id
+
+        # Первый запрос пользователя уже выполняется - ждем его результат
+        pending = _pending_list_lookups.get(key)
+        if pending is not None:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Отменен не этот вызов, а первый запрос - ищем список сами
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                return await Database.get_or_create_list(user_id, list_name)
+
+        future = asyncio.get_running_loop().create_future()
+        _pending_list_lookups[key] = future
         try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
+            list_id = await Database._find_or_create_list(user_id, list_name)
+        except asyncio.CancelledError:
+            # Ожидающие не должны ждать результата, которого не будет
+            future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка работы со списком: {e}")
+            list_id = None
+        finally:
+            del _pending_list_lookups[key]
+
+        if list_id is not None:
+            list_ids_cache.put(key, list_id)
+        future.set_result(list_id)
+        return list_id
+
+    @staticmethod
+    async def _find_or_create_list(user_id: int, list_name: str) -> int:
+        shard = shards.for_user(user_id)
+
+        async def find(db):
+            if list_name == DEFAULT_LIST_NAME:
+                # Основным списком участника семьи считается общий список
                 cursor = await db.execute(
-                    'SELECT id FROM shopping_lists WHERE user_id = ? AND name = ?',
-                    (user_id, list_name)
+                    f'''
+                    SELECT COALESCE(({_SHARED_LIST_QUERY.format(user_id=':user_id')}),
+                                    (SELECT id FROM shopping_lists WHERE user_id = :user_id AND name = :name))
+                    ''',
+                    {'user_id': user_id, 'name': list_name}
                 )
                 result = await cursor.fetchone()
+                return result if result[0] is not None else None
 
-                if result:
-                    return result[0]
+            cursor = await db.execute(
+                'SELECT id FROM shopping_lists WHERE user_id = ? AND name = ?',
+                (user_id, list_name)
+            )
+            return await cursor.fetchone()
 
-                cursor = await db.execute(
-                    'INSERT INTO shopping_lists (user_id, name) VALUES (?, ?)',
-                    (user_id, list_name)
-                )
-                await db.commit()
-                list_id = cursor.lastrowid
-                logger.info(f"📝 Создан список '{list_name}' для пользователя {user_id}")
-                return list_id
+        async def create(db):
+            # Список мог успеть создать другой обработчик - тогда уникальный индекс
+            # превращает вставку в обновление, и RETURNING отдает существующий id
+            cursor = await db.execute(
+                'INSERT INTO shopping_lists (user_id, name) VALUES (?, ?) '
+                'ON CONFLICT (user_id, name) DO UPDATE SET name = excluded.name '
+                'RETURNING id',
+                (user_id, list_name)
+            )
+            result = await cursor.fetchone()
+            await db.commit()
+            return result
+
+        result = await shard.pool.read(find)
+        if result:
+            return result[0]
+
+        result = await shard.pool.write(create)
+        logger.info(f"📝 Создан список '{list_name}' для пользователя {user_id}")
+        return result[0]
+
+    @staticmethod
+    async def get_invite_code(list_id: int) -> Optional[str]:
+        """Код приглашения в список (создается при первом запросе)"""
+        shard = shards.for_id(list_id)
+
+        async def select(db):
+            cursor = await db.execute('SELECT invite_code FROM shopping_lists WHERE id = ?', (list_id,))
+            return await cursor.fetchone()
+
+        async def create(db):
+            # Код мог успеть появиться - тогда COALESCE оставляет его
+            cursor = await db.execute(
+                'UPDATE shopping_lists SET invite_code = COALESCE(invite_code, ?) WHERE id = ? '
+                'RETURNING invite_code',
+                (secrets.token_urlsafe(INVITE_CODE_BYTES), list_id)
+            )
+            result = await cursor.fetchone()
+            await db.commit()
+            return result
+
+        try:
+            result = await shard.pool.read(select)
+            if result and result[0] is None:
+                result = await shard.pool.write(create)
+            return result[0] if result else None
 
         except Exception as e:
-            logger.error(f"❌ Ошибка работы со списком: {e}")
+            logger.error(f"❌ Ошибка кода приглашения: {e}")
             return None
 
+    @staticmethod
+    async def get_shared_list(user_id: int) -> Optional[int]:
+        """Общий список, к которому присоединился пользователь (None - пользователь ведет свой)"""
+        async def select(db):
+            cursor = await db.execute(_SHARED_LIST_QUERY.format(user_id='?'), (user_id,))
+            return await cursor.fetchone()
+
+        try:
+            result = await shards.for_user(user_id).pool.read(select)
+            return result[0] if result else None
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения общего списка: {e}")
+            return None
+
+    @staticmethod
+    async def join_list(user_id: int, list_id: int, invite_code: str) -> bool:
+        """Присоединить пользователя к чужому списку по коду приглашения"""
+        list_shard = shards.for_id(list_id)
+
+        async def check_code(db):
+            cursor = await db.execute(
+                'SELECT user_id FROM shopping_lists WHERE id = ? AND invite_code = ?',
+                (list_id, invite_code)
+            )
+            return await cursor.fetchone()
+
+        async def add_member(db):
+            await db.execute(
+                "INSERT OR IGNORE INTO list_members (list_id, user_id, role) VALUES (?, ?, 'member')",
+                (list_id, user_id)
+            )
+            await db.commit()
+
+        try:
+            owner = await list_shard.pool.read(check_code)
+            if not owner:
+                return False
+            if owner[0] == user_id or await Database.get_shared_list(user_id) == list_id:
+                return True
+
+            await Database.leave_list(user_id)
+            # Строка в шарде списка - для рассылки, в шарде пользователя - для поиска его списка
+            for shard in {list_shard, shards.for_user(user_id)}:
+                await shard.pool.write(add_member)
+
+            list_ids_cache.put((user_id, DEFAULT_LIST_NAME), list_id)
+            logger.info(f"👨‍👩‍👧 Пользователь {user_id} присоединился к списку {list_id}")
+            return True
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка присоединения к списку: {e}")
+            return False
+
+    @staticmethod
+    async def leave_list(user_id: int) -> Optional[int]:
+        """Выйти из общего списка и вернуться к своему, вернуть id покинутого списка"""
+        list_id = await Database.get_shared_list(user_id)
+        if list_id is None:
+            return None
+
+        async def remove_member(db):
+            await db.execute(
+                "DELETE FROM list_members WHERE list_id = ? AND user_id = ? AND role = 'member'",
+                (list_id, user_id)
+            )
+            await db.commit()
+
+        try:
+            for shard in {shards.for_id(list_id), shards.for_user(user_id)}:
+                await shard.pool.write(remove_member)
+            list_ids_cache.pop((user_id, DEFAULT_LIST_NAME))
+            logger.info(f"🚪 Пользователь {user_id} вышел из списка {list_id}")
+            return list_id
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка выхода из списка: {e}")
+            return None
+
+    @staticmethod
+    async def get_list_members(list_id: int) -> List[Dict]:
+        """Участники списка: сначала владелец, затем по времени присоединения"""
+        async def select(db):
+            cursor = await db.execute(
+                "SELECT user_id, role, joined_at FROM list_members WHERE list_id = ? "
+                "ORDER BY role = 'owner' DESC, joined_at",
+                (list_id,)
+            )
+            return await cursor.fetchall()
+
+        try:
+            rows = await shards.for_id(list_id).pool.read(select)
+            return [{'user_id': row[0], 'role': row[1], 'joined_at': row[2]} for row in rows]
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения участников списка: {e}")
+            return []
+
     @staticmethod
     async def add_product(list_id: int, name: str, quantity: str = '1'):
-        """Добавить продукт в список"""
+        """Добавить продукт в список (некупленный товар с тем же названием получает его количество)"""
+        row = product_row(list_id, name, quantity)
+
+        async def insert(db):
+            await db.execute(INSERT_PRODUCT, row)
+            await db.execute(COUNT_PRODUCT_NAME, row[:3])
+
         try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                await db.execute(
-                    'INSERT INTO products (list_id, name, quantity, is_bought) VALUES (?, ?, ?, 0)',
-                    (list_id, name.strip(), quantity.strip())
-                )
-                await db.commit()
-                logger.info(f"➕ Добавлен продукт: {name} ({quantity})")
+            await shards.for_id(list_id).write_queue.submit(insert)
+            _list_changed(list_id, 'add')
+            logger.info(f"➕ Добавлен продукт: {name} ({quantity})")
 
         except Exception as e:
             logger.error(f"❌ Ошибка добавления продукта: {e}")
 
     @staticmethod
-    async def add_multiple_products(list_id: int, products: List[Dict[str, str]]):
-        """Добавить несколько продуктов одновременно"""
+    async def add_multiple_products(list_id: int, products: List[Dict[str, str]]) -> int:
+        """Добавить несколько продуктов одновременно (одним executemany в одной транзакции, с тем же слиянием)"""
+        rows = [product_row(list_id, product['name'], product['quantity']) for product in products]
+
+        async def insert_all(db):
+            await db.executemany(INSERT_PRODUCT, rows)
+            await db.executemany(COUNT_PRODUCT_NAME, [row[:3] for row in rows])
+
         try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                for product in products:
-                    await db.execute(
-                        'INSERT INTO products (list_id, name, quantity, is_bought) VALUES (?, ?, ?, 0)',
-                        (list_id, product['name'].strip(), product['quantity'].strip())
-                    )
-                await db.commit()
-                logger.info(f"➕ Добавлено {len(products)} продуктов через AI")
+            await shards.for_id(list_id).write_queue.submit(insert_all)
+            _list_changed(list_id, 'add', count=len(rows))
+            logger.info(f"➕ Добавлено {len(rows)} продуктов в список {list_id}")
+            return len(rows)
 
         except Exception as e:
             logger.error(f"❌ Ошибка добавления множественных продуктов: {e}")
+            return 0
 
     @staticmethod
     async def get_products(list_id: int) -> List[Dict]:
         """Получить все продукты из списка"""
+        cached = products_cache.get(list_id)
+        if cached is not None:
+            return list(cached)
+
+        async def select(db):
+            cursor = await db.execute(
+                'SELECT id, name, quantity, is_bought FROM products WHERE list_id = ? ORDER BY is_bought ASC, added_at DESC, id DESC',
+                (list_id,)
+            )
+            return await cursor.fetchall()
+
         try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
+            version = products_cache.version(list_id)
+            rows = await shards.for_id(list_id).pool.read(select)
+
+            products = [
+                {
+                    'id': p[0],
+                    'name': p[1],
+                    'quantity': p[2],
+                    'is_bought': bool(p[3])
+                }
+                for p in rows
+            ]
+            products_cache.put(list_id, version, products)
+            return list(products)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения продуктов: {e}")
+            return []
+
+    @staticmethod
+    async def get_products_page(list_id: int, after_key: Optional[PageKey] = None, limit: int = 20,
+                                backward: bool = False) -> Dict:
+        """Страница продуктов списка по ключу (is_bought, added_at, id) без OFFSET.
+
+        after_key - ключ последнего товара предыдущей страницы (None - первая страница).
+        При backward=True передается ключ первого товара текущей страницы и
+        возвращается страница перед ним.
+
+        Результат: products, after_key (ключ товара перед страницей или None для первой)
+        и next_key (ключ последнего товара, если дальше есть еще товары).
+        """
+        cache_key = ('page', after_key, limit, backward)
+        cached = products_cache.get(list_id, cache_key)
+        if cached is not None:
+            return {**cached, 'products': list(cached['products'])}
+
+        async def select_page(db):
+            if backward and after_key is not None:
+                # Лишняя строка сверху - товар перед страницей, он станет ее after_key
+                cursor = await db.execute(_PAGE_BACKWARD_QUERY, Database._page_params(list_id, after_key, limit + 1))
+                rows = (await cursor.fetchall())[::-1]
+
+                if len(rows) <= limit:
+                    return rows, None, None
+                return rows[1:], Database._page_key(rows[0]), Database._page_key(rows[-1])
+
+            if after_key is None:
                 cursor = await db.execute(
-                    'SELECT id, name, quantity, is_bought FROM products WHERE list_id = ? ORDER BY is_bought ASC, added_at DESC',
-                    (list_id,)
+                    'SELECT id, name, quantity, is_bought, added_at FROM products WHERE list_id = ? '
+                    'ORDER BY is_bought ASC, added_at DESC, id DESC LIMIT ?',
+                    (list_id, limit + 1)
                 )
-                products = await cursor.fetchall()
+            else:
+                cursor = await db.execute(_PAGE_FORWARD_QUERY, Database._page_params(list_id, after_key, limit + 1))
+            rows = await cursor.fetchall()
+
+            # Лишняя строка снизу - признак следующей страницы
+            next_key = Database._page_key(rows[limit - 1]) if len(rows) > limit else None
+            return rows[:limit], after_key, next_key
 
-                return [
+        try:
+            version = products_cache.version(list_id)
+            rows, page_after_key, next_key = await shards.for_id(list_id).pool.read(select_page)
+
+            if backward and after_key is not None and page_after_key is None:
+                # Перед ключом меньше целой страницы - показываем начало списка
+                return await Database.get_products_page(list_id, None, limit)
+
+            page = {
+                'products': [
                     {
                         'id': p[0],
                         'name': p[1],
                         'quantity': p[2],
-                        'is_bought': bool(p[3])
+                        'is_bought': bool(p[3]),
+                        'key': Database._page_key(p)
                     }
-                    for p in products
-                ]
+                    for p in rows
+                ],
+                'after_key': page_after_key,
+                'next_key': next_key
+            }
+            products_cache.put(list_id, version, page, cache_key)
+            return {**page, 'products': list(page['products'])}
 
         except Exception as e:
-            logger.error(f"❌ Ошибка получения продуктов: {e}")
-            return []
+            logger.error(f"❌ Ошибка получения страницы продуктов: {e}")
+            return {'products': [], 'after_key': None, 'next_key': None}
+
+    @staticmethod
+    def _page_key(row) -> PageKey:
+        return int(row[3]), row[4], row[0]
+
+    @staticmethod
+    def _page_params(list_id: int, key: PageKey, limit: int) -> Dict:
+        is_bought, added_at, product_id = key
+        return {'list_id': list_id, 'is_bought': is_bought, 'added_at': added_at, 'id': product_id, 'limit': limit}
 
     @staticmethod
     async def toggle_product_bought(product_id: int) -> bool:
         """Переключить статус покупки продукта"""
+
+        async def toggle(db):
+            cursor = await db.execute(f'''
+                                      UPDATE products
+                                      SET is_bought = 1 - is_bought,
+                                          bought_at = CASE WHEN is_bought = 0 THEN CURRENT_TIMESTAMP END
+                                      WHERE id = ?
+                                        AND NOT (is_bought = 1 AND EXISTS ({_UNBOUGHT_TWIN}))
+                                      RETURNING list_id, is_bought
+                                      ''', (product_id,))
+            toggled = await cursor.fetchone()
+            if toggled is not None:
+                return toggled[0], toggled[1], False
+
+            # Товар возвращается в список, где уже есть некупленный с тем же названием, - сливаем их
+            await db.execute(RESTORE_PRODUCTS.format(where='id = ?'), (product_id,))
+            cursor = await db.execute(RESTORE_DELETE.format(where='id = ?'), (product_id,))
+            restored = await cursor.fetchone()
+            return (restored[0], 0, True) if restored else None
+
         try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                cursor = await db.execute(
-                    'SELECT is_bought FROM products WHERE id = ?',
-                    (product_id,)
-                )
-                result = await cursor.fetchone()
+            toggled = await shards.for_id(product_id).write_queue.submit(toggle)
 
-                if result:
-                    new_status = 1 if result[0] == 0 else 0
-                    await db.execute(
-                        'UPDATE products SET is_bought = ? WHERE id = ?',
-                        (new_status, product_id)
-                    )
-                    await db.commit()
-                    logger.info(f"🔄 Изменен статус продукта {product_id} на {bool(new_status)}")
-                    return True
+            if toggled is not None:
+                list_id, new_status, merged = toggled
+                _list_changed(list_id, 'merge' if merged else 'toggle', product_id, bool(new_status))
+                logger.info(f"🔄 Изменен статус продукта {product_id} на {bool(new_status)}")
+                return True
 
-                return False
+            return False
 
         except Exception as e:
             logger.error(f"❌ Ошибка изменения статуса: {e}")
@@ -194,18 +799,23 @@ class Database:
     @staticmethod
     async def delete_product(product_id: int) -> bool:
         """Удалить продукт из списка"""
+
+        async def delete(db):
+            cursor = await db.execute(
+                'DELETE FROM products WHERE id = ? RETURNING list_id',
+                (product_id,)
+            )
+            result = await cursor.fetchone()
+            return result[0] if result else None
+
         try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                cursor = await db.execute(
-                    'DELETE FROM products WHERE id = ?',
-                    (product_id,)
-                )
-                await db.commit()
+            list_id = await shards.for_id(product_id).write_queue.submit(delete)
 
-                if cursor.rowcount > 0:
-                    logger.info(f"🗑 Удален продукт {product_id}")
-                    return True
-                return False
+            if list_id is not None:
+                _list_changed(list_id, 'delete', product_id)
+                logger.info(f"🗑 Удален продукт {product_id}")
+                return True
+            return False
 
         except Exception as e:
             logger.error(f"❌ Ошибка удаления продукта: {e}")
@@ -213,31 +823,25 @@ class Database:
 
     @staticmethod
     async def clear_bought_products(list_id: int) -> int:
-        """Удалить все купленные продукты"""
-        try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                # Сначала проверяем, есть ли купленные товары
-                cursor = await db.execute(
-                    'SELECT COUNT(*) FROM products WHERE list_id = ? AND is_bought = 1',
-                    (list_id,)
-                )
-                count_result = await cursor.fetchone()
-                bought_count = count_result[0] if count_result else 0
+        """Удалить все купленные продукты (они переносятся в историю покупок)"""
 
-                if bought_count == 0:
-                    logger.info(f"ℹ️ Нет купленных товаров для удаления в списке {list_id}")
-                    return 0
+        async def clear_bought(db):
+            cursor = await db.execute(
+                f'DELETE FROM products WHERE list_id = ? AND is_bought = 1 RETURNING {_ARCHIVED_COLUMNS}',
+                (list_id,)
+            )
+            return await _archive_rows(db, await cursor.fetchall())
 
-                # Удаляем купленные товары
-                cursor = await db.execute(
-                    'DELETE FROM products WHERE list_id = ? AND is_bought = 1',
-                    (list_id,)
-                )
-                await db.commit()
+        try:
+            deleted_count = await shards.for_id(list_id).write_queue.submit(clear_bought)
+
+            if deleted_count == 0:
+                logger.info(f"ℹ️ Нет купленных товаров для удаления в списке {list_id}")
+                return 0
 
-                deleted_count = cursor.rowcount
-                logger.info(f"🧹 Удалено {deleted_count} купленных товаров из списка {list_id}")
-                return deleted_count
+            _list_changed(list_id, 'clear_bought', count=deleted_count)
+            logger.info(f"🧹 Удалено {deleted_count} купленных товаров из списка {list_id}")
+            return deleted_count
 
         except Exception as e:
             logger.error(f"❌ Ошибка очистки купленных товаров: {e}")
@@ -246,78 +850,254 @@ class Database:
     @staticmethod
     async def clear_all_products(list_id: int) -> int:
         """НОВОЕ: Удалить ВСЕ продукты из списка"""
-        try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                # Проверяем общее количество товаров
-                cursor = await db.execute(
-                    'SELECT COUNT(*) FROM products WHERE list_id = ?',
-                    (list_id,)
-                )
-                count_result = await cursor.fetchone()
-                total_count = count_result[0] if count_result else 0
 
-                if total_count == 0:
-                    logger.info(f"ℹ️ Список {list_id} уже пуст")
-                    return 0
+        async def clear_all(db):
+            cursor = await db.execute(
+                f'DELETE FROM products WHERE list_id = ? RETURNING is_bought, {_ARCHIVED_COLUMNS}',
+                (list_id,)
+            )
+            rows = await cursor.fetchall()
+            # Некупленные товары просто удаляются, купленные сохраняются в истории
+            await _archive_rows(db, [row[1:] for row in rows if row[0]])
+            return len(rows)
 
-                # Удаляем ВСЕ товары
-                cursor = await db.execute(
-                    'DELETE FROM products WHERE list_id = ?',
-                    (list_id,)
-                )
-                await db.commit()
+        try:
+            deleted_count = await shards.for_id(list_id).write_queue.submit(clear_all)
+
+            if deleted_count == 0:
+                logger.info(f"ℹ️ Список {list_id} уже пуст")
+                return 0
 
-                deleted_count = cursor.rowcount
-                logger.info(f"🗑 Удалено {deleted_count} товаров (весь список {list_id})")
-                return deleted_count
+            _list_changed(list_id, 'clear', count=deleted_count)
+            logger.info(f"🗑 Удалено {deleted_count} товаров (весь список {list_id})")
+            return deleted_count
 
         except Exception as e:
             logger.error(f"❌ Ошибка очистки всего списка: {e}")
             return 0
 
     @staticmethod
-    async def get_user_stats(user_id: int) -> Dict:
-        """Получить статистику пользователя"""
+    async def get_list_stats(list_id: int) -> Dict:
+        """Счетчики товаров списка (одно чтение по ключу из list_stats)"""
+        cached = products_cache.get(list_id, 'stats')
+        if cached is not None:
+            return dict(cached)
+
+        async def select(db):
+            cursor = await db.execute(
+                'SELECT total, bought FROM list_stats WHERE list_id = ?',
+                (list_id,)
+            )
+            return await cursor.fetchone()
+
         try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                cursor = await db.execute('''
-                                          SELECT COUNT(*)                                       as total_products,
-                                                 SUM(CASE WHEN is_bought = 1 THEN 1 ELSE 0 END) as bought_products
-                                          FROM products p
-                                                   JOIN shopping_lists sl ON p.list_id = sl.id
-                                          WHERE sl.user_id = ?
-                                          ''', (user_id,))
-
-                stats = await cursor.fetchone()
-
-                return {
-                    'total_products': stats[0] or 0,
-                    'bought_products': stats[1] or 0,
-                    'remaining_products': (stats[0] or 0) - (stats[1] or 0)
-                }
+            version = products_cache.version(list_id)
+            result = await shards.for_id(list_id).pool.read(select)
+
+            total, bought = result if result else (0, 0)
+            stats = {
+                'total_products': total,
+                'bought_products': bought,
+                'remaining_products': total - bought
+            }
+            products_cache.put(list_id, version, stats, 'stats')
+            return dict(stats)
 
         except Exception as e:
-            logger.error(f"❌ Ошибка получения статистики: {e}")
+            logger.error(f"❌ Ошибка получения счетчиков списка: {e}")
+            return {'total_products': 0, 'bought_products': 0, 'remaining_products': 0}
+
+    @staticmethod
+    async def get_user_stats(user_id: int) -> Dict:
+        """Статистика основного списка пользователя (у участника семьи - общего списка)"""
+        list_id = await Database.get_or_create_list(user_id)
+        if list_id is None:
             return {'total_products': 0, 'bought_products': 0, 'remaining_products': 0}
+        return await Database.get_list_stats(list_id)
+
+    @staticmethod
+    async def check_list_stats(repair: bool = False) -> List[Dict]:
+        """Сверить счетчики list_stats с products во всех шардах; при repair=True пересчитать их заново"""
+        async def check_and_rebuild(db) -> List[Dict]:
+            await db.execute('BEGIN')
+            shard_drift = await list_stats.find_drift(db)
+            if shard_drift:
+                await list_stats.rebuild(db)
+            await db.commit()
+            return shard_drift
+
+        drift = []
+        for shard in shards:
+            if repair:
+                drift.extend(await shard.pool.write(check_and_rebuild))
+            else:
+                drift.extend(await shard.pool.read(list_stats.find_drift))
+
+        if repair and drift:
+            for row in drift:
+                _list_changed(row['list_id'], 'repair')
+            logger.warning(f"🧮 Счетчики пересчитаны, расхождений было: {len(drift)}")
+        return drift
 
     @staticmethod
     async def mark_all_products(list_id: int, mark_as_bought: bool) -> int:
         """НОВОЕ: Отметить все продукты как купленные или не купленные"""
-        try:
-            async with aiosqlite.connect(DATABASE_URL) as db:
-                status = 1 if mark_as_bought else 0
 
+        async def mark_all(db):
+            if not mark_as_bought:
+                # Товар без некупленного двойника просто снимается с отметки и сохраняет id
+                # (его держат открытые клавиатуры); из нескольких купленных с одним названием
+                # так снимается первый
                 cursor = await db.execute(
-                    'UPDATE products SET is_bought = ? WHERE list_id = ?',
-                    (status, list_id)
+                    'UPDATE products SET is_bought = 0, bought_at = NULL '
+                    'WHERE list_id = ? AND is_bought = 1 '
+                    f'AND NOT EXISTS ({_UNBOUGHT_TWIN}) AND id = ({_FIRST_BOUGHT_TWIN})',
+                    (list_id,)
                 )
-                await db.commit()
+                restored = cursor.rowcount
+                # Остальные снятые отметки сливаются с некупленными товарами того же названия
+                await db.execute(RESTORE_PRODUCTS.format(where='list_id = ?'), (list_id,))
+                cursor = await db.execute(RESTORE_DELETE.format(where='list_id = ?'), (list_id,))
+                return restored + len(await cursor.fetchall())
+
+            # Строки, уже находящиеся в нужном статусе, не перезаписываем
+            cursor = await db.execute(
+                'UPDATE products SET is_bought = 1, bought_at = CURRENT_TIMESTAMP '
+                'WHERE list_id = ? AND is_bought = 0',
+                (list_id,)
+            )
+            return cursor.rowcount
 
-                affected_count = cursor.rowcount
-                action = "отмечено как купленные" if mark_as_bought else "сняты отметки"
-                logger.info(f"📋 {action} у {affected_count} товаров в списке {list_id}")
-                return affected_count
+        try:
+            affected_count = await shards.for_id(list_id).write_queue.submit(mark_all)
+            if affected_count > 0:
+                _list_changed(list_id, 'mark_all', is_bought=mark_as_bought, count=affected_count)
+
+            action = "отмечено как купленные" if mark_as_bought else "сняты отметки"
+            logger.info(f"📋 {action} у {affected_count} товаров в списке {list_id}")
+            return affected_count
 
         except Exception as e:
             logger.error(f"❌ Ошибка массовой отметки: {e}")
             return 0
+
+    @staticmethod
+    async def search_product_names(list_id: int, query: str, limit: int = 10) -> List[str]:
+        """Названия из словаря списка, слова которых начинаются со слов запроса (частые первыми).
+
+        Пустой запрос возвращает самые частые названия. Ответы кэшируются по запросу
+        до изменения списка, так что набор одного префикса повторно в базу не идет.
+        """
+        words = tuple(word for word in normalize_name(query.replace('"', ' ')).split())
+        key = ('search', words, limit)
+        cached = products_cache.get(list_id, key)
+        if cached is not None:
+            return list(cached)
+
+        async def select(db):
+            if not words:
+                cursor = await db.execute(
+                    'SELECT name FROM product_names WHERE list_id = ? ORDER BY uses DESC, last_used_at DESC LIMIT ?',
+                    (list_id, limit)
+                )
+            else:
+                # Каждое слово - префиксный запрос к FTS5, токен списка отсекает чужие словари
+                match = f'list_key : "l{list_id}" AND normalized_name : ('
+                match += ' AND '.join(f'"{word}"*' for word in words) + ')'
+                cursor = await db.execute('''
+                                          SELECT n.name
+                                          FROM product_names_fts f
+                                                   JOIN product_names n ON n.id = f.rowid
+                                          WHERE product_names_fts MATCH ?
+                                          ORDER BY n.uses DESC, n.last_used_at DESC
+                                          LIMIT ?
+                                          ''', (match, limit))
+            return [row[0] for row in await cursor.fetchall()]
+
+        try:
+            version = products_cache.version(list_id)
+            names = await shards.for_id(list_id).pool.read(select)
+            products_cache.put(list_id, version, names, key)
+            return list(names)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка поиска товаров: {e}")
+            return []
+
+    @staticmethod
+    async def get_purchase_history(user_id: int, limit: int = 20) -> List[Dict]:
+        """Последние покупки основного списка пользователя из архива, от новых к старым.
+
+        У участника семьи это история общего списка - она лежит в шарде списка.
+        """
+        async def select(db):
+            # По индексу (list_id, bought_at DESC) читается только начало истории
+            cursor = await db.execute('''
+                                      SELECT name, quantity, bought_at
+                                      FROM purchase_history
+                                      WHERE list_id = ?
+                                      ORDER BY bought_at DESC, id DESC
+                                      LIMIT ?
+                                      ''', (list_id, limit))
+            return await cursor.fetchall()
+
+        try:
+            list_id = await Database.get_or_create_list(user_id)
+            if list_id is None:
+                return []
+            rows = await shards.for_id(list_id).pool.read(select)
+            return [{'name': row[0], 'quantity': row[1], 'bought_at': row[2]} for row in rows]
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения истории покупок: {e}")
+            return []
+
+    @staticmethod
+    async def get_frequent_purchases(user_id: int, limit: int = 10) -> List[Dict]:
+        """Чаще всего покупаемые товары основного списка пользователя по архиву"""
+        async def select(db):
+            cursor = await db.execute('''
+                                      SELECT name, COUNT(*) as times, MAX(bought_at) as last_bought_at
+                                      FROM purchase_history
+                                      WHERE list_id = ?
+                                      GROUP BY name
+                                      ORDER BY times DESC, last_bought_at DESC
+                                      LIMIT ?
+                                      ''', (list_id, limit))
+            return await cursor.fetchall()
+
+        try:
+            list_id = await Database.get_or_create_list(user_id)
+            if list_id is None:
+                return []
+            rows = await shards.for_id(list_id).pool.read(select)
+            return [{'name': row[0], 'times': row[1], 'last_bought_at': row[2]} for row in rows]
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения частых покупок: {e}")
+            return []
+
+    @staticmethod
+    def get_list_seq(list_id: int) -> int:
+        """Номер последнего изменения списка (запоминается перед чтением списка)"""
+        return list_events.last_seq(list_id)
+
+    @staticmethod
+    def get_list_changes(list_id: int, since_seq: int) -> Optional[List[ListEvent]]:
+        """Изменения списка после since_seq; None - история неполная, список нужно перечитать"""
+        return list_events.since(list_id, since_seq)
+
+    @staticmethod
+    def get_list_events_stats() -> Dict:
+        """Размер журнала изменений списков"""
+        return list_events.stats()
+
+    @staticmethod
+    def get_cache_stats() -> Dict:
+        """Счетчики попаданий и промахов кэша продуктов"""
+        return products_cache.stats()
+
+    @staticmethod
+    def get_list_cache_stats() -> Dict:
+        """Счетчики попаданий и промахов кэша основных списков"""
+        return list_ids_cache.stats()
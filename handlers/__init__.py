@@ -2,6 +2,6 @@
 Пакет обработчиков команд для семейного бота
 """
 
-from . import start, shopping_list, ai_chat
+from . import start, shopping_list, search, ai_chat, admin
 
-__all__ = ['start', 'shopping_list', 'ai_chat']
+__all__ = ['start', 'shopping_list', 'search', 'ai_chat', 'admin']
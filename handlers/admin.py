@@ -0,0 +1,119 @@
+from aiogram import Router, F
+from aiogram.types import Message
+from aiogram.filters import Command
+import logging
+
+from config import ADMIN_IDS
+from database import Database, backup_databases
+from utils.list_fanout import list_fanout
+from utils.metrics import metrics
+from utils.ai_scheduler import ai_scheduler
+from utils.perplexity_client import perplexity_client
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# Команды этого роутера доступны только администраторам
+router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+
+
+@router.message(Command("stats"))
+async def stats_command(message: Message):
+    """Служебные метрики бота для администраторов"""
+    cache_stats = Database.get_cache_stats()
+    requests_total = cache_stats['hits'] + cache_stats['misses']
+    hit_rate = cache_stats['hits'] / requests_total * 100 if requests_total else 0
+
+    text = "📊 <b>Метрики бота</b>\n\n"
+    text += "🗃 <b>Кэш продуктов</b>\n"
+    text += f"• Попаданий: {cache_stats['hits']}\n"
+    text += f"• Промахов: {cache_stats['misses']}\n"
+    text += f"• Доля попаданий: {hit_rate:.1f}%\n"
+    text += f"• Списков в кэше: {cache_stats['lists']} (вытеснено: {cache_stats['evictions']})\n"
+    text += f"• Вытеснено страниц и поисков: {cache_stats['key_evictions']}, версий списков: {cache_stats['versions']}\n"
+
+    list_stats = Database.get_list_cache_stats()
+    text += "\n👤 <b>Кэш основных списков</b>\n"
+    text += f"• Попаданий: {list_stats['hits']}, промахов: {list_stats['misses']}\n"
+    text += f"• Пользователей в кэше: {list_stats['size']} (вытеснено: {list_stats['evictions']})\n"
+
+    ai_cache_stats = perplexity_client.cache.stats()
+    text += "\n🤖 <b>Кэш ответов AI</b>\n"
+    text += (
+        f"• Попаданий: {ai_cache_stats['hits']} (из файла: {ai_cache_stats['persistent_hits']}), "
+        f"промахов: {ai_cache_stats['misses']}\n"
+    )
+    text += f"• Ответов в памяти: {ai_cache_stats['size']} (вытеснено: {ai_cache_stats['evictions']})\n"
+    flight_stats = perplexity_client.in_flight_stats()
+    text += f"• Запросов к API: {flight_stats['calls']}, сэкономлено объединением: {flight_stats['shared']}\n"
+    queue_stats = ai_scheduler.stats()
+    text += (
+        f"• Очередь: в работе {queue_stats['running']}, ждут {queue_stats['queued']} "
+        f"(пользователей: {queue_stats['users_waiting']}), отклонено: {queue_stats['shed']}\n"
+    )
+    text += (
+        f"• Ожидание очереди: среднее {queue_stats['wait_avg'] * 1000:.0f} мс, "
+        f"максимум {queue_stats['wait_max'] * 1000:.0f} мс\n"
+    )
+
+    events_stats = Database.get_list_events_stats()
+    text += "\n📜 <b>Журнал изменений</b>\n"
+    text += f"• Событий: {events_stats['events']} в {events_stats['lists']} списках (всего: {events_stats['appended']})\n"
+    text += f"• Перечитываний из-за вытеснения: {events_stats['gaps']}\n"
+
+    fanout_stats = list_fanout.stats()
+    text += "\n👨‍👩‍👧 <b>Общие списки</b>\n"
+    text += f"• Открытых экранов: {fanout_stats['messages']} в {fanout_stats['lists']} списках\n"
+    text += (
+        f"• Изменений: {fanout_stats['changes']} (слито в одну рассылку: {fanout_stats['coalesced']}), "
+        f"правок: {fanout_stats['edits']}, RetryAfter: {fanout_stats['retry_after']}\n"
+    )
+    text += f"• Страниц обновлено по журналу: {fanout_stats['deltas']}, перечитано: {fanout_stats['reads']}\n"
+
+    snapshot = metrics.snapshot()
+    if snapshot['timings']:
+        text += "\n⏱ <b>Замеры</b>\n"
+        for name, timing in sorted(snapshot['timings'].items()):
+            text += f"• {name}: {timing['count']} шт, ср. {timing['avg_ms']:.1f} мс, макс. {timing['max_ms']:.1f} мс\n"
+
+    await message.answer(text, parse_mode="HTML")
+    logger.info(f"📊 Администратор {message.from_user.id} запросил метрики")
+
+
+@router.message(Command("checkstats"))
+async def check_stats_command(message: Message):
+    """Сверить счетчики товаров списков с таблицей продуктов и пересчитать расхождения"""
+    drift = await Database.check_list_stats(repair=True)
+
+    if not drift:
+        await message.answer("✅ Счетчики списков совпадают с товарами")
+        return
+
+    text = f"🧮 <b>Пересчитано списков: {len(drift)}</b>\n\n"
+    for row in drift[:20]:
+        text += (
+            f"• Список {row['list_id']}: было {row['stored_total']}/{row['stored_bought']}, "
+            f"стало {row['total']}/{row['bought']}\n"
+        )
+
+    await message.answer(text, parse_mode="HTML")
+    logger.warning(f"🧮 Администратор {message.from_user.id} пересчитал счетчики: {len(drift)} расхождений")
+
+
+@router.message(Command("backup"))
+async def backup_command(message: Message):
+    """Снять снимок базы прямо сейчас, не останавливая бота"""
+    await message.answer("💾 Снимаю копию базы...")
+    try:
+        snapshots = await backup_databases()
+    except Exception as e:
+        logger.error(f"❌ Ошибка резервного копирования: {e}")
+        await message.answer(f"❌ Не удалось снять копию: {e}")
+        return
+
+    text = "💾 <b>Копия базы готова</b>\n\n"
+    for taken in snapshots:
+        text += f"• {taken['path']}: {taken['size'] / 1024:.0f} КиБ за {taken['seconds']:.2f} с\n"
+
+    await message.answer(text, parse_mode="HTML")
+    logger.info(f"💾 Администратор {message.from_user.id} снял копию базы")
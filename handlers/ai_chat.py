@@ -1,11 +1,15 @@
 from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 import logging
 
+from config import AI_STREAM, AI_STREAM_EDIT_INTERVAL_SEC
 from database import Database
+from utils.ai_scheduler import AIQueueFull
 from utils.perplexity_client import perplexity_client
+from utils.progressive_message import ProgressiveMessage
 from keyboards.inline import get_main_menu, get_ai_chat_keyboard
 
 router = Router()
@@ -51,8 +55,9 @@ async def ai_chat_handler(message: Message, state: FSMContext):
             parse_mode="Markdown"
         )
 
-    # Показываем, что AI думает
-    await message.bot.send_chat_action(message.chat.id, "typing")
+    # Показываем, что AI думает: заглушка сразу, ответ дописывается в нее по мере генерации
+    placeholder = await message.answer("🤖 Думаю над ответом...")
+    progress = ProgressiveMessage(placeholder, AI_STREAM_EDIT_INTERVAL_SEC, prefix="🤖 ")
 
     try:
         # Получаем текущий список покупок пользователя
@@ -62,8 +67,21 @@ async def ai_chat_handler(message: Message, state: FSMContext):
 
         logger.info(f"🤖 AI чат - пользователь {user_id}: {user_message[:50]}...")
 
+        async def show_queue_position(position: int):
+            # Пока вопрос ждет очереди к AI, заглушка показывает место в ней. Уведомление
+            # может опоздать к началу потока - выведенный текст им не затираем
+            if progress.streaming:
+                return
+            try:
+                await placeholder.edit_text(f"⏳ Много вопросов к AI, вы {position}-й в очереди...", parse_mode=None)
+            except (TelegramBadRequest, TelegramRetryAfter) as e:
+                logger.debug(f"Место в очереди не показано: {e}")
+
         # Получаем умный ответ от AI
-        ai_result = await perplexity_client.get_smart_response(user_message, current_list)
+        ai_result = await perplexity_client.get_smart_response(
+            user_message, current_list, on_partial=progress.update if AI_STREAM else None,
+            user_id=user_id, on_queue_position=show_queue_position
+        )
 
         ai_response = ai_result["response"]
         suggested_products = ai_result["products"]
@@ -86,20 +104,30 @@ async def ai_chat_handler(message: Message, state: FSMContext):
         # Добавляем подсказку для продолжения
         response_text += f"\n\n💬 *Продолжайте задавать вопросы или используйте кнопки ниже*"
 
-        # Отправляем ответ с клавиатурой
-        await message.answer(
-            text=response_text,
+        # Заменяем заглушку готовым ответом с клавиатурой
+        await progress.finish(
+            response_text,
             reply_markup=get_ai_chat_keyboard(suggested_products, intent),
             parse_mode="Markdown"
         )
 
         logger.info(f"✅ AI чат ответ отправлен пользователю {user_id}")
 
+    except AIQueueFull as e:
+        logger.warning(f"⏳ Вопрос пользователя {user_id} отклонен: {e}")
+        await progress.finish(
+            "⏳ Сейчас слишком много вопросов к AI. Дождитесь ответа на предыдущий вопрос "
+            "или попробуйте еще раз через минуту.",
+            reply_markup=get_ai_chat_keyboard([], "error"),
+            parse_mode=None
+        )
+
     except Exception as e:
         logger.error(f"❌ Ошибка AI чата: {type(e).__name__}: {e}")
-        await message.answer(
+        await progress.finish(
             "🤖 Произошла ошибка при обращении к AI. Попробуйте еще раз или перейдите в меню.",
-            reply_markup=get_ai_chat_keyboard([], "error")
+            reply_markup=get_ai_chat_keyboard([], "error"),
+            parse_mode=None
         )
 
 
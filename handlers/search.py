@@ -0,0 +1,61 @@
+from aiogram import Router, F
+from aiogram.types import Message, InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+import logging
+
+from database import Database
+from keyboards.inline import get_main_menu
+from utils.product_parser import parse_product_line
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# Сколько подсказок показывать в inline-режиме
+SUGGESTIONS_LIMIT = 10
+
+# Сколько секунд Telegram может отдавать ответ из своего кэша (подсказки личные)
+SUGGESTIONS_CACHE_TIME = 5
+
+
+@router.inline_query()
+async def suggest_products(inline_query: InlineQuery):
+    """Подсказки товаров по началу названия: @бот мол -> Молоко, Молочный шоколад"""
+    try:
+        list_id = await Database.get_or_create_list(inline_query.from_user.id)
+        names = await Database.search_product_names(list_id, inline_query.query, SUGGESTIONS_LIMIT) if list_id else []
+
+        results = [
+            InlineQueryResultArticle(
+                id=str(index),
+                title=name,
+                description="➕ Добавить в список",
+                input_message_content=InputTextMessageContent(message_text=name)
+            )
+            for index, name in enumerate(names)
+        ]
+        await inline_query.answer(results, cache_time=SUGGESTIONS_CACHE_TIME, is_personal=True)
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка inline-поиска: {e}")
+        await inline_query.answer([], cache_time=SUGGESTIONS_CACHE_TIME, is_personal=True)
+
+
+@router.message(F.via_bot & F.text)
+async def add_suggested_product(message: Message):
+    """Подсказка, выбранная в чате с ботом, добавляется в список"""
+    if message.via_bot.id != message.bot.id:
+        return
+
+    try:
+        product_name, quantity = parse_product_line(message.text)
+        list_id = await Database.get_or_create_list(message.from_user.id)
+        if not list_id:
+            await message.answer("❌ Ошибка при добавлении продукта.", reply_markup=get_main_menu())
+            return
+
+        await Database.add_product(list_id, product_name, quantity)
+        await message.answer(f"✅ **{product_name}** в списке", reply_markup=get_main_menu(), parse_mode="Markdown")
+        logger.info(f"🔍 Пользователь {message.from_user.id} добавил подсказку: {product_name}")
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка добавления подсказки: {e}")
+        await message.answer("❌ Произошла ошибка при добавлении продукта.", reply_markup=get_main_menu())
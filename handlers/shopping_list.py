@@ -1,93 +1,143 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from typing import Dict, Optional, Tuple
 import logging
 import datetime
 
-from database import Database
+from database import Database, PageKey
+from utils.list_fanout import list_fanout
+from utils.product_parser import parse_product_list, MAX_BULK_PRODUCTS
 from keyboards.inline import (
     get_main_menu, get_list_actions, get_back_to_menu,
     get_product_management_keyboard, get_clear_options,
-    get_product_list_keyboard, get_mark_products_keyboard
+    get_product_list_keyboard, get_mark_products_keyboard, parse_page_callback,
+    get_family_keyboard, invite_link
 )
 
 router = Router()
 logger = logging.getLogger(__name__)
 
+# Сколько добавленных продуктов перечислять в ответе на массовое добавление
+BULK_SUMMARY_LIMIT = 20
+
+# Товаров на одной странице списка (у Telegram ограничено число кнопок клавиатуры)
+LIST_PAGE_SIZE = 20
+
+# Сколько последних и частых покупок показывать в истории
+HISTORY_LIMIT = 15
+FREQUENT_LIMIT = 5
+
 
 class AddProductState(StatesGroup):
     waiting_for_product = State()
 
 
-@router.callback_query(F.data == "view_list")
-async def view_shopping_list(callback: CallbackQuery):
-    """Показать список покупок"""
-    try:
-        user_id = callback.from_user.id
-        list_id = await Database.get_or_create_list(user_id)
+async def read_products_page(list_id: int, page_key: Optional[PageKey] = None, backward: bool = False) -> Dict:
+    """Страница списка; если ее товары удалены - начало списка"""
+    page = await Database.get_products_page(list_id, page_key, LIST_PAGE_SIZE, backward)
 
-        if not list_id:
-            await callback.message.edit_text(
-                "❌ Ошибка при загрузке списка покупок.",
-                reply_markup=get_back_to_menu()
-            )
-            return
+    if not page['products'] and page['after_key'] is not None:
+        # Товары этой страницы удалены - показываем начало списка
+        page = await Database.get_products_page(list_id, None, LIST_PAGE_SIZE)
+    return page
 
-        products = await Database.get_products(list_id)
-        logger.info(f"📋 Загружено {len(products)} продуктов для пользователя {user_id}")
 
-        timestamp = datetime.datetime.now().strftime("%H:%M")
+async def load_products_page(state: FSMContext, list_id: int, page_key: Optional[PageKey] = None,
+                             backward: bool = False) -> Dict:
+    """Загрузить страницу списка и запомнить ее, чтобы после действий с товаром остаться на ней"""
+    page = await read_products_page(list_id, page_key, backward)
+    await state.update_data(list_page=page['after_key'])
+    return page
 
-        if not products:
-            text = f"""
+
+async def current_page_key(state: FSMContext) -> Optional[PageKey]:
+    """Ключ текущей страницы списка (None - первая страница)"""
+    key = (await state.get_data()).get('list_page')
+    return tuple(key) if key else None
+
+
+async def render_list_view(list_id: int, page: Dict) -> Tuple[str, InlineKeyboardMarkup]:
+    """Текст и клавиатура экрана списка для страницы page"""
+    products = page['products']
+    timestamp = datetime.datetime.now().strftime("%H:%M")
+
+    if not products:
+        text = f"""
 📝 **Ваш список покупок пуст** _(обн. {timestamp})_
 
 Добавьте первые продукты, чтобы начать планирование покупок!
 
 💡 *Совет: Нажмите "Добавить продукт" ниже*
-            """
-            keyboard = get_list_actions()
-        else:
-            text = f"🛒 **Ваш список покупок** _(обн. {timestamp})_\n\n"
+        """
+        keyboard = get_list_actions()
+    else:
+        text = f"🛒 **Ваш список покупок** _(обн. {timestamp})_\n\n"
+
+        for product in products:
+            if product['is_bought']:
+                status = "✅"
+                name_display = f"~~{product['name']}~~"
+            else:
+                status = "🔘"
+                name_display = f"**{product['name']}**"
 
-            unbought_count = 0
-            bought_count = 0
+            quantity_display = f" _{product['quantity']}_" if product['quantity'] != '1' else ""
+            text += f"{status} {name_display}{quantity_display}\n"
 
-            for product in products:
-                if product['is_bought']:
-                    status = "✅"
-                    name_display = f"~~{product['name']}~~"
-                    bought_count += 1
-                else:
-                    status = "🔘"
-                    name_display = f"**{product['name']}**"
-                    unbought_count += 1
+        stats = await Database.get_list_stats(list_id)
+        text += f"\n📊 **Итого:** {stats['total_products']} товаров"
+        text += f"\n🔘 К покупке: {stats['remaining_products']}"
+        text += f"\n✅ Куплено: {stats['bought_products']}"
+        if len(products) < stats['total_products']:
+            text += f"\n📄 На странице: {len(products)}"
 
-                quantity_display = f" _{product['quantity']}_" if product['quantity'] != '1' else ""
-                text += f"{status} {name_display}{quantity_display}\n"
+        # ИСПРАВЛЕНО: Используем новую клавиатуру с кнопками отметки
+        keyboard = get_product_list_keyboard(products, page)
 
-            text += f"\n📊 **Итого:** {len(products)} товаров"
-            text += f"\n🔘 К покупке: {unbought_count}"
-            text += f"\n✅ Куплено: {bought_count}"
+    return text, keyboard
 
-            # ИСПРАВЛЕНО: Используем новую клавиатуру с кнопками отметки
-            keyboard = get_product_list_keyboard(products)
 
-        try:
+@router.callback_query(F.data == "view_list")
+async def view_shopping_list(callback: CallbackQuery, state: FSMContext, page_key: PageKey = None,
+                             backward: bool = False):
+    """Показать список покупок (постранично)"""
+    try:
+        user_id = callback.from_user.id
+        list_id = await Database.get_or_create_list(user_id)
+
+        if not list_id:
             await callback.message.edit_text(
+                "❌ Ошибка при загрузке списка покупок.",
+                reply_markup=get_back_to_menu()
+            )
+            return
+
+        # Изменения после этого номера не попадут в экран - их доставит рассылка
+        seq = Database.get_list_seq(list_id)
+        page = await load_products_page(state, list_id, page_key, backward)
+        logger.info(f"📋 Загружено {len(page['products'])} продуктов для пользователя {user_id}")
+        text, keyboard = await render_list_view(list_id, page)
+
+        try:
+            message = await callback.message.edit_text(
                 text=text,
                 reply_markup=keyboard,
                 parse_mode="Markdown"
             )
         except Exception:
             await callback.message.delete()
-            await callback.message.answer(
+            message = await callback.message.answer(
                 text=text,
                 reply_markup=keyboard,
                 parse_mode="Markdown"
             )
 
+        # Экран будет обновляться, когда список изменят другие участники
+        if isinstance(message, Message):
+            list_fanout.track(list_id, user_id, message.chat.id, message.message_id, page['after_key'], seq)
+
         await callback.answer()
 
     except Exception as e:
@@ -96,12 +146,14 @@ async def view_shopping_list(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "mark_products")
-async def mark_products_mode(callback: CallbackQuery):
+async def mark_products_mode(callback: CallbackQuery, state: FSMContext, page_key: PageKey = None,
+                             backward: bool = False):
     """НОВОЕ: Режим отметки продуктов"""
     try:
         user_id = callback.from_user.id
         list_id = await Database.get_or_create_list(user_id)
-        products = await Database.get_products(list_id)
+        page = await load_products_page(state, list_id, page_key, backward)
+        products = page['products']
 
         if not products:
             await callback.message.edit_text(
@@ -130,7 +182,7 @@ async def mark_products_mode(callback: CallbackQuery):
 
         await callback.message.edit_text(
             text=text,
-            reply_markup=get_mark_products_keyboard(products),
+            reply_markup=get_mark_products_keyboard(products, page),
             parse_mode="Markdown"
         )
         await callback.answer()
@@ -141,7 +193,7 @@ async def mark_products_mode(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "mark_all")
-async def mark_all_products(callback: CallbackQuery):
+async def mark_all_products(callback: CallbackQuery, state: FSMContext):
     """НОВОЕ: Отметить все продукты как купленные"""
     try:
         user_id = callback.from_user.id
@@ -151,7 +203,7 @@ async def mark_all_products(callback: CallbackQuery):
 
         if marked_count > 0:
             await callback.answer(f"✅ Отмечено {marked_count} товаров как купленные", show_alert=True)
-            await mark_products_mode(callback)  # Обновляем интерфейс
+            await mark_products_mode(callback, state, await current_page_key(state))  # Обновляем интерфейс
         else:
             await callback.answer("ℹ️ Нет товаров для отметки", show_alert=True)
 
@@ -161,7 +213,7 @@ async def mark_all_products(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "unmark_all")
-async def unmark_all_products(callback: CallbackQuery):
+async def unmark_all_products(callback: CallbackQuery, state: FSMContext):
     """НОВОЕ: Снять отметки со всех продуктов"""
     try:
         user_id = callback.from_user.id
@@ -171,7 +223,7 @@ async def unmark_all_products(callback: CallbackQuery):
 
         if unmarked_count > 0:
             await callback.answer(f"🔘 Сняты отметки с {unmarked_count} товаров", show_alert=True)
-            await mark_products_mode(callback)  # Обновляем интерфейс
+            await mark_products_mode(callback, state, await current_page_key(state))  # Обновляем интерфейс
         else:
             await callback.answer("ℹ️ Нет отмеченных товаров", show_alert=True)
 
@@ -181,12 +233,14 @@ async def unmark_all_products(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "manage_products")
-async def manage_products(callback: CallbackQuery):
+async def manage_products(callback: CallbackQuery, state: FSMContext, page_key: PageKey = None,
+                          backward: bool = False):
     """Управление продуктами - удаление и изменение статуса"""
     try:
         user_id = callback.from_user.id
         list_id = await Database.get_or_create_list(user_id)
-        products = await Database.get_products(list_id)
+        page = await load_products_page(state, list_id, page_key, backward)
+        products = page['products']
 
         if not products:
             await callback.message.edit_text(
@@ -200,11 +254,12 @@ async def manage_products(callback: CallbackQuery):
         text = "🗑 **Управление товарами**\n\n"
         text += "• Нажмите на товар, чтобы отметить купленным/не купленным\n"
         text += "• Нажмите 🗑 для удаления товара\n\n"
-        text += f"**Всего товаров:** {len(products)}"
+        stats = await Database.get_list_stats(list_id)
+        text += f"**Всего товаров:** {stats['total_products']}"
 
         await callback.message.edit_text(
             text=text,
-            reply_markup=get_product_management_keyboard(products),
+            reply_markup=get_product_management_keyboard(products, page),
             parse_mode="Markdown"
         )
         await callback.answer()
@@ -231,6 +286,9 @@ async def start_add_product(callback: CallbackQuery, state: FSMContext):
 • `Яблоки 1 кг`
 • `Помидоры 500г`
 
+📋 Можно сразу несколько - каждый с новой строки или через запятую:
+`Молоко, Хлеб 2 буханки, Яблоки 1 кг`
+
 Или отправьте `/cancel` для отмены
         """
 
@@ -260,35 +318,25 @@ async def add_product_handler(message: Message, state: FSMContext):
             await message.answer("❌ Название продукта не может быть пустым!")
             return
 
-        # Улучшенное разделение названия и количества
-        words = product_text.split()
-        product_name = product_text
-        quantity = '1'
-
-        if len(words) > 1:
-            last_word = words[-1].lower()
-            units = ['кг', 'г', 'гр', 'л', 'мл', 'шт', 'штук', 'упак', 'пачка', 'банка', 'бутылка']
-
-            if any(unit in last_word for unit in units):
-                if len(words) >= 2 and words[-2].replace(',', '.').replace('.', '').isdigit():
-                    quantity = f"{words[-2]} {words[-1]}"
-                    product_name = ' '.join(words[:-2])
-                else:
-                    quantity = words[-1]
-                    product_name = ' '.join(words[:-1])
-            elif last_word.replace(',', '.').replace('.', '').isdigit():
-                quantity = words[-1]
-                product_name = ' '.join(words[:-1])
-
-        if not product_name.strip():
-            product_name = product_text
-            quantity = '1'
+        products = parse_product_list(product_text)
+        if not products:
+            await message.answer("❌ Название продукта не может быть пустым!")
+            return
+
+        skipped_count = max(0, len(products) - MAX_BULK_PRODUCTS)
+        products = products[:MAX_BULK_PRODUCTS]
 
         # Добавляем в базу данных
         user_id = message.from_user.id
         list_id = await Database.get_or_create_list(user_id)
 
-        if list_id:
+        if not list_id:
+            await message.answer(
+                "❌ Ошибка при добавлении продукта. Попробуйте еще раз.",
+                reply_markup=get_main_menu()
+            )
+        elif len(products) == 1:
+            product_name, quantity = products[0]['name'], products[0]['quantity']
             await Database.add_product(list_id, product_name, quantity)
 
             success_text = f"✅ **Продукт добавлен!**\n\n📦 **{product_name}**"
@@ -303,9 +351,29 @@ async def add_product_handler(message: Message, state: FSMContext):
                 parse_mode="Markdown"
             )
         else:
+            added_count = await Database.add_multiple_products(list_id, products)
+
+            if added_count:
+                success_text = f"✅ **Добавлено продуктов: {added_count}**\n\n"
+                for product in products[:BULK_SUMMARY_LIMIT]:
+                    success_text += f"📦 {product['name']}"
+                    if product['quantity'] != '1':
+                        success_text += f" _{product['quantity']}_"
+                    success_text += "\n"
+
+                if added_count > BULK_SUMMARY_LIMIT:
+                    success_text += f"\n…и еще {added_count - BULK_SUMMARY_LIMIT}"
+                if skipped_count:
+                    success_text += f"\n⚠️ Не добавлено {skipped_count}: за раз можно не больше {MAX_BULK_PRODUCTS}"
+            else:
+                success_text = "❌ Ошибка при добавлении продуктов. Попробуйте еще раз."
+
+            logger.info(f"➕ Добавлено {added_count} продуктов одним сообщением для пользователя {user_id}")
+
             await message.answer(
-                "❌ Ошибка при добавлении продукта. Попробуйте еще раз.",
-                reply_markup=get_main_menu()
+                text=success_text,
+                reply_markup=get_main_menu(),
+                parse_mode="Markdown"
             )
 
         await state.clear()
@@ -320,7 +388,7 @@ async def add_product_handler(message: Message, state: FSMContext):
 
 
 @router.callback_query(F.data.startswith("toggle_"))
-async def toggle_product_status(callback: CallbackQuery):
+async def toggle_product_status(callback: CallbackQuery, state: FSMContext):
     """Изменить статус продукта (куплен/не куплен)"""
     try:
         product_id = int(callback.data.split("_")[1])
@@ -329,13 +397,14 @@ async def toggle_product_status(callback: CallbackQuery):
         if success:
             await callback.answer("✅ Статус изменен!", show_alert=False)
 
-            # Определяем, с какой страницы вызвана функция и обновляем соответственно
+            # Определяем, с какого экрана вызвана функция, и обновляем ту же страницу списка
+            page_key = await current_page_key(state)
             if "Режим отметки" in callback.message.text:
-                await mark_products_mode(callback)
+                await mark_products_mode(callback, state, page_key)
             elif "Управление товарами" in callback.message.text:
-                await manage_products(callback)
+                await manage_products(callback, state, page_key)
             else:
-                await view_shopping_list(callback)
+                await view_shopping_list(callback, state, page_key)
         else:
             await callback.answer("❌ Ошибка при изменении статуса", show_alert=True)
 
@@ -347,7 +416,7 @@ async def toggle_product_status(callback: CallbackQuery):
 
 
 @router.callback_query(F.data.startswith("delete_"))
-async def delete_product_handler(callback: CallbackQuery):
+async def delete_product_handler(callback: CallbackQuery, state: FSMContext):
     """Удалить продукт из списка"""
     try:
         product_id = int(callback.data.split("_")[1])
@@ -355,7 +424,7 @@ async def delete_product_handler(callback: CallbackQuery):
 
         if success:
             await callback.answer("🗑 Продукт удален!", show_alert=False)
-            await manage_products(callback)
+            await manage_products(callback, state, await current_page_key(state))
         else:
             await callback.answer("❌ Ошибка при удалении", show_alert=True)
 
@@ -389,7 +458,7 @@ async def show_clear_options(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "clear_bought")
-async def clear_bought_products(callback: CallbackQuery):
+async def clear_bought_products(callback: CallbackQuery, state: FSMContext):
     """Очистить купленные продукты"""
     try:
         user_id = callback.from_user.id
@@ -401,7 +470,7 @@ async def clear_bought_products(callback: CallbackQuery):
             if deleted_count > 0:
                 await callback.answer(f"🧹 Удалено {deleted_count} купленных товаров", show_alert=True)
                 logger.info(f"🧹 Пользователь {user_id} очистил {deleted_count} товаров")
-                await view_shopping_list(callback)
+                await view_shopping_list(callback, state)
             else:
                 await callback.answer("ℹ️ Нет купленных товаров для удаления", show_alert=True)
         else:
@@ -439,3 +508,117 @@ async def clear_all_products(callback: CallbackQuery):
     except Exception as e:
         logger.error(f"❌ Ошибка при полной очистке: {e}")
         await callback.answer("❌ Ошибка при очистке", show_alert=True)
+
+
+@router.callback_query(F.data == "purchase_history")
+async def show_purchase_history(callback: CallbackQuery):
+    """Показать последние и частые покупки из архива"""
+    try:
+        user_id = callback.from_user.id
+        history = await Database.get_purchase_history(user_id, HISTORY_LIMIT)
+
+        if not history:
+            text = "📜 **История покупок пуста**\n\n"
+            text += "Купленные товары попадают сюда после очистки списка или через сутки после отметки."
+        else:
+            text = "📜 **Последние покупки:**\n\n"
+            for item in history:
+                text += f"✅ {item['name']}"
+                if item['quantity'] and item['quantity'] != '1':
+                    text += f" ({item['quantity']})"
+                text += f" - {item['bought_at'][:10]}\n"
+
+            frequent = await Database.get_frequent_purchases(user_id, FREQUENT_LIMIT)
+            if frequent:
+                text += "\n🔁 **Покупаете чаще всего:**\n"
+                for item in frequent:
+                    text += f"• {item['name']} - {item['times']} раз\n"
+
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=get_back_to_menu(),
+            parse_mode="Markdown"
+        )
+        await callback.answer()
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка истории покупок: {e}")
+        await callback.answer("❌ Ошибка при загрузке истории", show_alert=True)
+
+
+@router.callback_query(F.data.startswith("page_"))
+async def turn_list_page(callback: CallbackQuery, state: FSMContext):
+    """Листание списка на экранах просмотра, отметки и управления"""
+    try:
+        screen, direction, key = parse_page_callback(callback.data)
+        show_screen = {
+            "view": view_shopping_list,
+            "mark": mark_products_mode,
+            "manage": manage_products,
+        }[screen]
+
+        await show_screen(callback, state, key, backward=direction == "p")
+
+    except (ValueError, KeyError):
+        await callback.answer("❌ Ошибка в данных", show_alert=True)
+    except Exception as e:
+        logger.error(f"❌ Ошибка листания списка: {e}")
+        await callback.answer("❌ Ошибка", show_alert=True)
+
+
+@router.callback_query(F.data == "family")
+async def show_family(callback: CallbackQuery):
+    """Общий список семьи: участники и ссылка-приглашение"""
+    try:
+        user_id = callback.from_user.id
+        list_id = await Database.get_or_create_list(user_id)
+        if not list_id:
+            await callback.answer("❌ Ошибка при загрузке списка", show_alert=True)
+            return
+
+        members = await Database.get_list_members(list_id)
+        invite_code = await Database.get_invite_code(list_id)
+        if not invite_code:
+            await callback.answer("❌ Ошибка при загрузке списка", show_alert=True)
+            return
+
+        bot = await callback.bot.me()
+        link = invite_link(bot.username, list_id, invite_code)
+        is_owner = any(member['user_id'] == user_id and member['role'] == 'owner' for member in members)
+
+        text = "👨‍👩‍👧 **Семейный список**\n\n"
+        if is_owner:
+            text += "Это ваш список. "
+        else:
+            text += "Вы ведете общий список вместе с семьей. "
+        text += f"Участников: {len(members)}\n\n"
+        text += "Отправьте ссылку близким - по ней они откроют этот список, "
+        text += "а изменения сразу появятся у всех, у кого список открыт:\n"
+        text += f"`{link}`"
+
+        await callback.message.edit_text(
+            text=text,
+            reply_markup=get_family_keyboard(link, is_owner),
+            parse_mode="Markdown"
+        )
+        await callback.answer()
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка экрана семьи: {e}")
+        await callback.answer("❌ Ошибка", show_alert=True)
+
+
+@router.callback_query(F.data == "leave_list")
+async def leave_shared_list(callback: CallbackQuery, state: FSMContext):
+    """Выйти из общего списка и вернуться к своему"""
+    try:
+        if await Database.leave_list(callback.from_user.id) is None:
+            await callback.answer("ℹ️ Вы ведете свой список", show_alert=True)
+            return
+
+        await callback.answer("🚪 Вы вышли из общего списка", show_alert=True)
+        await view_shopping_list(callback, state)
+
+    except Exception as e:
+        logger.error(f"❌ Ошибка выхода из списка: {e}")
+        await callback.answer("❌ Ошибка", show_alert=True)
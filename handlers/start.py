@@ -1,15 +1,34 @@
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 import logging
 
 from database import Database
-from keyboards.inline import get_main_menu
+from keyboards.inline import get_main_menu, parse_invite
 
 router = Router()
 logger = logging.getLogger(__name__)
 
 
+@router.message(CommandStart(deep_link=True, magic=F.args.startswith("join_")))
+async def join_by_invite(message: Message, command: CommandObject):
+    """/start по ссылке-приглашению: присоединиться к общему списку семьи"""
+    user = message.from_user
+    await Database.add_user(user_id=user.id, username=user.username, first_name=user.first_name)
+
+    try:
+        list_id, invite_code = parse_invite(command.args)
+    except ValueError:
+        list_id, invite_code = None, None
+
+    if list_id is not None and await Database.join_list(user.id, list_id, invite_code):
+        text = "👨‍👩‍👧 **Вы присоединились к общему списку!**\n\nТеперь «Мой список» - общий для всей семьи."
+    else:
+        text = "❌ **Приглашение недействительно.** Попросите прислать новую ссылку."
+
+    await message.answer(text=text, reply_markup=get_main_menu(), parse_mode="Markdown")
+
+
 @router.message(CommandStart())
 async def start_command(message: Message):
     """Обработчик команды /start"""
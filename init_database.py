@@ -6,71 +6,44 @@ import asyncio
 import os
 import sqlite3
 from pathlib import Path
-from config import DATABASE_URL
+from config import DATABASE_URL, DATABASE_SHARDS
+from storage.shards import shard_path, user_shard_index
+from storage.products import product_row
 
+TEST_USER_ID = 123456789
 
-def create_database_sync():
-    """Создание базы данных синхронно (для IDE)"""
 
-    # Удаляем старую базу если есть
-    if os.path.exists(DATABASE_URL):
-        print(f"🗑 Удаляем существующую базу: {DATABASE_URL}")
-        os.remove(DATABASE_URL)
+async def apply_migrations() -> int:
+    """Применяем миграции схемы ко всем шардам через пулы соединений бота"""
+    from database import init_db, close_db
+    from storage.migrations import LATEST_VERSION
 
-    # Создаем новую базу
-    print(f"📊 Создаем новую базу данных: {DATABASE_URL}")
+    try:
+        await init_db()
+        return LATEST_VERSION
+    finally:
+        await close_db()
 
-    conn = sqlite3.connect(DATABASE_URL)
-    cursor = conn.cursor()
 
-    # Включаем поддержку внешних ключей
-    cursor.execute('PRAGMA foreign_keys = ON')
+def create_database_sync():
+    """Создание базы данных синхронно (для IDE)"""
 
-    # Создаем таблицу пользователей
-    cursor.execute('''
-                   CREATE TABLE users
-                   (
-                       user_id    INTEGER PRIMARY KEY,
-                       username   TEXT,
-                       first_name TEXT,
-                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                   )
-                   ''')
-    print("✅ Таблица 'users' создана")
-
-    # Создаем таблицу списков покупок
-    cursor.execute('''
-                   CREATE TABLE shopping_lists
-                   (
-                       id         INTEGER PRIMARY KEY AUTOINCREMENT,
-                       user_id    INTEGER NOT NULL,
-                       name       TEXT      DEFAULT 'Основной список',
-                       created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                       FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-                   )
-                   ''')
-    print("✅ Таблица 'shopping_lists' создана")
-
-    # Создаем таблицу продуктов
-    cursor.execute('''
-                   CREATE TABLE products
-                   (
-                       id        INTEGER PRIMARY KEY AUTOINCREMENT,
-                       list_id   INTEGER NOT NULL,
-                       name      TEXT    NOT NULL,
-                       quantity  TEXT      DEFAULT '1',
-                       is_bought INTEGER   DEFAULT 0,
-                       added_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                       FOREIGN KEY (list_id) REFERENCES shopping_lists (id) ON DELETE CASCADE
-                   )
-                   ''')
-    print("✅ Таблица 'products' создана")
-
-    # Создаем индексы для оптимизации
-    cursor.execute('CREATE INDEX idx_products_list_id ON products (list_id)')
-    cursor.execute('CREATE INDEX idx_products_is_bought ON products (is_bought)')
-    cursor.execute('CREATE INDEX idx_shopping_lists_user_id ON shopping_lists (user_id)')
-    print("✅ Индексы созданы")
+    # Удаляем старую базу и ее шарды если есть (вместе с файлами журнала WAL)
+    for index in range(DATABASE_SHARDS):
+        database_path = shard_path(DATABASE_URL, index)
+        for path in (database_path, f"{database_path}-wal", f"{database_path}-shm"):
+            if os.path.exists(path):
+                print(f"🗑 Удаляем существующий файл: {path}")
+                os.remove(path)
+
+    # Создаем новую базу теми же миграциями, что и бот при запуске
+    print(f"📊 Создаем новую базу данных: {DATABASE_URL} (шардов: {DATABASE_SHARDS})")
+    version = asyncio.run(apply_migrations())
+    print(f"✅ Таблицы и индексы созданы (схема v{version})")
+
+    # Тестовые данные кладем в шард тестового пользователя
+    conn = sqlite3.connect(shard_path(DATABASE_URL, user_shard_index(TEST_USER_ID, DATABASE_SHARDS)))
+    cursor = conn.cursor()
 
     # Добавляем тестовые данные
     print("\n📋 Добавляем тестовые данные...")
@@ -78,28 +51,29 @@ def create_database_sync():
     # Тестовый пользователь
     cursor.execute('''
                    INSERT INTO users (user_id, username, first_name)
-                   VALUES (123456789, 'test_user', 'Тестовый пользователь')
-                   ''')
+                   VALUES (?, 'test_user', 'Тестовый пользователь')
+                   ''', (TEST_USER_ID,))
 
     # Тестовый список
     cursor.execute('''
                    INSERT INTO shopping_lists (user_id, name)
-                   VALUES (123456789, 'Основной список')
-                   ''')
+                   VALUES (?, 'Основной список')
+                   ''', (TEST_USER_ID,))
+    list_id = cursor.lastrowid
 
     # Тестовые продукты
     test_products = [
-        (1, 'Молоко', '1 литр', 0),
-        (1, 'Хлеб', '1 буханка', 0),
-        (1, 'Яйца', '10 штук', 1),
-        (1, 'Помидоры', '500 г', 0),
-        (1, 'Сыр', '200 г', 1)
+        (list_id, 'Молоко', '1 литр', 0),
+        (list_id, 'Хлеб', '1 буханка', 0),
+        (list_id, 'Яйца', '10 штук', 1),
+        (list_id, 'Помидоры', '500 г', 0),
+        (list_id, 'Сыр', '200 г', 1)
     ]
 
     cursor.executemany('''
-                       INSERT INTO products (list_id, name, quantity, is_bought)
-                       VALUES (?, ?, ?, ?)
-                       ''', test_products)
+                       INSERT INTO products (list_id, name, normalized_name, quantity, amount, unit, is_bought)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)
+                       ''', [(*product_row(*product[:3]), product[3]) for product in test_products])
 
     print("✅ Тестовые данные добавлены")
 
@@ -112,41 +86,43 @@ def create_database_sync():
 
 def print_database_info():
     """Выводим информацию о созданной базе"""
-    conn = sqlite3.connect(DATABASE_URL)
-    cursor = conn.cursor()
+    for index in range(DATABASE_SHARDS):
+        database_path = shard_path(DATABASE_URL, index)
+        conn = sqlite3.connect(database_path)
+        cursor = conn.cursor()
 
-    # Информация о таблицах
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    tables = cursor.fetchall()
+        # Информация о таблицах
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = cursor.fetchall()
 
-    print(f"\n📊 Информация о базе данных:")
-    print(f"📁 Файл: {os.path.abspath(DATABASE_URL)}")
-    print(f"📋 Таблицы: {[table[0] for table in tables]}")
+        print(f"\n📊 Информация о базе данных:")
+        print(f"📁 Файл: {os.path.abspath(database_path)}")
+        print(f"📋 Таблицы: {[table[0] for table in tables]}")
 
-    # Статистика по данным
-    cursor.execute("SELECT COUNT(*) FROM users")
-    users_count = cursor.fetchone()[0]
+        # Статистика по данным
+        cursor.execute("SELECT COUNT(*) FROM users")
+        users_count = cursor.fetchone()[0]
 
-    cursor.execute("SELECT COUNT(*) FROM shopping_lists")
-    lists_count = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM shopping_lists")
+        lists_count = cursor.fetchone()[0]
 
-    cursor.execute("SELECT COUNT(*) FROM products")
-    products_count = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM products")
+        products_count = cursor.fetchone()[0]
 
-    cursor.execute("SELECT COUNT(*) FROM products WHERE is_bought = 1")
-    bought_count = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM products WHERE is_bought = 1")
+        bought_count = cursor.fetchone()[0]
 
-    print(f"👥 Пользователей: {users_count}")
-    print(f"📝 Списков: {lists_count}")
-    print(f"🛒 Продуктов: {products_count}")
-    print(f"✅ Купленных: {bought_count}")
+        print(f"👥 Пользователей: {users_count}")
+        print(f"📝 Списков: {lists_count}")
+        print(f"🛒 Продуктов: {products_count}")
+        print(f"✅ Купленных: {bought_count}")
 
-    conn.close()
+        conn.close()
 
 
 async def test_async_database():
     """Тестируем асинхронные функции"""
-    from database import Database, init_db
+    from database import Database, init_db, close_db
 
     print("\n🧪 Тестируем асинхронные функции...")
 
@@ -163,6 +139,8 @@ async def test_async_database():
     products = await Database.get_products(list_id)
     print(f"✅ Асинхронный тест прошел успешно. Продуктов: {len(products)}")
 
+    await close_db()
+
 
 def main():
     """Главная функция инициализации"""
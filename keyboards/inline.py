@@ -1,5 +1,6 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from urllib.parse import quote
 
 
 def get_main_menu() -> InlineKeyboardMarkup:
@@ -8,6 +9,9 @@ def get_main_menu() -> InlineKeyboardMarkup:
         [InlineKeyboardButton(text="📝 Мой список", callback_data="view_list")],
         [InlineKeyboardButton(text="➕ Добавить продукт", callback_data="add_product")],
         [InlineKeyboardButton(text="🤖 AI помощник", callback_data="ai_help")],
+        [InlineKeyboardButton(text="🔍 Найти товар", switch_inline_query_current_chat="")],
+        [InlineKeyboardButton(text="📜 История покупок", callback_data="purchase_history")],
+        [InlineKeyboardButton(text="👨‍👩‍👧 Семья", callback_data="family")],
         [InlineKeyboardButton(text="🧹 Очистить список", callback_data="clear_options")]
     ])
 
@@ -23,7 +27,50 @@ def get_list_actions() -> InlineKeyboardMarkup:
     ])
 
 
-def get_product_list_keyboard(products) -> InlineKeyboardMarkup:
+def page_callback(screen: str, direction: str, key: Tuple[int, str, int]) -> str:
+    """callback_data кнопки листания: экран, направление (n/p) и ключ товара на границе страницы"""
+    is_bought, added_at, product_id = key
+    # added_at - "ГГГГ-ММ-ДД ЧЧ:ММ:СС": вся строка укладывается в лимит Telegram в 64 байта
+    return f"page_{screen}_{direction}_{is_bought}_{added_at}_{product_id}"
+
+
+def parse_page_callback(data: str) -> Tuple[str, str, Tuple[int, str, int]]:
+    """Разобрать callback_data кнопки листания"""
+    _, screen, direction, is_bought, added_at, product_id = data.split("_")
+    return screen, direction, (int(is_bought), added_at, int(product_id))
+
+
+def invite_link(bot_username: str, list_id: int, invite_code: str) -> str:
+    """Ссылка-приглашение в общий список: /start с параметром join_<list_id>_<код>"""
+    return f"https://t.me/{bot_username}?start=join_{list_id}_{invite_code}"
+
+
+def parse_invite(payload: str) -> Tuple[int, str]:
+    """Разобрать параметр /start из ссылки-приглашения (код может содержать "_")"""
+    prefix, list_id, invite_code = payload.split("_", 2)
+    if prefix != "join" or not invite_code:
+        raise ValueError(payload)
+    return int(list_id), invite_code
+
+
+def _page_navigation_row(screen: str, page: Optional[Dict]) -> List[InlineKeyboardButton]:
+    """Кнопки предыдущей/следующей страницы (пустой ряд, если список умещается на одной)"""
+    row = []
+    if not page or not page['products']:
+        return row
+
+    if page['after_key'] is not None:
+        row.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=page_callback(screen, "p", page['products'][0]['key'])
+        ))
+    if page['next_key'] is not None:
+        row.append(InlineKeyboardButton(
+            text="Далее ➡️", callback_data=page_callback(screen, "n", page['next_key'])
+        ))
+    return row
+
+
+def get_product_list_keyboard(products, page: Dict = None) -> InlineKeyboardMarkup:
     """НОВОЕ: Клавиатура для отметки продуктов в списке"""
     keyboard = []
 
@@ -41,13 +88,18 @@ def get_product_list_keyboard(products) -> InlineKeyboardMarkup:
             )
         ])
 
+    navigation = _page_navigation_row("view", page)
+    if navigation:
+        keyboard.append(navigation)
+
     # Кнопки управления
     keyboard.append([
         InlineKeyboardButton(text="✅ Отметить товары", callback_data="mark_products"),
         InlineKeyboardButton(text="🗑 Управление", callback_data="manage_products")
     ])
     keyboard.append([
-        InlineKeyboardButton(text="🧹 Очистить список", callback_data="clear_options")
+        InlineKeyboardButton(text="🧹 Очистить список", callback_data="clear_options"),
+        InlineKeyboardButton(text="👨‍👩‍👧 Семья", callback_data="family")
     ])
     keyboard.append([
         InlineKeyboardButton(text="⬅️ Главное меню", callback_data="main_menu")
@@ -56,7 +108,19 @@ def get_product_list_keyboard(products) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
 
-def get_mark_products_keyboard(products) -> InlineKeyboardMarkup:
+def get_family_keyboard(invite_link: str, is_owner: bool) -> InlineKeyboardMarkup:
+    """Общий список: переслать приглашение, выйти из чужого списка"""
+    keyboard = [
+        [InlineKeyboardButton(text="📨 Отправить приглашение", url=f"https://t.me/share/url?url={quote(invite_link, safe='')}")]
+    ]
+    if not is_owner:
+        keyboard.append([InlineKeyboardButton(text="🚪 Выйти из общего списка", callback_data="leave_list")])
+    keyboard.append([InlineKeyboardButton(text="📝 К списку", callback_data="view_list")])
+    keyboard.append([InlineKeyboardButton(text="⬅️ Главное меню", callback_data="main_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+def get_mark_products_keyboard(products, page: Dict = None) -> InlineKeyboardMarkup:
     """НОВОЕ: Специальная клавиатура для отметки товаров"""
     keyboard = []
 
@@ -78,6 +142,10 @@ def get_mark_products_keyboard(products) -> InlineKeyboardMarkup:
             )
         ])
 
+    navigation = _page_navigation_row("mark", page)
+    if navigation:
+        keyboard.append(navigation)
+
     # Кнопки быстрых действий
     keyboard.append([
         InlineKeyboardButton(text="✅ Отметить все", callback_data="mark_all"),
@@ -106,7 +174,7 @@ def get_back_to_menu() -> InlineKeyboardMarkup:
     ])
 
 
-def get_product_management_keyboard(products) -> InlineKeyboardMarkup:
+def get_product_management_keyboard(products, page: Dict = None) -> InlineKeyboardMarkup:
     """Клавиатура для управления продуктами"""
     keyboard = []
 
@@ -127,6 +195,10 @@ def get_product_management_keyboard(products) -> InlineKeyboardMarkup:
         ]
         keyboard.append(row)
 
+    navigation = _page_navigation_row("manage", page)
+    if navigation:
+        keyboard.append(navigation)
+
     # Кнопки управления
     keyboard.append([
         InlineKeyboardButton(text="🧹 Очистить список", callback_data="clear_options")
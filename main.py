@@ -7,8 +7,9 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
 from config import BOT_TOKEN
-from database import init_db
-from handlers import start, shopping_list, ai_chat  # Заменили smart_ai на ai_chat
+from database import Database, init_db, close_db, start_background_tasks, list_change_listeners
+from handlers import start, shopping_list, search, ai_chat, admin  # Заменили smart_ai на ai_chat
+from utils.list_fanout import list_fanout, forget_on_navigation
 from utils.perplexity_client import perplexity_client
 
 # Настройка логирования
@@ -65,15 +66,26 @@ async def main():
     # ВАЖНО: Подключаем роутеры в правильном порядке
     # ai_chat должен быть ПОСЛЕДНИМ, так как он перехватывает все текстовые сообщения
     dp.include_router(start.router)
+    dp.include_router(admin.router)
     dp.include_router(shopping_list.router)
+    dp.include_router(search.router)  # До ai_chat: выбранные подсказки не уходят в AI
     dp.include_router(ai_chat.router)  # В конце - перехватывает все сообщения
 
     logger.info("🔗 Роутеры подключены")
 
+    # Изменения общего списка расходятся по открытым экранам всех участников
+    list_fanout.setup(
+        bot, shopping_list.read_products_page, shopping_list.render_list_view,
+        Database.get_list_seq, Database.get_list_changes
+    )
+    list_change_listeners.append(list_fanout.list_changed)
+    dp.callback_query.outer_middleware(forget_on_navigation)
+
     try:
         # Инициализируем базу данных
         await init_db()
         logger.info("💾 База данных инициализирована")
+        start_background_tasks()
 
         # Получаем информацию о боте
         bot_info = await bot.get_me()
@@ -97,6 +109,8 @@ async def main():
     finally:
         # Закрываем ресурсы
         await perplexity_client.close()
+        await list_fanout.stop()
+        await close_db()
         await bot.session.close()
         logger.info("🛑 Бот остановлен")
 
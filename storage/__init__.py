@@ -0,0 +1,11 @@
+"""
+Пакет инфраструктуры хранения данных (соединения, миграции, служебные задачи БД)
+"""
+
+from .migrations import migrate
+from .pool import ConnectionPool
+from .shards import Shard, ShardRouter
+from .threaded_pool import ThreadedPool
+from .write_queue import WriteQueue
+
+__all__ = ['ConnectionPool', 'Shard', 'ShardRouter', 'ThreadedPool', 'WriteQueue', 'migrate']
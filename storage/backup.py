@@ -0,0 +1,135 @@
+import asyncio
+import datetime
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIXES = ('.db', '.db.gz')
+
+
+class _BackupRestarted(Exception):
+    """Копирование слишком часто начиналось заново из-за записей в исходную базу"""
+
+
+def _copy(source_path: str, target_path: str, pages: int, pause: float, max_restarts: int):
+    """Скопировать базу онлайн-бэкапом SQLite порциями по pages страниц"""
+    source = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+    try:
+        try:
+            _run_backup(source, target_path, pages, pause, max_restarts)
+        except _BackupRestarted:
+            # Запись другим соединением перезапускает пошаговое копирование. Под постоянной
+            # нагрузкой копируем за один шаг: в WAL он держит только снимок чтения и писателей не ждет
+            logger.warning(f"⚠️ Копирование {source_path} перезапускалось {max_restarts} раз, копируем за один шаг")
+            _run_backup(source, target_path, -1, 0, max_restarts)
+    finally:
+        source.close()
+
+
+def _run_backup(source: sqlite3.Connection, target_path: str, pages: int, pause: float, max_restarts: int):
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > max_restarts:
+                raise _BackupRestarted()
+        last_remaining = remaining
+        # Между шагами исходная база свободна: писатели успевают зафиксировать изменения
+        if pause and remaining:
+            time.sleep(pause)
+
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    finally:
+        target.close()
+
+
+def _compress(path: str) -> str:
+    """Сжать файл в path.gz и удалить исходный"""
+    compressed_path = f'{path}.gz'
+    try:
+        with open(path, 'rb') as source, gzip.open(compressed_path, 'wb') as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+    except Exception:
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+        raise
+    os.remove(path)
+    return compressed_path
+
+
+def snapshot_prefix(source_path: str) -> str:
+    """Общее начало имен снимков одной базы: shopping.db -> shopping"""
+    return os.path.splitext(os.path.basename(source_path))[0]
+
+
+def list_snapshots(directory: str, source_path: str) -> List[str]:
+    """Снимки базы в каталоге, от старых к новым (время снимка - в имени файла)"""
+    pattern = os.path.join(glob.escape(directory), f'{glob.escape(snapshot_prefix(source_path))}-*')
+    return sorted(path for path in glob.glob(pattern) if path.endswith(SNAPSHOT_SUFFIXES))
+
+
+def prune_snapshots(directory: str, source_path: str, keep: int) -> List[str]:
+    """Удалить старые снимки базы, оставив keep последних"""
+    snapshots = list_snapshots(directory, source_path)
+    removed = snapshots[:-keep] if keep > 0 else []
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def _snapshot_path(directory: str, source_path: str) -> str:
+    """Имя нового снимка: время до микросекунд, а если такой файл уже есть - следующая микросекунда.
+
+    Снимки одной базы в одну секунду (/backup во время снимка перед переносом
+    шардов) не перезаписывают друг друга, а имена по-прежнему сортируются по времени.
+    """
+    moment = datetime.datetime.now()
+    while True:
+        path = os.path.join(directory, f'{snapshot_prefix(source_path)}-{moment:%Y%m%d-%H%M%S-%f}.db')
+        if not any(os.path.exists(taken) for taken in (path, f'{path}.gz', f'{path}.tmp')):
+            return path
+        moment += datetime.timedelta(microseconds=1)
+
+
+async def snapshot(source_path: str, directory: str, pages: int = 1024, pause: float = 0.005,
+                   compress: bool = False, max_restarts: int = 3) -> Dict:
+    """Снять копию работающей базы в directory, не останавливая бота.
+
+    Копирование идет в отдельном потоке порциями по pages страниц, поэтому ни цикл
+    событий, ни писатели базы не ждут его целиком. Снимок сначала пишется во временный
+    файл и появляется под своим именем только готовым.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, source_path)
+    temp_path = f'{path}.tmp'
+
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(_copy, source_path, temp_path, pages, pause, max_restarts)
+        os.replace(temp_path, path)
+        if compress:
+            path = await asyncio.to_thread(_compress, path)
+    except Exception:
+        for leftover in (temp_path, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+
+    return {
+        'source': source_path,
+        'path': path,
+        'size': os.path.getsize(path),
+        'seconds': time.perf_counter() - started,
+    }
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from itertools import count
+from typing import Any, Dict, Hashable, Optional
+
+from utils.metrics import metrics
+
+
+class ListCache:
+    """LRU-кэш чтений по спискам покупок с версией каждого списка.
+
+    Любое изменение списка повышает его версию и сбрасывает закэшированные
+    данные. Чтение запоминает версию до запроса в базу и кладет результат
+    в кэш, только если версия за это время не изменилась - так медленное
+    чтение не может вернуть в кэш устаревшие данные.
+
+    Хранится не больше max_lists списков и max_keys ключей на список (страницы,
+    префиксы поиска), вытеснение LRU. Версии хранятся для не больше чем max_lists
+    списков: версия вытесненного списка заменяется общей нижней границей.
+    """
+
+    def __init__(self, name: str, max_lists: int = 1000, max_keys: int = 32):
+        self.name = name
+        self.max_lists = max(1, max_lists)
+        self.max_keys = max(1, max_keys)
+        self._entries: 'OrderedDict[int, OrderedDict[Hashable, Any]]' = OrderedDict()
+        self._versions: 'OrderedDict[int, int]' = OrderedDict()
+        self._clock = count(1)
+        # Версия списков без своей записи. Растет при каждом вытеснении версии,
+        # чтобы версия не "вернулась" к значению, которое запомнило незавершенное чтение
+        self._floor = 0
+
+    def version(self, list_id: int) -> int:
+        """Текущая версия списка"""
+        return self._versions.get(list_id, self._floor)
+
+    def get(self, list_id: int, key: Hashable = 'all') -> Optional[Any]:
+        """Значение из кэша или None"""
+        entries = self._entries.get(list_id)
+        if entries is not None and key in entries:
+            self._entries.move_to_end(list_id)
+            entries.move_to_end(key)
+            metrics.incr(f'{self.name}.hit')
+            return entries[key]
+
+        metrics.incr(f'{self.name}.miss')
+        return None
+
+    def put(self, list_id: int, version: int, value: Any, key: Hashable = 'all'):
+        """Сохранить значение, прочитанное при версии version"""
+        if self.version(list_id) != version:
+            return
+
+        entries = self._entries.get(list_id)
+        if entries is None:
+            entries = self._entries[list_id] = OrderedDict()
+        entries[key] = value
+        entries.move_to_end(key)
+        self._entries.move_to_end(list_id)
+
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+            metrics.incr(f'{self.name}.key_eviction')
+
+        while len(self._entries) > self.max_lists:
+            evicted, _ = self._entries.popitem(last=False)
+            self._drop_version(evicted)
+            metrics.incr(f'{self.name}.eviction')
+
+    def invalidate(self, list_id: int):
+        """Список изменился: новая версия и сброс его данных"""
+        self._versions[list_id] = next(self._clock)
+        self._versions.move_to_end(list_id)
+        self._entries.pop(list_id, None)
+
+        # Списки, давно не менявшиеся и не читавшиеся, отдают свою версию нижней границе
+        while len(self._versions) > self.max_lists:
+            stale = next(iter(self._versions))
+            self._entries.pop(stale, None)
+            self._drop_version(stale)
+
+    def _drop_version(self, list_id: int):
+        if self._versions.pop(list_id, None) is not None:
+            self._floor = next(self._clock)
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов"""
+        return {
+            'lists': len(self._entries),
+            'versions': len(self._versions),
+            'hits': metrics.counters[f'{self.name}.hit'],
+            'misses': metrics.counters[f'{self.name}.miss'],
+            'evictions': metrics.counters[f'{self.name}.eviction'],
+            'key_evictions': metrics.counters[f'{self.name}.key_eviction'],
+        }
+
+
+class LRUCache:
+    """Ограниченный по размеру словарь с вытеснением давно не используемых ключей"""
+
+    def __init__(self, name: str, max_size: int = 10000):
+        self.name = name
+        self.max_size = max(1, max_size)
+        self._data: 'OrderedDict[Hashable, Any]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Значение из кэша или None"""
+        if key in self._data:
+            self._data.move_to_end(key)
+            metrics.incr(f'{self.name}.hit')
+            return self._data[key]
+
+        metrics.incr(f'{self.name}.miss')
+        return None
+
+    def put(self, key: Hashable, value: Any):
+        """Сохранить значение, вытеснив самые старые ключи при переполнении"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            metrics.incr(f'{self.name}.eviction')
+
+    def pop(self, key: Hashable):
+        """Удалить ключ из кэша"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов"""
+        return {
+            'size': len(self._data),
+            'hits': metrics.counters[f'{self.name}.hit'],
+            'misses': metrics.counters[f'{self.name}.miss'],
+            'evictions': metrics.counters[f'{self.name}.eviction'],
+        }
@@ -0,0 +1,102 @@
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from itertools import count
+from typing import Deque, Dict, List, Optional
+
+from utils.metrics import metrics
+
+# События, после которых список нельзя восстановить по дельтам - только перечитать
+BULK_EVENT_KINDS = ('add', 'merge', 'clear', 'clear_bought', 'mark_all', 'archive', 'repair')
+
+
+@dataclass(frozen=True)
+class ListEvent:
+    """Одно изменение списка. product_id и is_bought есть у изменений одного товара"""
+    seq: int
+    kind: str
+    product_id: Optional[int] = None
+    is_bought: Optional[bool] = None
+    count: int = 1
+
+    @property
+    def is_bulk(self) -> bool:
+        return self.kind in BULK_EVENT_KINDS
+
+
+class _ListFeed:
+    __slots__ = ('events', 'dropped_seq')
+
+    def __init__(self, max_events: int):
+        self.events: Deque[ListEvent] = deque(maxlen=max_events)
+        # Последнее вытесненное событие: дельты от более раннего номера уже неполные
+        self.dropped_seq = 0
+
+
+class ChangeFeed:
+    """Журнал изменений списков в памяти: последние события каждого списка с номерами.
+
+    Номера растут монотонно на весь журнал, поэтому читатель запоминает номер
+    последнего увиденного события и потом забирает только новые события списка.
+    Хранится не больше max_events событий на список и не больше max_lists
+    списков (вытеснение LRU). Если нужная часть истории уже вытеснена, since()
+    возвращает None - тогда список перечитывается целиком.
+    """
+
+    def __init__(self, name: str, max_lists: int = 1000, max_events: int = 100):
+        self.name = name
+        self.max_lists = max(1, max_lists)
+        self.max_events = max(1, max_events)
+        self._lists: 'OrderedDict[int, _ListFeed]' = OrderedDict()
+        self._clock = count(1)
+        # Наибольший номер среди событий вытесненных списков
+        self._floor = 0
+
+    def append(self, list_id: int, kind: str, product_id: Optional[int] = None,
+               is_bought: Optional[bool] = None, count: int = 1) -> int:
+        """Записать изменение списка, вернуть его номер"""
+        feed = self._lists.get(list_id)
+        if feed is None:
+            feed = self._lists[list_id] = _ListFeed(self.max_events)
+            # События списка могли быть вытеснены вместе с ним: читатель, отставший
+            # от границы вытеснения, должен перечитать список
+            feed.dropped_seq = self._floor
+        self._lists.move_to_end(list_id)
+
+        if len(feed.events) == feed.events.maxlen:
+            feed.dropped_seq = feed.events[0].seq
+        event = ListEvent(next(self._clock), kind, product_id, is_bought, count)
+        feed.events.append(event)
+        metrics.incr(f'{self.name}.event')
+
+        while len(self._lists) > self.max_lists:
+            _, evicted = self._lists.popitem(last=False)
+            self._floor = max(self._floor, evicted.events[-1].seq)
+            metrics.incr(f'{self.name}.eviction')
+        return event.seq
+
+    def last_seq(self, list_id: int) -> int:
+        """Номер последнего изменения списка: с него читатель продолжит через since()"""
+        feed = self._lists.get(list_id)
+        if feed is None:
+            return self._floor
+        return feed.events[-1].seq
+
+    def since(self, list_id: int, seq: int) -> Optional[List[ListEvent]]:
+        """События списка после номера seq или None, если часть из них уже вытеснена"""
+        feed = self._lists.get(list_id)
+        if feed is None:
+            return [] if seq >= self._floor else None
+        if seq < feed.dropped_seq:
+            metrics.incr(f'{self.name}.gap')
+            return None
+        return [event for event in feed.events if event.seq > seq]
+
+    def stats(self) -> Dict[str, int]:
+        """Размер журнала и счетчики"""
+        return {
+            'lists': len(self._lists),
+            'events': sum(len(feed.events) for feed in self._lists.values()),
+            'appended': metrics.counters[f'{self.name}.event'],
+            'gaps': metrics.counters[f'{self.name}.gap'],
+            'evictions': metrics.counters[f'{self.name}.eviction'],
+        }
@@ -0,0 +1,51 @@
+from typing import Dict, List
+
+import aiosqlite
+
+# Расхождения list_stats с фактическим содержимым products:
+# списки с товарами и неверными счетчиками, а также ненулевые счетчики пустых списков
+_DRIFT_QUERY = '''
+               WITH actual AS (SELECT list_id,
+                                      COUNT(*)                                       AS total,
+                                      SUM(CASE WHEN is_bought = 1 THEN 1 ELSE 0 END) AS bought
+                               FROM products
+                               GROUP BY list_id)
+               SELECT a.list_id, a.total, a.bought, COALESCE(s.total, 0), COALESCE(s.bought, 0)
+               FROM actual a
+                        LEFT JOIN list_stats s ON s.list_id = a.list_id
+               WHERE a.total != COALESCE(s.total, 0)
+                  OR a.bought != COALESCE(s.bought, 0)
+               UNION ALL
+               SELECT s.list_id, 0, 0, s.total, s.bought
+               FROM list_stats s
+               WHERE (s.total != 0 OR s.bought != 0)
+                 AND NOT EXISTS (SELECT 1 FROM products p WHERE p.list_id = s.list_id)
+               '''
+
+
+async def find_drift(db: aiosqlite.Connection) -> List[Dict[str, int]]:
+    """Списки, у которых счетчики в list_stats не совпадают с products"""
+    cursor = await db.execute(_DRIFT_QUERY)
+    rows = await cursor.fetchall()
+
+    return [
+        {
+            'list_id': row[0],
+            'total': row[1],
+            'bought': row[2],
+            'stored_total': row[3],
+            'stored_bought': row[4],
+        }
+        for row in rows
+    ]
+
+
+async def rebuild(db: aiosqlite.Connection):
+    """Пересчитать list_stats с нуля по таблице products (внутри транзакции вызывающего)"""
+    await db.execute('DELETE FROM list_stats')
+    await db.execute('''
+                     INSERT INTO list_stats (list_id, total, bought)
+                     SELECT list_id, COUNT(*), SUM(CASE WHEN is_bought = 1 THEN 1 ELSE 0 END)
+                     FROM products
+                     GROUP BY list_id
+                     ''')
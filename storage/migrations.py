@@ -0,0 +1,434 @@
+import logging
+from typing import Awaitable, Callable, List, Tuple, Union
+
+import aiosqlite
+
+from utils.product_parser import normalize_name, parse_quantity
+from .products import INSERT_PRODUCT, product_row
+
+logger = logging.getLogger(__name__)
+
+# Шаг миграции - SQL-выражение или async-функция, получающая соединение
+MigrationStep = Union[str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+
+def outside_transaction(step: Callable[[aiosqlite.Connection], Awaitable[None]]):
+    """Пометить шаг, который SQLite не выполняет внутри транзакции (например, VACUUM).
+
+    Миграция с таким шагом применяется без общей транзакции, поэтому ее шаги
+    должны быть безопасны для повторного запуска.
+    """
+    step.outside_transaction = True
+    return step
+
+
+@outside_transaction
+async def _enable_incremental_vacuum(db: aiosqlite.Connection):
+    cursor = await db.execute('PRAGMA auto_vacuum')
+    if (await cursor.fetchone())[0] == 2:
+        return
+
+    # Режим auto_vacuum существующей базы меняется только полным VACUUM
+    await db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    await db.execute('VACUUM')
+
+
+async def _backfill_amounts(db: aiosqlite.Connection):
+    # Разбираем уже сохраненные количества тем же парсером, что и новые товары
+    for table in ('products', 'purchase_history'):
+        cursor = await db.execute(f'SELECT id, quantity FROM {table} WHERE quantity IS NOT NULL')
+        updates = []
+        for row_id, quantity in await cursor.fetchall():
+            amount, unit = parse_quantity(quantity)
+            if amount is not None:
+                updates.append((amount, unit, row_id))
+
+        await db.executemany(f'UPDATE {table} SET amount = ?, unit = ? WHERE id = ?', updates)
+
+
+async def _merge_duplicate_products(db: aiosqlite.Connection):
+    cursor = await db.execute('SELECT id, list_id, name, quantity, is_bought FROM products ORDER BY id')
+    rows = await cursor.fetchall()
+    await db.executemany(
+        'UPDATE products SET normalized_name = ? WHERE id = ?',
+        [(normalize_name(name), row_id) for row_id, _, name, _, _ in rows]
+    )
+
+    # Повторы некупленных товаров убираем и добавляем заново уже через слияние:
+    # количества складываются так же, как при обычном добавлении
+    seen = set()
+    duplicates = []
+    for row_id, list_id, name, quantity, is_bought in rows:
+        if is_bought:
+            continue
+        key = (list_id, normalize_name(name))
+        if key in seen:
+            duplicates.append((row_id, list_id, name, quantity or '1'))
+        seen.add(key)
+
+    await db.executemany('DELETE FROM products WHERE id = ?', [(row[0],) for row in duplicates])
+    await db.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_products_unbought_name '
+        'ON products (list_id, normalized_name) WHERE is_bought = 0'
+    )
+    await db.executemany(INSERT_PRODUCT, [product_row(*row[1:]) for row in duplicates])
+
+
+async def _backfill_product_names(db: aiosqlite.Connection):
+    # Словарь названий собирается из текущих товаров и истории покупок
+    cursor = await db.execute(
+        'SELECT list_id, name, added_at FROM products '
+        'UNION ALL SELECT list_id, name, bought_at FROM purchase_history ORDER BY 3'
+    )
+    await db.executemany(
+        'INSERT INTO product_names (list_id, normalized_name, name, last_used_at) '
+        'VALUES (?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP)) '
+        'ON CONFLICT (list_id, normalized_name) DO UPDATE SET '
+        'uses = uses + 1, name = excluded.name, last_used_at = excluded.last_used_at',
+        [(list_id, normalize_name(name), name, used_at) for list_id, name, used_at in await cursor.fetchall()]
+    )
+
+# (версия, описание, шаги). Версии только добавляются в конец и никогда не меняются:
+# уже примененные миграции повторно не выполняются.
+MIGRATIONS: List[Tuple[int, str, List[MigrationStep]]] = [
+    (1, 'Базовые таблицы', [
+        '''
+        CREATE TABLE IF NOT EXISTS users
+        (
+            user_id    INTEGER PRIMARY KEY,
+            username   TEXT,
+            first_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS shopping_lists
+        (
+            id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id    INTEGER NOT NULL,
+            name       TEXT      DEFAULT 'Основной список',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS products
+        (
+            id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            list_id   INTEGER NOT NULL,
+            name      TEXT    NOT NULL,
+            quantity  TEXT      DEFAULT '1',
+            is_bought INTEGER   DEFAULT 0,
+            added_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (list_id) REFERENCES shopping_lists (id) ON DELETE CASCADE
+        )
+        ''',
+    ]),
+    (2, 'Составные индексы горячих запросов', [
+        # Чтение списка: WHERE list_id = ? ORDER BY is_bought ASC, added_at DESC.
+        # Этот же индекс обслуживает очистку купленных и JOIN в статистике.
+        '''
+        CREATE INDEX IF NOT EXISTS idx_products_list_bought_added
+            ON products (list_id, is_bought, added_at DESC)
+        ''',
+        # get_or_create_list: WHERE user_id = ? AND name = ?
+        '''
+        CREATE INDEX IF NOT EXISTS idx_shopping_lists_user_name
+            ON shopping_lists (user_id, name)
+        ''',
+        # Одиночные индексы из init_database.py перекрываются составными
+        'DROP INDEX IF EXISTS idx_products_list_id',
+        'DROP INDEX IF EXISTS idx_products_is_bought',
+        'DROP INDEX IF EXISTS idx_shopping_lists_user_id',
+    ]),
+    (3, 'Уникальность названия списка у пользователя', [
+        # Дубликаты могли появиться при гонке двух первых запросов:
+        # переносим их товары в самый ранний список и удаляем лишние
+        '''
+        UPDATE products
+        SET list_id = (SELECT MIN(keep.id)
+                       FROM shopping_lists dup
+                                JOIN shopping_lists keep
+                                     ON keep.user_id = dup.user_id AND keep.name IS dup.name
+                       WHERE dup.id = products.list_id)
+        WHERE list_id IN (SELECT dup.id
+                          FROM shopping_lists dup
+                                   JOIN shopping_lists keep
+                                        ON keep.user_id = dup.user_id AND keep.name IS dup.name
+                                            AND keep.id < dup.id)
+        ''',
+        '''
+        DELETE FROM shopping_lists
+        WHERE EXISTS (SELECT 1
+                      FROM shopping_lists keep
+                      WHERE keep.user_id = shopping_lists.user_id
+                        AND keep.name IS shopping_lists.name
+                        AND keep.id < shopping_lists.id)
+        ''',
+        # Позволяет get_or_create_list создавать список одним INSERT ... ON CONFLICT
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_shopping_lists_user_name_unique
+            ON shopping_lists (user_id, name)
+        ''',
+        'DROP INDEX IF EXISTS idx_shopping_lists_user_name',
+    ]),
+    (4, 'Счетчики товаров по спискам', [
+        '''
+        CREATE TABLE IF NOT EXISTS list_stats
+        (
+            list_id INTEGER PRIMARY KEY,
+            total   INTEGER NOT NULL DEFAULT 0,
+            bought  INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        # Счетчики ведет сама база: любое изменение products, в том числе
+        # сделанное в обход Database, сразу отражается в list_stats
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_stats_insert
+            AFTER INSERT ON products
+        BEGIN
+            INSERT INTO list_stats (list_id, total, bought)
+            VALUES (NEW.list_id, 1, CASE WHEN NEW.is_bought = 1 THEN 1 ELSE 0 END)
+            ON CONFLICT (list_id) DO UPDATE SET total  = total + 1,
+                                                bought = bought + excluded.bought;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_stats_delete
+            AFTER DELETE ON products
+        BEGIN
+            UPDATE list_stats
+            SET total  = total - 1,
+                bought = bought - CASE WHEN OLD.is_bought = 1 THEN 1 ELSE 0 END
+            WHERE list_id = OLD.list_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_stats_toggle
+            AFTER UPDATE OF is_bought ON products
+            WHEN OLD.list_id = NEW.list_id
+                AND (OLD.is_bought = 1) IS NOT (NEW.is_bought = 1)
+        BEGIN
+            UPDATE list_stats
+            SET bought = bought + CASE WHEN NEW.is_bought = 1 THEN 1 ELSE -1 END
+            WHERE list_id = NEW.list_id;
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_products_stats_move
+            AFTER UPDATE OF list_id ON products
+            WHEN OLD.list_id != NEW.list_id
+        BEGIN
+            UPDATE list_stats
+            SET total  = total - 1,
+                bought = bought - CASE WHEN OLD.is_bought = 1 THEN 1 ELSE 0 END
+            WHERE list_id = OLD.list_id;
+            INSERT INTO list_stats (list_id, total, bought)
+            VALUES (NEW.list_id, 1, CASE WHEN NEW.is_bought = 1 THEN 1 ELSE 0 END)
+            ON CONFLICT (list_id) DO UPDATE SET total  = total + 1,
+                                                bought = bought + excluded.bought;
+        END
+        ''',
+        '''
+        INSERT INTO list_stats (list_id, total, bought)
+        SELECT list_id, COUNT(*), SUM(CASE WHEN is_bought = 1 THEN 1 ELSE 0 END)
+        FROM products
+        GROUP BY list_id
+        ''',
+    ]),
+    (5, 'Индекс постраничного чтения списка', [
+        # Ключ страницы (is_bought, added_at, id): id в индексе по убыванию,
+        # чтобы товары с одинаковым added_at читались по индексу без сортировки
+        '''
+        CREATE INDEX IF NOT EXISTS idx_products_list_page
+            ON products (list_id, is_bought, added_at DESC, id DESC)
+        ''',
+        'DROP INDEX IF EXISTS idx_products_list_bought_added',
+    ]),
+    (6, 'Архив купленных товаров', [
+        # Время отметки о покупке: по нему архиватор выбирает, что переносить
+        'ALTER TABLE products ADD COLUMN bought_at TIMESTAMP',
+        'UPDATE products SET bought_at = CURRENT_TIMESTAMP WHERE is_bought = 1',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_products_bought_at
+            ON products (bought_at) WHERE is_bought = 1
+        ''',
+        # Только добавление: строки попадают сюда из products и больше не меняются
+        '''
+        CREATE TABLE IF NOT EXISTS purchase_history
+        (
+            id          INTEGER PRIMARY KEY,
+            list_id     INTEGER   NOT NULL,
+            name        TEXT      NOT NULL,
+            quantity    TEXT,
+            added_at    TIMESTAMP,
+            bought_at   TIMESTAMP NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_purchase_history_list_bought
+            ON purchase_history (list_id, bought_at DESC)
+        ''',
+    ]),
+    (7, 'Инкрементальная очистка свободных страниц', [
+        # Освобожденные удалениями страницы копятся в файле и возвращаются
+        # фоновым обслуживанием через PRAGMA incremental_vacuum
+        _enable_incremental_vacuum,
+    ]),
+    (8, 'Числовое количество товаров', [
+        # quantity остается текстом для показа, amount/unit - то же количество
+        # в единицах хранения (г, мл, шт...) для сумм в SQL
+        'ALTER TABLE products ADD COLUMN amount REAL',
+        'ALTER TABLE products ADD COLUMN unit TEXT',
+        'ALTER TABLE purchase_history ADD COLUMN amount REAL',
+        'ALTER TABLE purchase_history ADD COLUMN unit TEXT',
+        _backfill_amounts,
+    ]),
+    (9, 'Слияние одинаковых некупленных товаров', [
+        # Ключ названия и уникальный индекс по некупленной части списка:
+        # повторное добавление товара сливается с ним одним INSERT ... ON CONFLICT
+        'ALTER TABLE products ADD COLUMN normalized_name TEXT',
+        _merge_duplicate_products,
+    ]),
+    (10, 'Полнотекстовый поиск названий товаров', [
+        # Словарь названий списка: одна строка на название, сколько раз его добавляли.
+        # Товары уходят в архив и удаляются, а название остается для подсказок
+        '''
+        CREATE TABLE IF NOT EXISTS product_names
+        (
+            id              INTEGER PRIMARY KEY,
+            list_id         INTEGER NOT NULL,
+            normalized_name TEXT    NOT NULL,
+            name            TEXT    NOT NULL,
+            uses            INTEGER NOT NULL DEFAULT 1,
+            last_used_at    TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (list_id, normalized_name)
+        )
+        ''',
+        # Индекс FTS5 без копии текста (content=''): строки находятся по rowid в product_names.
+        # list_key - токен списка ("l42"), чтобы поиск шел только по словарю своего списка
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS product_names_fts USING fts5(
+            normalized_name, list_key,
+            content = '', tokenize = 'unicode61', prefix = '1 2 3'
+        )
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_product_names_fts
+            AFTER INSERT ON product_names
+        BEGIN
+            INSERT INTO product_names_fts (rowid, normalized_name, list_key)
+            VALUES (NEW.id, NEW.normalized_name, 'l' || NEW.list_id);
+        END
+        ''',
+        # Новые добавления считает Database.add_product (COUNT_PRODUCT_NAME), а не триггер
+        # на products: вставкой туда же снимаются отметки, и такие вставки не добавления
+        _backfill_product_names,
+    ]),
+    (11, 'Общие списки семьи', [
+        # Участники списка. Строка лежит в шарде списка (кому рассылать изменения),
+        # а у участника из другого шарда - еще и в его шарде (какой список ему открывать)
+        '''
+        CREATE TABLE IF NOT EXISTS list_members
+        (
+            list_id   INTEGER NOT NULL,
+            user_id   INTEGER NOT NULL,
+            role      TEXT    NOT NULL DEFAULT 'member',
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (list_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_list_members_user
+            ON list_members (user_id, role, joined_at)
+        ''',
+        # Код приглашения в список, создается при первой ссылке
+        'ALTER TABLE shopping_lists ADD COLUMN invite_code TEXT',
+        # Владелец - тоже участник своего списка
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_shopping_lists_owner
+            AFTER INSERT ON shopping_lists
+        BEGIN
+            INSERT OR IGNORE INTO list_members (list_id, user_id, role)
+            VALUES (NEW.id, NEW.user_id, 'owner');
+        END
+        ''',
+        '''
+        INSERT OR IGNORE INTO list_members (list_id, user_id, role)
+        SELECT id, user_id, 'owner' FROM shopping_lists
+        ''',
+    ]),
+    (12, 'Журнал переноса списков между шардами', [
+        # Списки, скопированные в этот шард при смене числа шардов: по журналу прерванный
+        # перенос не копирует список второй раз, а участники в других шардах получают новый id
+        '''
+        CREATE TABLE IF NOT EXISTS moved_lists
+        (
+            source_id INTEGER PRIMARY KEY,
+            target_id INTEGER NOT NULL
+        )
+        ''',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    """Текущая версия схемы (0 - база без таблицы schema_version)"""
+    cursor = await db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'"
+    )
+    if not await cursor.fetchone():
+        return 0
+
+    cursor = await db.execute('SELECT MAX(version) FROM schema_version')
+    result = await cursor.fetchone()
+    return result[0] or 0
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Применить недостающие миграции к базе на месте, вернуть итоговую версию"""
+    await db.execute('''
+                     CREATE TABLE IF NOT EXISTS schema_version
+                     (
+                         version     INTEGER PRIMARY KEY,
+                         description TEXT,
+                         applied_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                     )
+                     ''')
+    await db.commit()
+
+    current_version = await get_schema_version(db)
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        # Каждая миграция применяется атомарно вместе с записью о версии
+        transactional = not any(getattr(step, 'outside_transaction', False) for step in steps)
+        if transactional:
+            await db.execute('BEGIN')
+        try:
+            for step in steps:
+                if isinstance(step, str):
+                    await db.execute(step)
+                else:
+                    await step(db)
+
+            await db.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            await db.commit()
+        except Exception:
+            if db.in_transaction:
+                await db.rollback()
+            logger.error(f"❌ Миграция {version} ({description}) не применена")
+            raise
+
+        current_version = version
+        logger.info(f"🧱 Применена миграция {version}: {description}")
+
+    return current_version
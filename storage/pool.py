@@ -0,0 +1,144 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+# Операция с базой: async-функция, получающая соединение и выполняющая на нем весь свой SQL
+DbJob = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений aiosqlite: один писатель и несколько читателей.
+
+    Каждое соединение aiosqlite - это отдельный поток и повторное чтение схемы,
+    поэтому соединения открываются один раз и переиспользуются всеми методами Database.
+    В режиме WAL читатели не ждут коммитов писателя, а запись идет строго
+    через одно соединение под замком.
+    """
+
+    def __init__(self, path: str, readers: int = 3, pragmas: Dict[str, Union[str, int]] = None):
+        self.path = path
+        self.readers = max(1, readers)
+        self.pragmas = dict(pragmas or {})
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._connections: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._idle_readers is not None
+
+    async def open(self):
+        """Открыть соединения пула (повторный вызов ничего не делает)"""
+        async with self._open_lock:
+            if self._idle_readers is not None:
+                return
+
+            idle_readers = asyncio.Queue()
+            try:
+                # Писатель открывается первым: он переводит файл базы в WAL
+                self._writer = await self._connect(read_only=False)
+                for _ in range(self.readers):
+                    idle_readers.put_nowait(await self._connect(read_only=True))
+            except Exception:
+                await self._close_connections()
+                raise
+
+            self._idle_readers = idle_readers
+            logger.info(
+                f"🔌 Пул соединений открыт: 1 писатель + {self.readers} читателей "
+                f"({self.path}, journal_mode={self.pragmas.get('journal_mode', 'по умолчанию')})"
+            )
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        async with self._open_lock:
+            if self._idle_readers is None:
+                return
+
+            # Дожидаемся текущей записи, чтобы не оборвать транзакцию
+            async with self._write_lock:
+                self._idle_readers = None
+                await self._close_connections()
+            logger.info("🔌 Пул соединений закрыт")
+
+    async def _connect(self, read_only: bool) -> aiosqlite.Connection:
+        """Открыть соединение и применить к нему профиль PRAGMA"""
+        connection = await aiosqlite.connect(self.path)
+        self._connections.append(connection)
+
+        for name, value in self.pragmas.items():
+            # journal_mode хранится в файле базы - достаточно установить его писателем
+            if read_only and name == 'journal_mode':
+                continue
+            await connection.execute(f'PRAGMA {name} = {value}')
+
+        if read_only:
+            # Страховка от случайной записи через соединение читателя
+            await connection.execute('PRAGMA query_only = ON')
+
+        return connection
+
+    async def _close_connections(self):
+        for connection in self._connections:
+            try:
+                await connection.close()
+            except Exception as e:
+                logger.error(f"❌ Ошибка закрытия соединения: {e}")
+        self._connections.clear()
+        self._writer = None
+
+    async def set_trace_callback(self, callback):
+        """Передавать каждое выполняемое SQL-выражение всех соединений в callback (None - отключить)"""
+        if self._idle_readers is None:
+            await self.open()
+
+        for connection in self._connections:
+            await connection.set_trace_callback(callback)
+
+    async def read(self, job: DbJob) -> Any:
+        """Выполнить операцию чтения на свободном соединении читателя"""
+        async with self.reader() as db:
+            return await job(db)
+
+    async def write(self, job: DbJob) -> Any:
+        """Выполнить операцию на соединении писателя (незавершенная транзакция будет откатана)"""
+        async with self.writer() as db:
+            return await job(db)
+
+    @asynccontextmanager
+    async def reader(self):
+        """Взять соединение читателя на время операции"""
+        if self._idle_readers is None:
+            await self.open()
+
+        idle_readers = self._idle_readers
+        connection = await idle_readers.get()
+        try:
+            yield connection
+        finally:
+            idle_readers.put_nowait(connection)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Получить единственное соединение писателя (операции записи идут по очереди)"""
+        if self._idle_readers is None:
+            await self.open()
+
+        async with self._write_lock:
+            connection = self._writer
+            try:
+                yield connection
+            finally:
+                # Незавершенная транзакция не должна достаться следующему владельцу
+                if connection.in_transaction:
+                    try:
+                        await connection.rollback()
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка отката транзакции: {e}")
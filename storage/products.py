@@ -0,0 +1,54 @@
+from typing import Tuple
+
+from utils.product_parser import normalize_name, parse_quantity
+
+# Некупленный товар с тем же названием уже есть в списке - сливаем количества:
+# одна единица складывается (формат как у format_amount), разные перечисляются через "+"
+_MERGE_QUANTITY = '''
+    ON CONFLICT (list_id, normalized_name) WHERE is_bought = 0 DO UPDATE SET
+        amount   = CASE WHEN products.unit = excluded.unit THEN products.amount + excluded.amount END,
+        unit     = CASE WHEN products.unit = excluded.unit THEN products.unit END,
+        quantity = CASE
+            WHEN products.unit = 'г' AND excluded.unit = 'г' AND products.amount + excluded.amount >= 1000
+                THEN printf('%g кг', (products.amount + excluded.amount) / 1000.0)
+            WHEN products.unit = 'мл' AND excluded.unit = 'мл' AND products.amount + excluded.amount >= 1000
+                THEN printf('%g л', (products.amount + excluded.amount) / 1000.0)
+            WHEN products.unit = excluded.unit
+                THEN printf('%g %s', products.amount + excluded.amount, products.unit)
+            ELSE products.quantity || ' + ' || excluded.quantity
+        END
+'''
+
+# Добавление товара с параметрами из product_row
+INSERT_PRODUCT = f'''
+    INSERT INTO products (list_id, name, normalized_name, quantity, amount, unit, is_bought)
+    VALUES (?, ?, ?, ?, ?, ?, 0)
+    {_MERGE_QUANTITY}
+'''
+
+# Добавление товара засчитывается его названию в словаре подсказок (параметры - product_row()[:3]).
+# Только здесь: снятие отметок и переносы вставляют строки products, но не добавляют товар
+COUNT_PRODUCT_NAME = '''
+    INSERT INTO product_names (list_id, name, normalized_name)
+    VALUES (?, ?, ?)
+    ON CONFLICT (list_id, normalized_name) DO UPDATE SET
+        uses = uses + 1, name = excluded.name, last_used_at = CURRENT_TIMESTAMP
+'''
+
+# Вернуть купленные товары списка в некупленные, сливая их с уже некупленными
+# (вместе с RESTORE_DELETE - UPDATE is_bought = 0 нарушил бы уникальность названий)
+RESTORE_PRODUCTS = f'''
+    INSERT INTO products (list_id, name, normalized_name, quantity, amount, unit, added_at, is_bought)
+    SELECT list_id, name, normalized_name, quantity, amount, unit, added_at, 0
+    FROM products
+    WHERE {{where}} AND is_bought = 1
+    ORDER BY id
+    {_MERGE_QUANTITY}
+'''
+RESTORE_DELETE = 'DELETE FROM products WHERE {where} AND is_bought = 1 RETURNING list_id'
+
+
+def product_row(list_id: int, name: str, quantity: str) -> Tuple:
+    """Параметры INSERT_PRODUCT для товара"""
+    name, quantity = name.strip(), quantity.strip()
+    return (list_id, name, normalize_name(name), quantity, *parse_quantity(quantity))
@@ -0,0 +1,219 @@
+from typing import Dict
+
+import aiosqlite
+
+from .products import _MERGE_QUANTITY
+from .shards import user_shard_index
+
+# Псевдоним подключенного (ATTACH) файла шарда, в который переносятся данные
+TARGET = 'target'
+
+
+async def misplaced_users(db: aiosqlite.Connection, index: int, shard_count: int) -> Dict[int, int]:
+    """Пользователи, чьи данные лежат в шарде index, а хэш ведет в другой: user_id -> домашний шард.
+
+    Такие пользователи появляются, когда в существующей базе включают шарды
+    или меняют их число.
+    """
+    cursor = await db.execute(
+        'SELECT user_id FROM users UNION SELECT user_id FROM shopping_lists '
+        "UNION SELECT user_id FROM list_members WHERE role = 'member' "
+        'AND list_id NOT IN (SELECT id FROM shopping_lists)'
+    )
+    homes = {}
+    for (user_id,) in await cursor.fetchall():
+        home = user_shard_index(user_id, shard_count)
+        if home != index:
+            homes[user_id] = home
+    return homes
+
+
+async def move_user(db: aiosqlite.Connection, target_path: str, user_id: int, index: int,
+                    shard_count: int) -> Dict[int, int]:
+    """Перенести пользователя из шарда index (соединение db) в файл target_path.
+
+    Списки получают новые id в диапазоне целевого шарда (по ним Database
+    находит шард), товары, история и словарь названий переходят вместе со
+    списком. Если в целевом шарде у пользователя уже есть список с тем же
+    названием (создан после включения шардов), товары сливаются в него.
+
+    Фиксация сразу двух файлов в режиме WAL не атомарна, поэтому перенос идет
+    двумя транзакциями: копирование пишет только целевой файл (вместе со строкой
+    moved_lists о каждом скопированном списке), удаление - только исходный.
+    Если перенос прервался между ними, повторный вызов находит списки в
+    moved_lists и не копирует их второй раз. Возвращает перенумерацию списков
+    {старый id: новый id}.
+    """
+    await db.execute(f'ATTACH DATABASE ? AS {TARGET}', (target_path,))
+    try:
+        await db.execute('BEGIN')
+        remap = await _copy_user(db, user_id)
+        await db.commit()
+
+        await db.execute('BEGIN')
+        await _delete_user(db, user_id, index, shard_count)
+        await db.commit()
+        return remap
+    finally:
+        if db.in_transaction:
+            await db.rollback()
+        await db.execute(f'DETACH DATABASE {TARGET}')
+
+
+async def _copy_user(db: aiosqlite.Connection, user_id: int) -> Dict[int, int]:
+    await db.execute(
+        f'INSERT OR IGNORE INTO {TARGET}.users (user_id, username, first_name, created_at) '
+        'SELECT user_id, username, first_name, created_at FROM users WHERE user_id = ?',
+        (user_id,)
+    )
+
+    remap = {}
+    cursor = await db.execute(
+        'SELECT id, name, created_at, invite_code FROM shopping_lists WHERE user_id = ? ORDER BY id',
+        (user_id,)
+    )
+    for list_id, name, created_at, invite_code in await cursor.fetchall():
+        remap[list_id] = await _copy_list(db, user_id, list_id, name, created_at, invite_code)
+
+    # Строки участия пользователя в чужих списках: копия "какой список открывать"
+    # переезжает с ним, а строка шарда самого списка остается на месте
+    await db.execute(
+        f'INSERT OR IGNORE INTO {TARGET}.list_members (list_id, user_id, role, joined_at) '
+        "SELECT list_id, user_id, role, joined_at FROM list_members WHERE user_id = ? AND role = 'member'",
+        (user_id,)
+    )
+    return remap
+
+
+async def _delete_user(db: aiosqlite.Connection, user_id: int, index: int, shard_count: int):
+    cursor = await db.execute('SELECT id FROM shopping_lists WHERE user_id = ?', (user_id,))
+    for (list_id,) in await cursor.fetchall():
+        await _delete_list(db, list_id, index, shard_count)
+
+    await db.execute(
+        "DELETE FROM list_members WHERE user_id = ? AND role = 'member' "
+        'AND list_id NOT IN (SELECT id FROM shopping_lists)',
+        (user_id,)
+    )
+    await db.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
+
+
+async def _copy_list(db: aiosqlite.Connection, user_id: int, list_id: int, name: str, created_at: str,
+                     invite_code: str) -> int:
+    # Список уже скопирован прерванным переносом - остается удалить его из исходного шарда
+    cursor = await db.execute(f'SELECT target_id FROM {TARGET}.moved_lists WHERE source_id = ?', (list_id,))
+    copied = await cursor.fetchone()
+    if copied:
+        return copied[0]
+
+    cursor = await db.execute(
+        f'SELECT id FROM {TARGET}.shopping_lists WHERE user_id = ? AND name = ?',
+        (user_id, name)
+    )
+    existing = await cursor.fetchone()
+    if existing:
+        new_id = existing[0]
+        await db.execute(
+            f'UPDATE {TARGET}.shopping_lists SET invite_code = COALESCE(invite_code, ?) WHERE id = ?',
+            (invite_code, new_id)
+        )
+    else:
+        # Триггеры целевого шарда сами добавят владельца в участники
+        cursor = await db.execute(
+            f'INSERT INTO {TARGET}.shopping_lists (user_id, name, created_at, invite_code) '
+            'VALUES (?, ?, ?, ?) RETURNING id',
+            (user_id, name, created_at, invite_code)
+        )
+        new_id = (await cursor.fetchone())[0]
+
+    # Словарь названий: счетчики добавлений складываются со списком, созданным в целевом шарде
+    await db.execute(
+        f'''
+        INSERT INTO {TARGET}.product_names (list_id, normalized_name, name, uses, last_used_at)
+        SELECT ?, normalized_name, name, uses, last_used_at FROM product_names WHERE list_id = ? ORDER BY id
+        ON CONFLICT (list_id, normalized_name) DO UPDATE SET
+            uses = uses + excluded.uses, last_used_at = MAX(last_used_at, excluded.last_used_at)
+        ''',
+        (new_id, list_id)
+    )
+    for is_bought in (1, 0):
+        await db.execute(
+            f'''
+            INSERT INTO {TARGET}.products
+                (list_id, name, normalized_name, quantity, amount, unit, is_bought, added_at, bought_at)
+            SELECT ?, name, normalized_name, quantity, amount, unit, is_bought, added_at, bought_at
+            FROM products
+            WHERE list_id = ? AND is_bought = ?
+            ORDER BY id
+            {_MERGE_QUANTITY if not is_bought else ''}
+            ''',
+            (new_id, list_id, is_bought)
+        )
+    await db.execute(
+        f'INSERT INTO {TARGET}.purchase_history '
+        '(list_id, name, quantity, amount, unit, added_at, bought_at, archived_at) '
+        'SELECT ?, name, quantity, amount, unit, added_at, bought_at, archived_at '
+        'FROM purchase_history WHERE list_id = ? ORDER BY id',
+        (new_id, list_id)
+    )
+    await db.execute(
+        f'INSERT OR IGNORE INTO {TARGET}.list_members (list_id, user_id, role, joined_at) '
+        "SELECT ?, user_id, role, joined_at FROM list_members WHERE list_id = ? AND role = 'member'",
+        (new_id, list_id)
+    )
+    await db.execute(
+        f'INSERT INTO {TARGET}.moved_lists (source_id, target_id) VALUES (?, ?)', (list_id, new_id)
+    )
+    return new_id
+
+
+async def _delete_list(db: aiosqlite.Connection, list_id: int, index: int, shard_count: int):
+    # Индекс FTS5 без копии текста удаляет строки только специальной командой 'delete'
+    await db.execute(
+        "INSERT INTO product_names_fts (product_names_fts, rowid, normalized_name, list_key) "
+        "SELECT 'delete', id, normalized_name, 'l' || list_id FROM product_names WHERE list_id = ?",
+        (list_id,)
+    )
+    for table in ('product_names', 'products', 'purchase_history', 'list_stats'):
+        await db.execute(f'DELETE FROM {table} WHERE list_id = ?', (list_id,))
+
+    # Участники, живущие в этом шарде или еще ждущие своего переноса, хранят здесь
+    # свою копию строки участия - ее перенумерует remap_lists (а перенос участника
+    # заберет с собой). Строки остальных участников уходят вместе со списком
+    cursor = await db.execute(
+        "SELECT user_id FROM list_members WHERE list_id = ? AND role = 'member' "
+        'AND user_id NOT IN (SELECT user_id FROM users UNION SELECT user_id FROM shopping_lists)',
+        (list_id,)
+    )
+    leaving = [
+        (list_id, member_id) for (member_id,) in await cursor.fetchall()
+        if user_shard_index(member_id, shard_count) != index
+    ]
+    await db.executemany('DELETE FROM list_members WHERE list_id = ? AND user_id = ?', leaving)
+    await db.execute("DELETE FROM list_members WHERE list_id = ? AND role = 'owner'", (list_id,))
+    await db.execute('DELETE FROM shopping_lists WHERE id = ?', (list_id,))
+
+
+async def moved_lists(db: aiosqlite.Connection) -> Dict[int, int]:
+    """Списки, перенесенные в этот шард: {старый id: новый id}"""
+    cursor = await db.execute('SELECT source_id, target_id FROM moved_lists')
+    return dict(await cursor.fetchall())
+
+
+async def remap_lists(db: aiosqlite.Connection, remap: Dict[int, int]) -> int:
+    """Перенумеровать перенесенные списки в строках участников этого шарда (повторный вызов безопасен)"""
+    moved = 0
+    for old_id, new_id in remap.items():
+        cursor = await db.execute(
+            'UPDATE OR IGNORE list_members SET list_id = ? WHERE list_id = ?', (new_id, old_id)
+        )
+        moved += cursor.rowcount
+        await db.execute('DELETE FROM list_members WHERE list_id = ?', (old_id,))
+    await db.commit()
+    return moved
+
+
+async def forget_moved_lists(db: aiosqlite.Connection):
+    """Очистить журнал переноса, когда перенумерация применена во всех шардах"""
+    await db.execute('DELETE FROM moved_lists')
+    await db.commit()
@@ -0,0 +1,89 @@
+import os
+import zlib
+from typing import Iterator, List, Union
+
+import aiosqlite
+
+from .pool import ConnectionPool
+from .threaded_pool import ThreadedPool
+from .write_queue import WriteQueue
+
+# Старшие биты id списка или товара - номер шарда: у шарда k AUTOINCREMENT
+# начинается с k << SHARD_ID_BITS, поэтому шард находится по самому id без поиска
+SHARD_ID_BITS = 40
+
+# Таблицы, чьи id используются как ключи маршрутизации
+ROUTED_TABLES = ('shopping_lists', 'products')
+
+
+def user_shard_index(user_id: int, shards: int) -> int:
+    """Номер шарда пользователя: crc32 от user_id по модулю числа шардов"""
+    if shards == 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+def shard_path(path: str, index: int) -> str:
+    """Файл шарда: нулевой шард - это сама DATABASE_URL, остальные рядом с ней"""
+    if index == 0:
+        return path
+
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext or '.db'}"
+
+
+async def reserve_id_range(db: aiosqlite.Connection, index: int):
+    """Сдвинуть счетчики AUTOINCREMENT шарда в его диапазон id (повторный вызов безопасен)"""
+    if index == 0:
+        return
+
+    first_id = index << SHARD_ID_BITS
+    for table in ROUTED_TABLES:
+        await db.execute(
+            'INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? '
+            'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)',
+            (table, first_id, table)
+        )
+        await db.execute(
+            'UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?',
+            (first_id, table, first_id)
+        )
+    await db.commit()
+
+
+class Shard:
+    """Один файл базы: свой пул соединений и своя очередь записи"""
+
+    def __init__(self, index: int, pool: Union[ConnectionPool, ThreadedPool], write_queue: WriteQueue):
+        self.index = index
+        self.pool = pool
+        self.write_queue = write_queue
+
+
+class ShardRouter:
+    """Выбор шарда по user_id (хэш) или по id списка/товара (старшие биты).
+
+    Все данные пользователя - его списки и их товары - лежат в одном шарде,
+    поэтому любой метод Database работает ровно с одним файлом, а записи
+    разных пользователей не ждут общую блокировку базы.
+    """
+
+    def __init__(self, shards: List[Shard]):
+        self.shards = shards
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def __iter__(self) -> Iterator[Shard]:
+        return iter(self.shards)
+
+    def __getitem__(self, index: int) -> Shard:
+        return self.shards[index]
+
+    def for_user(self, user_id: int) -> Shard:
+        """Шард пользователя"""
+        return self.shards[user_shard_index(user_id, len(self.shards))]
+
+    def for_id(self, row_id: int) -> Shard:
+        """Шард, в котором создан список или товар с этим id"""
+        return self.shards[row_id >> SHARD_ID_BITS]
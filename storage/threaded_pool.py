@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+from .pool import DbJob
+
+logger = logging.getLogger(__name__)
+
+
+class _SyncCursor:
+    """Курсор sqlite3 с awaitable-методами курсора aiosqlite"""
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        self._cursor = cursor
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self) -> Optional[int]:
+        return self._cursor.lastrowid
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+    async def fetchall(self) -> List[Any]:
+        return self._cursor.fetchall()
+
+
+class _SyncConnection:
+    """Соединение sqlite3 с интерфейсом aiosqlite, выполняющее вызовы сразу в текущем потоке.
+
+    Операции Database написаны для aiosqlite, но с этим соединением ни один
+    await внутри них не приостанавливается, и всю операцию можно выполнить
+    в потоке пула за один проход.
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self._connection = connection
+
+    @property
+    def in_transaction(self) -> bool:
+        return self._connection.in_transaction
+
+    async def execute(self, sql: str, parameters=()) -> _SyncCursor:
+        return _SyncCursor(self._connection.execute(sql, parameters))
+
+    async def executemany(self, sql: str, parameters) -> _SyncCursor:
+        return _SyncCursor(self._connection.executemany(sql, parameters))
+
+    async def executescript(self, sql: str) -> _SyncCursor:
+        return _SyncCursor(self._connection.executescript(sql))
+
+    async def commit(self):
+        self._connection.commit()
+
+    async def rollback(self):
+        self._connection.rollback()
+
+
+def _drive(job: DbJob, connection: _SyncConnection) -> Any:
+    """Выполнить операцию до конца в текущем потоке"""
+    coroutine = job(connection)
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        return stop.value
+
+    coroutine.close()
+    raise RuntimeError("Операция с базой ждет событие цикла asyncio - в потоке пула так нельзя")
+
+
+class ThreadedPool:
+    """Пул соединений sqlite3 на небольшом общем пуле потоков.
+
+    В отличие от aiosqlite, где каждый execute и fetch - отдельный переход
+    в поток соединения, здесь операция Database целиком выполняется в одном
+    потоке: один переход туда и один обратно. Записи идут через единственный
+    поток писателя и поэтому выполняются строго по очереди.
+    """
+
+    def __init__(self, path: str, readers: int = 3, pragmas: Dict[str, Union[str, int]] = None,
+                 cached_statements: int = 256):
+        self.path = path
+        self.readers = max(1, readers)
+        self.pragmas = dict(pragmas or {})
+        self.cached_statements = cached_statements
+        self._connections: List[sqlite3.Connection] = []
+        self._writer: Optional[sqlite3.Connection] = None
+        self._idle_readers: 'queue.SimpleQueue[sqlite3.Connection]' = queue.SimpleQueue()
+        self._write_executor: Optional[ThreadPoolExecutor] = None
+        self._read_executor: Optional[ThreadPoolExecutor] = None
+        self._open_lock = asyncio.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self._write_executor is not None
+
+    async def open(self):
+        """Открыть соединения и потоки пула (повторный вызов ничего не делает)"""
+        async with self._open_lock:
+            if self._write_executor is not None:
+                return
+
+            self._write_executor = ThreadPoolExecutor(1, thread_name_prefix='sqlite-writer')
+            self._read_executor = ThreadPoolExecutor(self.readers, thread_name_prefix='sqlite-reader')
+            try:
+                await asyncio.to_thread(self._open_connections)
+            except Exception:
+                self._close_connections()
+                self._shutdown_executors()
+                raise
+
+            logger.info(
+                f"🔌 Пул sqlite3 открыт: 1 писатель + {self.readers} читателей "
+                f"({self.path}, journal_mode={self.pragmas.get('journal_mode', 'по умолчанию')})"
+            )
+
+    def _open_connections(self):
+        # Писатель открывается первым: он переводит файл базы в WAL
+        self._writer = self._connect(read_only=False)
+        for _ in range(self.readers):
+            self._idle_readers.put(self._connect(read_only=True))
+
+    def _connect(self, read_only: bool) -> sqlite3.Connection:
+        """Открыть соединение и применить к нему профиль PRAGMA"""
+        # Соединение переходит между потоками пула, но одновременно им пользуется только один
+        connection = sqlite3.connect(
+            self.path, check_same_thread=False, cached_statements=self.cached_statements
+        )
+        self._connections.append(connection)
+
+        for name, value in self.pragmas.items():
+            # journal_mode хранится в файле базы - достаточно установить его писателем
+            if read_only and name == 'journal_mode':
+                continue
+            connection.execute(f'PRAGMA {name} = {value}')
+
+        if read_only:
+            # Страховка от случайной записи через соединение читателя
+            connection.execute('PRAGMA query_only = ON')
+
+        return connection
+
+    async def close(self):
+        """Дождаться начатых операций и закрыть соединения пула"""
+        async with self._open_lock:
+            if self._write_executor is None:
+                return
+
+            await asyncio.to_thread(self._shutdown_executors)
+            self._close_connections()
+            logger.info("🔌 Пул sqlite3 закрыт")
+
+    def _shutdown_executors(self):
+        for executor in (self._write_executor, self._read_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._write_executor = self._read_executor = None
+
+    def _close_connections(self):
+        for connection in self._connections:
+            try:
+                connection.close()
+            except Exception as e:
+                logger.error(f"❌ Ошибка закрытия соединения: {e}")
+        self._connections.clear()
+        self._writer = None
+        self._idle_readers = queue.SimpleQueue()
+
+    async def set_trace_callback(self, callback):
+        """Передавать каждое выполняемое SQL-выражение всех соединений в callback (None - отключить)"""
+        if self._write_executor is None:
+            await self.open()
+
+        for connection in self._connections:
+            connection.set_trace_callback(callback)
+
+    async def read(self, job: DbJob) -> Any:
+        """Выполнить операцию чтения в потоке читателей"""
+        if self._write_executor is None:
+            await self.open()
+
+        return await asyncio.get_running_loop().run_in_executor(self._read_executor, self._run_read, job)
+
+    async def write(self, job: DbJob) -> Any:
+        """Выполнить операцию в потоке писателя (незавершенная транзакция будет откатана)"""
+        if self._write_executor is None:
+            await self.open()
+
+        return await asyncio.get_running_loop().run_in_executor(self._write_executor, self._run_write, job)
+
+    def _run_read(self, job: DbJob) -> Any:
+        # Потоков читателей столько же, сколько соединений: свободное есть всегда
+        connection = self._idle_readers.get()
+        try:
+            return _drive(job, _SyncConnection(connection))
+        finally:
+            self._idle_readers.put(connection)
+
+    def _run_write(self, job: DbJob) -> Any:
+        connection = self._writer
+        try:
+            return _drive(job, _SyncConnection(connection))
+        finally:
+            # Незавершенная транзакция не должна достаться следующей операции
+            if connection.in_transaction:
+                try:
+                    connection.rollback()
+                except Exception as e:
+                    logger.error(f"❌ Ошибка отката транзакции: {e}")
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Union
+
+import aiosqlite
+
+from .pool import ConnectionPool
+from .threaded_pool import ThreadedPool
+
+logger = logging.getLogger(__name__)
+
+# Задание записи: async-функция, выполняющая SQL на соединении писателя без commit
+WriteJob = Callable[..., Awaitable[Any]]
+
+
+class WriteQueue:
+    """Групповая фиксация (group commit) изменений через одну фоновую задачу.
+
+    Изменения, пришедшие почти одновременно, выполняются в одной транзакции
+    и фиксируются одним commit, а вызывающий получает свой результат.
+    Если задание падает, пачка повторяется с изоляцией заданий SAVEPOINT'ами,
+    так что ошибка одного не откатывает остальные.
+    """
+
+    def __init__(self, pool: Union[ConnectionPool, ThreadedPool], window: float = 0.002, max_batch: int = 100):
+        self.pool = pool
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Время последней пачки (time.monotonic); по нему фоновые задачи узнают, что база простаивает
+        self.last_commit_at = 0.0
+
+    async def submit(self, job: WriteJob, *args) -> Any:
+        """Поставить задание в очередь и дождаться его результата"""
+        if self._worker is None or self._worker.done():
+            self.start()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((job, args, future))
+        return await future
+
+    def start(self):
+        """Запустить фоновую задачу-писателя"""
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run(self._queue))
+
+    async def stop(self):
+        """Дописать принятые задания и остановить фоновую задачу"""
+        if self._worker is None:
+            return
+
+        self._queue.put_nowait(None)
+        try:
+            await self._worker
+        finally:
+            self._worker = None
+            self._queue = None
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        contended = False
+
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stopping = False
+            # Одиночная запись без конкурентов не ждет окна: ждать имеет смысл,
+            # только если предыдущая пачка собрала несколько изменений
+            deadline = loop.time() + (self.window if contended else 0)
+
+            # Собираем все, что успело прийти за короткое окно
+            while len(batch) < self.max_batch:
+                try:
+                    if queue.empty():
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        item = await asyncio.wait_for(queue.get(), timeout)
+                    else:
+                        item = queue.get_nowait()
+                except asyncio.TimeoutError:
+                    break
+
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._commit_batch(batch)
+            self.last_commit_at = time.monotonic()
+            contended = len(batch) > 1
+
+            if stopping:
+                return
+
+    async def _commit_batch(self, batch: List[tuple]):
+        try:
+            try:
+                # Обычный случай: все задания успешны, одна транзакция без лишних SAVEPOINT
+                results = await self._execute_batch(batch, isolated=False)
+            except _JobFailed:
+                # Кто-то упал - повторяем пачку, изолируя каждое задание SAVEPOINT'ом
+                results = await self._execute_batch(batch, isolated=True)
+
+        except Exception as e:
+            logger.error(f"❌ Ошибка групповой записи ({len(batch)} заданий): {e}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, _, future), (ok, value) in zip(batch, results):
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+        if len(batch) > 1:
+            logger.debug(f"💾 Групповая запись: {len(batch)} заданий одним commit")
+
+    async def _execute_batch(self, batch: List[tuple], isolated: bool) -> List[tuple]:
+        # Вся пачка - одна операция пула: для движка sqlite3 это один переход в поток писателя
+        async def run_batch(db) -> List[tuple]:
+            results = []
+            await db.execute('BEGIN')
+
+            for job, args, _ in batch:
+                if isolated:
+                    results.append(await self._run_isolated(db, job, args))
+                    continue
+
+                try:
+                    results.append((True, await job(db, *args)))
+                except Exception as e:
+                    # Откат транзакции выполнит пул по завершении операции
+                    raise _JobFailed() from e
+
+            await db.commit()
+            return results
+
+        return await self.pool.write(run_batch)
+
+    @staticmethod
+    async def _run_isolated(db: aiosqlite.Connection, job: WriteJob, args: tuple) -> tuple:
+        await db.execute('SAVEPOINT write_job')
+        try:
+            value = await job(db, *args)
+        except Exception as e:
+            await db.execute('ROLLBACK TO write_job')
+            await db.execute('RELEASE write_job')
+            return False, e
+
+        await db.execute('RELEASE write_job')
+        return True, value
+
+
+class _JobFailed(Exception):
+    """Одно из заданий пачки завершилось ошибкой"""
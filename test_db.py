@@ -1,6 +1,50 @@
 import asyncio
+import os
 import sqlite3
-from database import Database, init_db
+import time
+import database
+from database import Database, init_db, close_db, archive_bought_products, backup_databases, run_maintenance
+from storage.cache import ListCache
+from storage.change_feed import ChangeFeed
+from config import BACKUP_DIR
+from storage import backup, rebalance
+from storage.shards import ShardRouter, shard_path, user_shard_index
+from utils.ai_scheduler import AIQueueFull, AIScheduler
+from utils.list_fanout import ListFanout, apply_changes
+from utils.perplexity_client import TRUNCATED_NOTE, PerplexityClient
+from utils.response_cache import ResponseCache
+from utils.singleflight import SingleFlight
+
+# Служебные выражения управления транзакциями не считаются обращениями к данным
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+# Выражения, которые SQLite выполняет сам: тела триггеров ("-- ...") и служебные
+# запросы модуля FTS5 к его теневым таблицам ('main'.'product_names_fts_...')
+INTERNAL_STATEMENT_PREFIX = '--'
+FTS_SHADOW_TABLE_MARKER = "'main'."
+
+
+class QueryCounter:
+    """Счетчик SQL-выражений, выполненных через пул соединений Database"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, statement: str):
+        if statement.lstrip().upper().startswith(TRANSACTION_STATEMENTS):
+            return
+        if statement.lstrip().startswith(INTERNAL_STATEMENT_PREFIX) or FTS_SHADOW_TABLE_MARKER in statement:
+            return
+        # Срабатывание триггера SQLite сообщает повтором внешнего выражения
+        if self.statements and self.statements[-1] == statement:
+            return
+        self.statements.append(statement)
+
+    async def count(self, coroutine) -> int:
+        """Выполнить вызов и вернуть, сколько выражений он отправил в SQLite"""
+        self.statements.clear()
+        await coroutine
+        return len(self.statements)
 
 
 async def test_database():
@@ -39,6 +83,1108 @@ async def test_database():
     print(f"📊 Продуктов в базе (SQLite): {count}")
     conn.close()
 
+    # Закрываем пул соединений, иначе его потоки не дадут процессу завершиться
+    await close_db()
+
+
+async def test_query_counts():
+    """Проверяем, сколько SQL-выражений выполняет каждый публичный метод Database"""
+    print("🧪 Считаем обращения к SQLite...")
+
+    await init_db()
+    counter = QueryCounter()
+    for shard in database.shards:
+        await shard.pool.set_trace_callback(counter)
+
+    user_id = 888888
+    database.list_ids_cache.pop((user_id, database.DEFAULT_LIST_NAME))
+
+    # (название, ожидаемое число выражений, фабрика вызова)
+    cases = [
+        ("add_user", 1, lambda: Database.add_user(user_id, "counter", "Счетчик")),
+        ("get_or_create_list (новый)", 2, lambda: Database.get_or_create_list(user_id)),
+        ("get_or_create_list (из кэша)", 0, lambda: Database.get_or_create_list(user_id)),
+        # Товар и счетчик его названия в словаре подсказок
+        ("add_product", 2, lambda: Database.add_product(list_id, "Хлеб", "1 буханка")),
+        # executemany: одно обращение к потоку базы, трассировка видит выполнение на каждую строку
+        ("add_multiple_products (3 шт)", 6, lambda: Database.add_multiple_products(
+            list_id, [{'name': name, 'quantity': "200 г"} for name in ("Сыр", "Творог", "Кефир")]
+        )),
+        ("search_product_names (промах кэша)", 1, lambda: Database.search_product_names(list_id, "сы")),
+        ("search_product_names (из кэша)", 0, lambda: Database.search_product_names(list_id, "сы")),
+        ("get_products (промах кэша)", 1, lambda: Database.get_products(list_id)),
+        ("get_products (из кэша)", 0, lambda: Database.get_products(list_id)),
+        ("get_products_page (промах кэша)", 1, lambda: Database.get_products_page(list_id, None, 2)),
+        ("get_products_page (из кэша)", 0, lambda: Database.get_products_page(list_id, None, 2)),
+        ("toggle_product_bought", 1, lambda: Database.toggle_product_bought(product_id)),
+        ("mark_all_products", 1, lambda: Database.mark_all_products(list_id, True)),
+        # DELETE ... RETURNING и executemany в историю: трассировка видит вставку каждого из 4 товаров
+        ("clear_bought_products", 5, lambda: Database.clear_bought_products(list_id)),
+        ("delete_product", 1, lambda: Database.delete_product(product_id)),
+        ("clear_all_products", 1, lambda: Database.clear_all_products(list_id)),
+        ("get_list_stats (промах кэша)", 1, lambda: Database.get_list_stats(list_id)),
+        ("get_list_stats (из кэша)", 0, lambda: Database.get_list_stats(list_id)),
+        # Счетчики основного списка пользователя - из того же кэша
+        ("get_user_stats", 0, lambda: Database.get_user_stats(user_id)),
+    ]
+
+    failures = []
+    list_id = product_id = None
+    for name, expected, call in cases:
+        actual = await counter.count(call())
+
+        if name.startswith("get_or_create_list"):
+            list_id = await Database.get_or_create_list(user_id)
+        if name.startswith(("add_product", "add_multiple_products")):
+            product_id = (await Database.get_products(list_id))[0]['id']
+            database.products_cache.invalidate(list_id)
+
+        status = "✅" if actual == expected else "❌"
+        print(f"  {status} {name}: {actual} (ожидалось {expected})")
+        if actual != expected:
+            failures.append((name, counter.statements[:]))
+
+    for shard in database.shards:
+        await shard.pool.set_trace_callback(None)
+    await close_db()
+
+    assert not failures, f"Лишние обращения к SQLite: {failures}"
+
+
+async def test_write_queue():
+    """Проверяем групповую запись: ошибка одного задания не откатывает соседей по пачке"""
+    print("🧪 Проверяем групповую запись...")
+
+    await init_db()
+    write_queue = database.shards[0].write_queue
+    user_ids = (555501, 555502, 555503)
+
+    def insert_user(user_id, fail=False):
+        async def job(db):
+            await db.execute('INSERT INTO users (user_id, first_name) VALUES (?, ?)', (user_id, "Пачка"))
+            if fail:
+                raise RuntimeError("задание упало")
+            return user_id
+        return job
+
+    async def select_users(db):
+        cursor = await db.execute(
+            f'SELECT user_id FROM users WHERE user_id IN ({", ".join("?" * len(user_ids))}) ORDER BY user_id',
+            user_ids
+        )
+        return [row[0] for row in await cursor.fetchall()]
+
+    try:
+        # Задания, отправленные подряд без ожидания, попадают в одну пачку
+        results = await asyncio.gather(
+            write_queue.submit(insert_user(user_ids[0])),
+            write_queue.submit(insert_user(user_ids[1], fail=True)),
+            write_queue.submit(insert_user(user_ids[2])),
+            return_exceptions=True
+        )
+        assert results[0] == user_ids[0] and results[2] == user_ids[2]
+        assert isinstance(results[1], RuntimeError)
+        # Вставка упавшего задания откатилась до его SAVEPOINT, соседние зафиксированы
+        assert await database.shards[0].pool.read(select_users) == [user_ids[0], user_ids[2]]
+        print("  ✅ Упавшее задание откатилось, остальные записаны")
+
+        # Одиночная запись без конкурентов не ждет окна пачки
+        window = write_queue.window
+        write_queue.window = 0.5
+        try:
+            await write_queue.submit(lambda db: db.execute('SELECT 1'))
+            started = time.perf_counter()
+            await write_queue.submit(lambda db: db.execute('SELECT 1'))
+            elapsed = time.perf_counter() - started
+        finally:
+            write_queue.window = window
+        print(f"  ⚡ Одиночная запись: {elapsed * 1000:.1f} мс при окне 500 мс")
+        assert elapsed < 0.25
+
+    finally:
+        await write_queue.submit(
+            lambda db: db.execute(f'DELETE FROM users WHERE user_id IN ({", ".join("?" * len(user_ids))})', user_ids)
+        )
+        await close_db()
+
+
+def test_list_cache():
+    """Проверяем границы кэша списков: ключи на список, число списков и их версий"""
+    print("🧪 Проверяем границы кэша списков...")
+
+    cache = ListCache('test.list_cache', max_lists=2, max_keys=3)
+
+    # Каждый префикс поиска - отдельный ключ, но на список их не больше max_keys
+    for prefix in ("м", "мо", "мол", "моло"):
+        cache.put(1, cache.version(1), [prefix], ('search', prefix))
+    assert cache.get(1, ('search', "м")) is None
+    assert cache.get(1, ('search', "моло")) == ["моло"]
+
+    # Медленное чтение запомнило версию списка, которую потом вытеснили
+    stale_version = cache.version(3)
+    for list_id in range(3, 10):
+        cache.invalidate(list_id)
+    stats = cache.stats()
+    assert stats['versions'] == 2 and stats['lists'] <= 2
+    cache.put(3, stale_version, ["устарело"])
+    assert cache.get(3) is None
+
+    # Вытесненный из данных список отдает и версию
+    cache.put(8, cache.version(8), ["восемь"])
+    cache.put(9, cache.version(9), ["девять"])
+    cache.put(10, cache.version(10), ["десять"])
+    assert cache.get(8) is None and cache.stats()['versions'] <= 2
+    assert cache.get(10) == ["десять"]
+    print(f"  📊 {cache.stats()}")
+    print("  ✅ Кэш списков ограничен")
+
+
+async def test_list_lookup_cancel():
+    """Проверяем, что отмена первого поиска списка не оставляет ожидающих висеть"""
+    print("🧪 Проверяем отмену первого поиска списка...")
+
+    await init_db()
+    user_id = 555601
+    database.list_ids_cache.pop((user_id, database.DEFAULT_LIST_NAME))
+    find_or_create = Database._find_or_create_list
+    release = asyncio.Event()
+
+    async def slow_find_or_create(user_id, list_name):
+        await release.wait()
+        return await find_or_create(user_id, list_name)
+
+    Database._find_or_create_list = staticmethod(slow_find_or_create)
+    try:
+        leader = asyncio.create_task(Database.get_or_create_list(user_id))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(Database.get_or_create_list(user_id))
+        await asyncio.sleep(0)
+
+        leader.cancel()
+        await asyncio.gather(leader, return_exceptions=True)
+        assert leader.cancelled()
+        release.set()
+
+        # Ожидающий сам находит список вместо вечного ожидания
+        list_id = await asyncio.wait_for(waiter, 5)
+        assert list_id is not None
+        assert list_id == await Database.get_or_create_list(user_id)
+        assert not database._pending_list_lookups
+        print(f"  ✅ Ожидающий получил список {list_id}")
+    finally:
+        Database._find_or_create_list = staticmethod(find_or_create)
+        await close_db()
+
+
+async def test_keyset_pages():
+    """Проверяем листание страниц вперед и назад по товарам с одинаковым временем добавления"""
+    print("🧪 Проверяем листание страниц...")
+
+    await init_db()
+    try:
+        list_id = await Database.get_or_create_list(555701)
+        await Database.clear_all_products(list_id)
+        # Одна пачка executemany: у всех товаров одинаковые is_bought и added_at
+        await Database.add_multiple_products(list_id, [{'name': f"Страница {i:02d}", 'quantity': "1"} for i in range(24)])
+        order = [p['id'] for p in await Database.get_products(list_id)]
+        assert len(order) == 24
+
+        # Вперед: страницы по 5 товаров без повторов и пропусков на границах
+        forward, keys, after_key = [], [], None
+        while True:
+            page = await Database.get_products_page(list_id, after_key, 5)
+            forward.append([p['id'] for p in page['products']])
+            keys.extend(p['key'] for p in page['products'])
+            if page['next_key'] is None:
+                break
+            after_key = page['next_key']
+        assert sum(forward, []) == order
+        added_at = {key[1] for key in keys}
+        assert len(added_at) < len(order), "товары должны делить время добавления"
+        assert [len(ids) for ids in forward] == [5, 5, 5, 5, 4]
+
+        # Назад от последней страницы: предыдущие страницы прилегают друг к другу
+        backward = [forward[-1]]
+        page = await Database.get_products_page(list_id, after_key, 5)
+        while page['after_key'] is not None:
+            page = await Database.get_products_page(list_id, page['products'][0]['key'], 5, backward=True)
+            backward.insert(0, [p['id'] for p in page['products']])
+        assert backward == forward
+
+        # Отметка товара между страницами: некупленные не теряются и не повторяются
+        first = await Database.get_products_page(list_id, None, 5)
+        await Database.toggle_product_bought(first['products'][1]['id'])
+        seen = [p['id'] for p in first['products']]
+        after_key = first['next_key']
+        while after_key is not None:
+            page = await Database.get_products_page(list_id, after_key, 5)
+            seen.extend(p['id'] for p in page['products'])
+            after_key = page['next_key']
+        toggled = first['products'][1]['id']
+        # Отмеченный товар уехал в конец списка и встретился второй раз, остальные - ровно по разу
+        assert seen[-1] == toggled and seen.count(toggled) == 2
+        assert sorted(set(seen)) == sorted(order) and len(seen) == len(order) + 1
+        print(f"  ✅ {len(forward)} страниц вперед и {len(backward)} назад без повторов и пропусков")
+    finally:
+        await close_db()
+
+
+async def test_rebalance_shards():
+    """Проверяем перенос пользователей в их шарды при включении шардов и уменьшении их числа"""
+    print("🧪 Проверяем перенос пользователей по шардам...")
+
+    original_shards, original_url = database.shards, database.DATABASE_URL
+    database.DATABASE_URL = os.path.join(os.path.dirname(os.path.abspath(original_url)), 'rebalance', 'shopping.db')
+    os.makedirs(os.path.dirname(database.DATABASE_URL), exist_ok=True)
+    # Владелец общего списка и участник - оба не в нулевом шарде из трех, третий пользователь - в нулевом
+    owner_id, member_id, staying_id = [
+        next(u for u in range(555801, 556000) if user_shard_index(u, 3) == shard) for shard in (1, 2, 0)
+    ]
+
+    original_cache = database.products_cache
+
+    def use_shards(count):
+        database.shards = ShardRouter([database._create_shard(index) for index in range(count)])
+        # id списков новой базы могут совпасть с id из других тестов
+        database.products_cache = ListCache('test.rebalance_cache')
+        database.list_ids_cache.clear()
+
+    try:
+        # Данные, накопленные до включения шардов
+        use_shards(1)
+        await init_db()
+        for user_id in (owner_id, member_id, staying_id):
+            await Database.add_user(user_id, f"user{user_id}", "Семья")
+        list_id = await Database.get_or_create_list(owner_id)
+        await Database.add_multiple_products(list_id, [
+            {'name': "Молоко", 'quantity': "1 л"}, {'name': "Хлеб", 'quantity': "1"}, {'name': "Сыр", 'quantity': "1"}
+        ])
+        products = {p['name']: p['id'] for p in await Database.get_products(list_id)}
+        await Database.toggle_product_bought(products["Сыр"])
+        await Database.clear_bought_products(list_id)
+        await Database.toggle_product_bought(products["Хлеб"])
+        code = await Database.get_invite_code(list_id)
+        assert await Database.join_list(member_id, list_id, code)
+        staying_list = await Database.get_or_create_list(staying_id)
+        await Database.add_product(staying_list, "Яблоки", "1 кг")
+        await close_db()
+
+        use_shards(3)
+        await init_db()
+        try:
+            moved_list = await Database.get_or_create_list(owner_id)
+            assert moved_list != list_id and database.shards.for_id(moved_list).index == 1
+            names = sorted((p['name'], p['is_bought']) for p in await Database.get_products(moved_list))
+            assert names == [("Молоко", False), ("Хлеб", True)], names
+            assert [p['name'] for p in await Database.get_purchase_history(owner_id)] == ["Сыр"]
+            assert await Database.search_product_names(moved_list, "сы") == ["Сыр"]
+            # Участник из третьего шарда по-прежнему видит общий список
+            assert await Database.get_or_create_list(member_id) == moved_list
+            members = sorted(m['user_id'] for m in await Database.get_list_members(moved_list))
+            assert members == sorted([owner_id, member_id]), members
+            assert await Database.get_or_create_list(staying_id) == staying_list
+            assert await Database.check_list_stats() == []
+            # Повторный запуск ничего не переносит
+            assert await database.rebalance_shards() == 0
+            print(f"  ✅ Список {list_id} переехал в шард 1 как {moved_list}")
+
+            # Личный список участника в шарде 2, который исчезнет при уменьшении числа шардов
+            dacha_list = await Database.get_or_create_list(member_id, "Дача")
+            await Database.add_product(dacha_list, "Рассада", "3 шт")
+
+            # Перенос участника прервался после копирования: его данные уже в новом
+            # шарде, но еще и в старом
+            async def interrupted_copy(db):
+                target = database.shards[user_shard_index(member_id, 2)].pool.path
+                await db.execute(f'ATTACH DATABASE ? AS {rebalance.TARGET}', (target,))
+                await db.execute('BEGIN')
+                await rebalance._copy_user(db, member_id)
+                await db.commit()
+                await db.execute(f'DETACH DATABASE {rebalance.TARGET}')
+
+            await database.shards[2].pool.write(interrupted_copy)
+        finally:
+            await close_db()
+
+        # Три шарда -> два: файл шарда 2 остается, его пользователи переезжают
+        use_shards(2)
+        await init_db()
+        try:
+            assert os.path.exists(shard_path(database.DATABASE_URL, 2))
+            shared_list = await Database.get_or_create_list(owner_id)
+            assert await Database.get_or_create_list(member_id) == shared_list
+            names = sorted((p['name'], p['is_bought']) for p in await Database.get_products(shared_list))
+            assert names == [("Молоко", False), ("Хлеб", True)], names
+            assert [p['name'] for p in await Database.get_purchase_history(member_id)] == ["Сыр"]
+            members = sorted(m['user_id'] for m in await Database.get_list_members(shared_list))
+            assert members == sorted([owner_id, member_id]), members
+
+            # Прерванное копирование не задвоило личный список участника
+            dacha_list = await Database.get_or_create_list(member_id, "Дача")
+            dacha = [(p['name'], p['quantity']) for p in await Database.get_products(dacha_list)]
+            assert dacha == [("Рассада", "3 шт")], dacha
+            staying_products = await Database.get_products(await Database.get_or_create_list(staying_id))
+            assert [p['name'] for p in staying_products] == ["Яблоки"]
+            assert await Database.check_list_stats() == []
+            assert await database.rebalance_shards() == 0
+
+            async def leftovers(db):
+                cursor = await db.execute('SELECT (SELECT COUNT(*) FROM users) + (SELECT COUNT(*) FROM products)')
+                return (await cursor.fetchone())[0]
+
+            retired = database._create_shard(2)
+            await retired.pool.open()
+            try:
+                assert await retired.pool.read(leftovers) == 0
+            finally:
+                await retired.pool.close()
+            print(f"  ✅ Пользователи шарда 2 переехали в оставшиеся два")
+        finally:
+            await close_db()
+    finally:
+        database.shards, database.DATABASE_URL = original_shards, original_url
+        database.products_cache = original_cache
+        database.list_ids_cache.clear()
+
+
+async def test_list_stats():
+    """Проверяем, что триггеры держат счетчики list_stats в согласии с products"""
+    print("🧪 Проверяем счетчики списков...")
+
+    await init_db()
+    try:
+        list_id = await Database.get_or_create_list(777777)
+        await Database.clear_all_products(list_id)
+        await Database.add_multiple_products(list_id, [{'name': f"Товар {i}", 'quantity': "1"} for i in range(5)])
+        products = await Database.get_products(list_id)
+        await Database.toggle_product_bought(products[0]['id'])
+        await Database.toggle_product_bought(products[1]['id'])
+        await Database.delete_product(products[1]['id'])
+
+        stats = await Database.get_list_stats(list_id)
+        print(f"  📊 {stats}")
+        assert stats == {'total_products': 4, 'bought_products': 1, 'remaining_products': 3}, stats
+        assert await Database.check_list_stats() == []
+
+        # Портим счетчик в обход триггеров - проверка должна найти и исправить расхождение
+        async def corrupt(db):
+            await db.execute('UPDATE list_stats SET total = total + 10 WHERE list_id = ?', (list_id,))
+            await db.commit()
+
+        await database.shards.for_id(list_id).pool.write(corrupt)
+
+        drift = await Database.check_list_stats(repair=True)
+        print(f"  🧮 Найдено и исправлено расхождений: {len(drift)}")
+        assert [row['list_id'] for row in drift] == [list_id]
+        assert await Database.check_list_stats() == []
+        assert (await Database.get_list_stats(list_id))['total_products'] == 4
+        print("  ✅ Счетчики согласованы")
+
+    finally:
+        await close_db()
+
+
+async def test_purchase_history():
+    """Проверяем перенос купленных товаров в историю покупок"""
+    print("🧪 Проверяем архив покупок...")
+
+    await init_db()
+    try:
+        user_id = 666666
+        list_id = await Database.get_or_create_list(user_id)
+        await Database.clear_all_products(list_id)
+        await Database.add_multiple_products(list_id, [{'name': f"Архив {i}", 'quantity': "1"} for i in range(5)])
+        products = await Database.get_products(list_id)
+        for product in products[:3]:
+            await Database.toggle_product_bought(product['id'])
+
+        # Свежие покупки остаются в списке
+        assert await archive_bought_products() == 0
+
+        # Отметки "сделаны" двое суток назад - архиватор переносит их пачками по 2
+        async def backdate(db):
+            await db.execute(
+                "UPDATE products SET bought_at = datetime('now', '-2 days') WHERE list_id = ? AND is_bought = 1",
+                (list_id,)
+            )
+            await db.commit()
+
+        await database.shards.for_id(list_id).pool.write(backdate)
+        archived = await archive_bought_products(batch_size=2)
+        print(f"  📦 Перенесено в историю: {archived}")
+        assert archived == 3
+
+        stats = await Database.get_list_stats(list_id)
+        assert stats == {'total_products': 2, 'bought_products': 0, 'remaining_products': 2}, stats
+
+        await Database.toggle_product_bought((await Database.get_products(list_id))[0]['id'])
+        assert await Database.clear_all_products(list_id) == 2
+
+        history = await Database.get_purchase_history(user_id)
+        print(f"  📜 В истории: {[item['name'] for item in history]}")
+        assert len(history) == 4
+        assert (await Database.get_frequent_purchases(user_id))[0]['times'] == 1
+        print("  ✅ Архив покупок работает")
+
+    finally:
+        await close_db()
+
+
+async def test_merge_products():
+    """Проверяем слияние повторно добавленных товаров"""
+    print("🧪 Проверяем слияние одинаковых товаров...")
+
+    await init_db()
+    try:
+        list_id = await Database.get_or_create_list(444444)
+        await Database.add_multiple_products(list_id, [
+            {'name': "Молоко", 'quantity': "2 кг"},
+            {'name': "Яйца", 'quantity': "10"},
+            {'name': "Хлеб", 'quantity': "1 буханка"},
+            {'name': "ЯЙЦА ", 'quantity': "5 шт"},
+        ])
+        await Database.add_product(list_id, "молоко", "500 г")
+        await Database.add_product(list_id, "Хлеб", "1 банка")
+
+        quantities = {p['name']: p['quantity'] for p in await Database.get_products(list_id)}
+        print(f"  🧮 {quantities}")
+        assert quantities == {"Молоко": "2.5 кг", "Яйца": "15 шт", "Хлеб": "1 буханка + 1 банка"}, quantities
+
+        # Купленное молоко и новое некупленное живут отдельно, пока отметку не снимут
+        milk = next(p for p in await Database.get_products(list_id) if p['name'] == "Молоко")
+        await Database.toggle_product_bought(milk['id'])
+        await Database.add_product(list_id, "Молоко", "1 л")
+        assert len(await Database.get_products(list_id)) == 4
+
+        assert await Database.toggle_product_bought(milk['id'])
+        products = await Database.get_products(list_id)
+        assert [p['quantity'] for p in products if p['name'] == "Молоко"] == ["1 л + 2.5 кг"], products
+
+        await Database.mark_all_products(list_id, True)
+        await Database.add_product(list_id, "Хлеб", "1 буханка")
+        assert await Database.mark_all_products(list_id, False) == 3
+        products = await Database.get_products(list_id)
+        assert len(products) == 3 and not any(p['is_bought'] for p in products), products
+
+        # Снятие всех отметок не пересоздает товары без двойника: открытые клавиатуры держат их id
+        ids = sorted(p['id'] for p in products)
+        await Database.mark_all_products(list_id, True)
+        assert await Database.mark_all_products(list_id, False) == 3
+        assert sorted(p['id'] for p in await Database.get_products(list_id)) == ids
+
+        # Из двух купленных с одним названием id сохраняет первый, второй сливается с ним
+        await Database.add_product(list_id, "Сыр", "200 г")
+        cheese = next(p for p in await Database.get_products(list_id) if p['name'] == "Сыр")
+        await Database.toggle_product_bought(cheese['id'])
+        await Database.add_product(list_id, "Сыр", "100 г")
+        await Database.mark_all_products(list_id, True)
+        assert await Database.mark_all_products(list_id, False) == 5
+        products = await Database.get_products(list_id)
+        assert [(p['id'], p['quantity']) for p in products if p['name'] == "Сыр"] == [(cheese['id'], "300 г")]
+        assert sorted(p['id'] for p in products if p['name'] != "Сыр") == ids
+
+        assert await Database.check_list_stats() == []
+        print("  ✅ Повторы слиты в одну строку")
+
+    finally:
+        await close_db()
+
+
+async def test_product_search():
+    """Проверяем подсказки названий по префиксу"""
+    print("🧪 Проверяем поиск товаров...")
+
+    await init_db()
+    try:
+        list_id = await Database.get_or_create_list(333333)
+        other_list_id = await Database.get_or_create_list(333334)
+        await Database.add_multiple_products(list_id, [
+            {'name': name, 'quantity': "1"} for name in ("Молоко", "Молочный шоколад", "Мыло", "Ёжевика")
+        ])
+        await Database.add_product(other_list_id, "Молотый кофе", "1")
+
+        # Товар ушел в историю, а подсказка осталась; повторное добавление поднимает его выше
+        await Database.clear_all_products(list_id)
+        await Database.add_product(list_id, "Молочный шоколад", "1")
+
+        names = await Database.search_product_names(list_id, "мол")
+        print(f"  🔍 мол -> {names}")
+        assert names == ["Молочный шоколад", "Молоко"], names
+        assert await Database.search_product_names(list_id, "МОЛОЧ шок") == ["Молочный шоколад"]
+        assert await Database.search_product_names(list_id, "еж") == ["Ёжевика"]
+
+        # Отметки и их снятие - не добавления: счетчик названия не растет
+        async def uses(name):
+            async def select(db):
+                cursor = await db.execute(
+                    'SELECT uses FROM product_names WHERE list_id = ? AND normalized_name = ?', (list_id, name)
+                )
+                return (await cursor.fetchone())[0]
+            return await database.shards.for_id(list_id).pool.read(select)
+
+        chocolate = (await Database.get_products(list_id))[0]
+        assert await uses("молочный шоколад") == 2
+        await Database.toggle_product_bought(chocolate['id'])
+        await Database.toggle_product_bought(chocolate['id'])
+        await Database.mark_all_products(list_id, True)
+        await Database.add_product(list_id, "молочный шоколад", "1")
+        await Database.mark_all_products(list_id, False)
+        assert await uses("молочный шоколад") == 3
+        # Слияние с некупленным - тоже добавление
+        await Database.add_product(list_id, "Молочный шоколад", "1")
+        assert await uses("молочный шоколад") == 4
+        assert await Database.search_product_names(list_id, 'мол"') == ["Молочный шоколад", "Молоко"]
+        assert (await Database.search_product_names(list_id, ""))[0] == "Молочный шоколад"
+        print("  ✅ Подсказки только из своего списка")
+
+    finally:
+        await close_db()
+
+
+async def test_backup():
+    """Проверяем снимок работающей базы"""
+    print("🧪 Проверяем резервное копирование...")
+
+    await init_db()
+    try:
+        snapshots = await backup_databases(compress=False)
+        assert len(snapshots) == len(database.shards)
+
+        for taken in snapshots:
+            print(f"  💾 {taken['path']}: {taken['size']} байт за {taken['seconds']:.3f} с")
+            copy = sqlite3.connect(taken['path'])
+            try:
+                assert copy.execute('PRAGMA integrity_check').fetchone()[0] == 'ok'
+            finally:
+                copy.close()
+            os.remove(taken['path'])
+
+        # Два снимка подряд в одну секунду - два файла
+        first, second = [await backup.snapshot(database.shards[0].pool.path, BACKUP_DIR) for _ in range(2)]
+        assert first['path'] != second['path'] and os.path.exists(first['path'])
+        assert backup.list_snapshots(BACKUP_DIR, database.shards[0].pool.path)[-2:] == [first['path'], second['path']]
+        for taken in (first, second):
+            os.remove(taken['path'])
+        print("  ✅ Снимки целые")
+
+    finally:
+        await close_db()
+
+
+async def test_maintenance():
+    """Проверяем, что обслуживание возвращает страницы, освобожденные удалением"""
+    print("🧪 Проверяем обслуживание базы...")
+
+    await init_db()
+    try:
+        list_id = await Database.get_or_create_list(555555)
+        await Database.add_multiple_products(
+            list_id, [{'name': f"Товар {i} " + "x" * 200, 'quantity': "1"} for i in range(500)]
+        )
+        await Database.clear_all_products(list_id)
+
+        # Сразу после записи база не простаивает - обслуживание откладывается
+        assert await run_maintenance() == []
+
+        reports = await run_maintenance(idle_seconds=0)
+        shard_report = next(r for r in reports if r['path'] == database.shards.for_id(list_id).pool.path)
+        print(f"  🧽 Освобождено страниц: {shard_report['reclaimed_pages']}, осталось {shard_report['free_pages']}")
+        assert shard_report['reclaimed_pages'] > 0
+
+        async def auto_vacuum(db):
+            cursor = await db.execute('PRAGMA auto_vacuum')
+            return (await cursor.fetchone())[0]
+
+        assert await database.shards[0].pool.read(auto_vacuum) == 2
+        print("  ✅ Свободные страницы возвращены")
+
+    finally:
+        await close_db()
+
+
+class FakeBot:
+    """Запоминает правки сообщений вместо отправки в Telegram"""
+
+    def __init__(self):
+        self.edits = []
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits.append((chat_id, message_id, text))
+
+
+async def test_shared_lists():
+    """Проверяем общий список семьи и слияние рассылки изменений"""
+    print("🧪 Проверяем общие списки...")
+
+    await init_db()
+    fanout = ListFanout(coalesce_window=0.05, edits_per_second=1000)
+    try:
+        owner_id, member_id = 666661, 666663
+        list_id = await Database.get_or_create_list(owner_id)
+        own_list_id = await Database.get_or_create_list(member_id)
+
+        invite_code = await Database.get_invite_code(list_id)
+        assert invite_code and await Database.get_invite_code(list_id) == invite_code
+        assert not await Database.join_list(member_id, list_id, "wrong")
+        assert await Database.join_list(member_id, list_id, invite_code)
+
+        # Основной список участника - общий, в том числе после перезапуска
+        assert await Database.get_or_create_list(member_id) == list_id
+        database.list_ids_cache.clear()
+        assert await Database.get_or_create_list(member_id) == list_id
+        database.list_ids_cache.clear()
+        await database.warm_list_cache()
+        assert database.list_ids_cache.get((member_id, database.DEFAULT_LIST_NAME)) == list_id
+
+        members = await Database.get_list_members(list_id)
+        assert [(m['user_id'], m['role']) for m in members] == [(owner_id, 'owner'), (member_id, 'member')]
+        print(f"  👨‍👩‍👧 Участников: {len(members)}")
+
+        bot = FakeBot()
+        reads, renders = [], []
+
+        async def read_page(read_list_id, page_key):
+            reads.append(page_key)
+            return await Database.get_products_page(read_list_id, page_key)
+
+        async def render(rendered_list_id, page):
+            renders.append(page['after_key'])
+            bought = sum(product['is_bought'] for product in page['products'])
+            return f"{len(page['products'])} товаров, куплено {bought}", None
+
+        fanout.setup(bot, read_page, render, Database.get_list_seq, Database.get_list_changes)
+        database.list_change_listeners.append(fanout.list_changed)
+        fanout.track(list_id, owner_id, owner_id, 1)
+        fanout.track(list_id, member_id, member_id, 2)
+
+        # Пять изменений подряд - одна отрисовка и по одной правке на участника
+        for i in range(5):
+            await Database.add_product(list_id, f"Товар {i}", "1")
+        await asyncio.sleep(0.2)
+        print(f"  📨 Правок: {len(bot.edits)}, отрисовок: {len(renders)}")
+        assert len(renders) == 1 and len(reads) == 1
+        deltas = fanout.stats()['deltas']
+        assert sorted(bot.edits) == [(owner_id, 1, "5 товаров, куплено 0"), (member_id, 2, "5 товаров, куплено 0")]
+
+        # Автор изменения сам перерисовал экран - правку получает только другой участник
+        bot.edits.clear()
+        products = await Database.get_products(list_id)
+        await Database.toggle_product_bought(products[0]['id'])
+        fanout.track(list_id, owner_id, owner_id, 1)
+        await asyncio.sleep(0.2)
+        assert bot.edits == [(member_id, 2, "5 товаров, куплено 1")]
+
+        # Ушедший с экрана участник больше не получает правок
+        bot.edits.clear()
+        fanout.forget(member_id, 2)
+        fanout.forget(owner_id, 999)
+        assert fanout.open_count(list_id) == 1
+        await Database.delete_product(products[1]['id'])
+        await asyncio.sleep(0.2)
+        assert bot.edits == [(owner_id, 1, "4 товаров, куплено 1")]
+
+        # Отметка и удаление применены к прочитанной странице по журналу, добавление - перечитывание
+        assert len(reads) == 1 and fanout.stats()['deltas'] == deltas + 2
+        bot.edits.clear()
+        await Database.add_product(list_id, "Товар 5", "1")
+        await asyncio.sleep(0.2)
+        assert len(reads) == 2
+        assert bot.edits == [(owner_id, 1, "5 товаров, куплено 1")]
+        page = await Database.get_products_page(list_id)
+        seq = Database.get_list_seq(list_id)
+        await Database.add_product(list_id, "Товар 6", "1")
+        assert apply_changes(page, Database.get_list_changes(list_id, seq)) is None
+
+        # Статистика и история участника - это статистика и история общего списка
+        assert await Database.clear_bought_products(list_id) == 1
+        assert await Database.get_user_stats(member_id) == await Database.get_list_stats(list_id)
+        assert await Database.get_user_stats(member_id) == {
+            'total_products': 5, 'bought_products': 0, 'remaining_products': 5
+        }
+        history = await Database.get_purchase_history(member_id)
+        assert [item['name'] for item in history] == [products[0]['name']]
+        assert history == await Database.get_purchase_history(owner_id)
+        assert [item['name'] for item in await Database.get_frequent_purchases(member_id)] == [products[0]['name']]
+
+        assert await Database.leave_list(member_id) == list_id
+        assert await Database.get_or_create_list(member_id) == own_list_id
+        assert len(await Database.get_list_members(list_id)) == 1
+        assert await Database.get_purchase_history(member_id) == []
+        print("  ✅ Изменения расходятся одной правкой на экран")
+
+    finally:
+        database.list_change_listeners.clear()
+        await fanout.stop()
+        await close_db()
+
+
+async def test_list_events():
+    """Проверяем журнал изменений списков"""
+    print("🧪 Проверяем журнал изменений...")
+
+    await init_db()
+    try:
+        list_id = await Database.get_or_create_list(888888)
+        seq = Database.get_list_seq(list_id)
+        await Database.add_multiple_products(list_id, [
+            {'name': name, 'quantity': "1"} for name in ("Хлеб", "Сыр")
+        ])
+        products = await Database.get_products(list_id)
+        await Database.toggle_product_bought(products[0]['id'])
+        await Database.delete_product(products[1]['id'])
+
+        events = Database.get_list_changes(list_id, seq)
+        print(f"  📜 События: {[event.kind for event in events]}")
+        assert [(e.kind, e.product_id, e.is_bought, e.count) for e in events] == [
+            ('add', None, None, 2),
+            ('toggle', products[0]['id'], True, 1),
+            ('delete', products[1]['id'], None, 1),
+        ]
+        assert [e.seq for e in events] == sorted(e.seq for e in events)
+        assert Database.get_list_changes(list_id, events[-1].seq) == []
+
+        # Ограниченное хранение: вытесненная история - сигнал перечитать список
+        feed = ChangeFeed('test.feed', max_lists=2, max_events=3)
+        first = feed.append(1, 'add')
+        for product_id in range(5):
+            feed.append(1, 'delete', product_id)
+        assert feed.since(1, first) is None
+        assert [e.product_id for e in feed.since(1, feed.last_seq(1) - 2)] == [3, 4]
+
+        last_of_evicted = feed.last_seq(1)
+        feed.append(2, 'add')
+        feed.append(3, 'add')
+        assert feed.since(1, first) is None
+        assert feed.since(1, last_of_evicted) == []
+        assert feed.stats()['lists'] == 2
+
+        # Список вытеснен и снова изменился: отставший читатель перечитывает список целиком
+        feed = ChangeFeed('test.feed_evicted', max_lists=1)
+        first = feed.append(1, 'add')
+        deleted = feed.append(1, 'delete', 1)
+        feed.append(2, 'add')
+        latest = feed.append(1, 'toggle', 2, True)
+        assert feed.since(1, first) is None
+        assert [e.seq for e in feed.since(1, deleted)] == [latest]
+        print("  ✅ Дельты после номера и ограниченное хранение")
+
+    finally:
+        await close_db()
+
+
+async def test_ai_response_cache():
+    """Проверяем кэш ответов AI: срок жизни, вытеснение и копию в SQLite"""
+    print("🧪 Проверяем кэш ответов AI...")
+
+    path = os.path.join(os.path.dirname(database.DATABASE_URL) or ".", "test_ai_cache.db")
+    for leftover in (path, f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(leftover):
+            os.remove(leftover)
+
+    key = PerplexityClient.cache_key("Что нужно для  БОРЩА?", ["Свекла (2 шт)", "Молоко (1 л)"])
+    assert key == PerplexityClient.cache_key("что нужно для борща", ["молоко (1 л)", "свекла (2 шт)"])
+    assert key != PerplexityClient.cache_key("что нужно для борща", [])
+    assert PerplexityClient.cache_ttl("рецепт борща", "recipe") > PerplexityClient.cache_ttl(
+        "какие овощи сейчас в сезоне", "general")
+
+    answer = {"response": "🍲 Свекла, капуста", "products": [], "intent": "recipe", "model": "sonar-pro"}
+    cache = ResponseCache('test.ai_cache', max_entries=2, path=path)
+    try:
+        await cache.put(key, answer, ttl=60)
+        await cache.put("expired", answer, ttl=0.01)
+        assert await cache.get(key) == answer
+        await asyncio.sleep(0.02)
+        assert await cache.get("expired") is None
+
+        await cache.put("a", answer, ttl=60)
+        await cache.put("b", answer, ttl=60)
+        assert cache.stats()['size'] == 2
+    finally:
+        cache.close()
+
+    # После перезапуска ответ поднимается из файла
+    restarted = ResponseCache('test.ai_cache', max_entries=2, path=path)
+    try:
+        assert await restarted.get(key) == answer
+        assert await restarted.get("expired") is None
+        assert restarted.stats()['persistent_hits'] >= 1
+        print(f"  ⚡ {restarted.stats()}")
+        print("  ✅ Ответы переживают перезапуск и истекают по сроку")
+    finally:
+        restarted.close()
+
+
+async def test_hedged_completion():
+    """Проверяем параллельную подстраховку моделей AI"""
+    print("🧪 Проверяем подстраховку моделей AI...")
+
+    client = PerplexityClient()
+    client.models = ["slow", "fast", "broken", "spare"]
+    client.model_timeouts = {}
+    client.hedge_delay = 0.05
+    client.total_budget = 1.0
+    started, cancelled = [], []
+
+    async def complete(model, messages, timeout, on_partial=None):
+        started.append(model)
+        try:
+            if model == "broken":
+                raise RuntimeError("HTTP 500")
+            await asyncio.sleep({"slow": 0.5, "fast": 0.01, "spare": 0.01}[model])
+            return f"ответ {model}"
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    client.complete = complete
+
+    # Основная модель медленная: через hedge_delay стартует запасная и побеждает
+    assert await client.hedged_completion([]) == ("fast", "ответ fast", False)
+    assert started == ["slow", "fast"] and cancelled == ["slow"]
+
+    # Упавшая модель сразу заменяется следующей
+    started.clear()
+    client.models = ["broken", "spare"]
+    assert await client.hedged_completion([]) == ("spare", "ответ spare", False)
+    assert started == ["broken", "spare"]
+
+    # Весь вопрос ограничен бюджетом, даже если модели еще думают
+    started.clear()
+    client.models = ["slow"]
+    client.total_budget = 0.1
+    loop = asyncio.get_running_loop()
+    begin = loop.time()
+    assert await client.hedged_completion([]) is None
+    assert loop.time() - begin < 0.3
+    print("  ✅ Первый хороший ответ, остальные запросы отменены")
+    await client.close()
+
+
+class FakeStreamResponse:
+    """Ответ aiohttp с телом SSE: строки приходят по одной"""
+
+    def __init__(self, lines):
+        self.content = self._lines(lines)
+
+    @staticmethod
+    async def _lines(lines):
+        for line in lines:
+            yield line.encode('utf-8')
+
+
+async def test_streaming_response():
+    """Проверяем разбор потока SSE и вывод потока одной модели"""
+    print("🧪 Проверяем потоковый ответ AI...")
+
+    partials = []
+
+    async def on_partial(content):
+        partials.append(content)
+
+    response = FakeStreamResponse([
+        ': ping\n',
+        'data: {"choices": [{"delta": {"content": "Свекла"}}]}\n', '\n',
+        'data: {"choices": [{"delta": {"role": "assistant"}}]}\n', '\n',
+        'data: {"choices": [{"delta": {"content": ", капуста"}}]}\n', '\n',
+        'data: [DONE]\n',
+    ])
+    assert await PerplexityClient._read_stream(response, on_partial) == "Свекла, капуста"
+    assert partials == ["Свекла", "Свекла, капуста"]
+
+    # Поток начала запасная модель - выводится только он, основная отменяется
+    client = PerplexityClient()
+    client.models = ["slow", "fast"]
+    client.model_timeouts = {}
+    client.hedge_delay = 0.01
+    client.total_budget = 1.0
+    cancelled = []
+
+    async def complete(model, messages, timeout, partial=None):
+        try:
+            await asyncio.sleep({"slow": 0.2, "fast": 0.02}[model])
+            text = ""
+            for chunk in ("ответ ", model):
+                text += chunk
+                await partial(text)
+                await asyncio.sleep(0.01)
+            return text
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+
+    client.complete = complete
+    partials.clear()
+    assert await client.hedged_completion([], on_partial) == ("fast", "ответ fast", False)
+    assert partials == ["ответ ", "ответ fast"] and cancelled == ["slow"]
+
+    # Бюджет кончился посреди потока - остается выведенная часть, а не запасной ответ
+    async def stalled(model, messages, timeout, partial=None):
+        await partial("Свекла, ")
+        await asyncio.wait_for(asyncio.sleep(1), timeout)
+        return "Свекла, капуста"
+
+    client.complete = stalled
+    client.models = ["sonar"]
+    client.total_budget = 0.1
+    partials.clear()
+    assert await client.hedged_completion([], on_partial) == ("sonar", "Свекла, ", True)
+
+    client.api_key = "test"
+    client.cache = ResponseCache('test.truncated_cache')
+    result = await client.get_smart_response("Что нужно для борща?", [], on_partial=on_partial)
+    assert result['truncated'] and result['model'] == "sonar"
+    assert result['response'].startswith("Свекла, ") and result['response'].endswith(TRUNCATED_NOTE)
+    assert await client.cache.get(PerplexityClient.cache_key("Что нужно для борща?", [])) is None
+    print("  ✅ Накопленный текст приходит по мере генерации, оборванный поток не теряется")
+    await client.close()
+
+
+async def test_singleflight():
+    """Проверяем объединение одинаковых одновременных вопросов к AI"""
+    print("🧪 Проверяем объединение одинаковых вопросов...")
+
+    # Первый вызов отменен (пользователь ушел) - ожидающие не отменяются, а выполняют работу сами
+    flight = SingleFlight('test.singleflight')
+    calls = []
+
+    async def work(name):
+        calls.append(name)
+        await asyncio.sleep(0.05)
+        return f"ответ {name}"
+
+    leader = asyncio.create_task(flight.do("вопрос", lambda: work("leader")))
+    await asyncio.sleep(0.01)
+    followers = [asyncio.create_task(flight.do("вопрос", lambda name=name: work(name))) for name in ("f1", "f2")]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    assert await asyncio.gather(*followers) == ["ответ f1", "ответ f1"]
+    assert calls == ["leader", "f1"] and leader.cancelled() and not flight.in_flight("вопрос")
+
+    client = PerplexityClient()
+    client.api_key = "test"
+    client.cache = ResponseCache('test.singleflight_cache')
+    client.models = ["sonar"]
+    upstream_calls = []
+
+    async def complete(model, messages, timeout, on_partial=None):
+        upstream_calls.append(messages[-1]['content'])
+        await asyncio.sleep(0.05)
+        if on_partial:
+            await on_partial("Свекла")
+        return "Свекла, капуста"
+
+    client.complete = complete
+    partials = []
+
+    async def on_partial(content):
+        partials.append(content)
+
+    shared_before = client.in_flight_stats()['shared']
+    results = await asyncio.gather(
+        client.get_smart_response("Что нужно для борща?", []),
+        client.get_smart_response("что нужно для борща", [], on_partial=on_partial),
+        client.get_smart_response("Что нужно для БОРЩА", []),
+        client.get_smart_response("Что нужно для щей?", []),
+    )
+    print(f"  🔗 Запросов к API: {len(upstream_calls)} на 4 вопроса")
+    assert len(upstream_calls) == 2
+    assert all(result['response'] == "Свекла, капуста" for result in results)
+    assert [result.get('shared', False) for result in results] == [False, True, True, False]
+    assert client.in_flight_stats()['shared'] - shared_before == 2
+    assert not client._partial_listeners
+    print("  ✅ Одинаковые вопросы получили один ответ")
+    await client.close()
+
+
+async def test_ai_scheduler():
+    """Проверяем очередь к AI: лимит одновременных запросов, обход по кругу и отклонение"""
+    print("🧪 Проверяем очередь к AI...")
+
+    scheduler = AIScheduler('test.ai_queue', max_concurrent=1, max_queued=3, max_per_user=3)
+    release = asyncio.Event()
+    started = []
+    positions = {}
+
+    def work(name):
+        async def run():
+            started.append(name)
+            await release.wait()
+            return name
+        return run
+
+    def on_position(name):
+        async def notify(position):
+            positions.setdefault(name, []).append(position)
+        return notify
+
+    # Первый вопрос занимает единственное место, остальные встают в очередь
+    tasks = [asyncio.create_task(scheduler.run(1, work("a1")))]
+    await asyncio.sleep(0)
+    for user_id, name in ((1, "a2"), (1, "a3"), (2, "b1")):
+        tasks.append(asyncio.create_task(scheduler.run(user_id, work(name), on_position(name))))
+        await asyncio.sleep(0)
+
+    try:
+        await scheduler.run(1, work("a4"))
+        assert False, "четвертый вопрос пользователя должен быть отклонен"
+    except AIQueueFull:
+        pass
+    try:
+        await scheduler.run(3, work("c1"))
+        assert False, "вопрос сверх очереди должен быть отклонен"
+    except AIQueueFull:
+        pass
+
+    await asyncio.sleep(0)
+    assert scheduler.stats()['running'] == 1 and scheduler.stats()['queued'] == 3
+    # Второй пользователь ждет один вопрос первого, а не оба
+    assert positions['b1'][-1] == 2
+    release.set()
+    results = await asyncio.gather(*tasks)
+    print(f"  🔄 Порядок выполнения: {started}")
+    assert started == ["a1", "a2", "b1", "a3"]
+    assert results == ["a1", "a2", "a3", "b1"]
+    assert positions['b1'] == [2, 1]
+    # Новый пользователь встает перед вторым вопросом первого
+    assert positions['a3'][:2] == [2, 3]
+
+    # Отмененный в очереди вопрос освобождает свое место
+    release.clear()
+    running = asyncio.create_task(scheduler.run(1, work("x")))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(scheduler.run(2, work("y")))
+    await asyncio.sleep(0)
+    waiting.cancel()
+    await asyncio.gather(waiting, return_exceptions=True)
+    assert scheduler.stats()['queued'] == 0
+    release.set()
+    await running
+
+    stats = scheduler.stats()
+    print(f"  📊 {stats}")
+    assert stats['running'] == 0 and stats['queued'] == 0 and stats['shed'] == 2
+    assert not scheduler._per_user
+    print("  ✅ Очередь к AI работает")
+
 
 if __name__ == "__main__":
     asyncio.run(test_database())
+    asyncio.run(test_query_counts())
+    asyncio.run(test_write_queue())
+    test_list_cache()
+    asyncio.run(test_list_lookup_cancel())
+    asyncio.run(test_keyset_pages())
+    asyncio.run(test_rebalance_shards())
+    asyncio.run(test_list_stats())
+    asyncio.run(test_purchase_history())
+    asyncio.run(test_merge_products())
+    asyncio.run(test_product_search())
+    asyncio.run(test_backup())
+    asyncio.run(test_maintenance())
+    asyncio.run(test_shared_lists())
+    asyncio.run(test_list_events())
+    asyncio.run(test_ai_response_cache())
+    asyncio.run(test_hedged_completion())
+    asyncio.run(test_streaming_response())
+    asyncio.run(test_singleflight())
+    asyncio.run(test_ai_scheduler())
@@ -2,6 +2,7 @@
 Пакет утилит и вспомогательных функций
 """
 
+from .metrics import metrics
 from .perplexity_client import perplexity_client
 
-__all__ = ['perplexity_client']
+__all__ = ['metrics', 'perplexity_client']
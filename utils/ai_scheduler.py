@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from config import AI_MAX_CONCURRENT, AI_MAX_PER_USER, AI_MAX_QUEUED
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Уведомление ожидающего о его месте в очереди (1 - следующий)
+OnPosition = Callable[[int], Awaitable[None]]
+
+
+class AIQueueFull(Exception):
+    """Очередь к AI переполнена или у пользователя слишком много вопросов в работе"""
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'future', 'on_position', 'position')
+
+    def __init__(self, user_id: int, future: asyncio.Future, on_position: Optional[OnPosition]):
+        self.user_id = user_id
+        self.future = future
+        self.on_position = on_position
+        self.position = 0
+
+
+class AIScheduler:
+    """Очередь запросов к AI: не больше max_concurrent запросов одновременно на бота.
+
+    Ожидающие запросы хранятся в очередях по пользователям, освободившееся место
+    достается пользователям по кругу - кто отправил десять вопросов подряд, не
+    задерживает остальных больше чем на один свой запрос. Очередь ограничена
+    max_queued запросами, а у одного пользователя в работе и в очереди - не больше
+    max_per_user; лишние запросы сразу отклоняются AIQueueFull. Время ожидания
+    в очереди пишется в метрику '{name}.wait' отдельно от времени ответа моделей.
+    """
+
+    def __init__(self, name: str, max_concurrent: int = 4, max_queued: int = 50, max_per_user: int = 2):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queued = max(0, max_queued)
+        self.max_per_user = max(1, max_per_user)
+        self._running = 0
+        # user_id -> ожидающие запросы; порядок ключей - очередь обхода по кругу
+        self._queues: 'OrderedDict[int, Deque[_Waiter]]' = OrderedDict()
+        self._queued = 0
+        # user_id -> запросы пользователя в работе и в очереди
+        self._per_user: Dict[int, int] = {}
+        self._notify_tasks: set = set()
+
+    async def run(self, user_id: int, work: Callable[[], Awaitable[T]],
+                  on_position: Optional[OnPosition] = None) -> T:
+        """Выполнить work(), когда до пользователя дойдет очередь"""
+        if self._per_user.get(user_id, 0) >= self.max_per_user:
+            metrics.incr(f'{self.name}.shed_user')
+            raise AIQueueFull(f"у пользователя {user_id} уже {self.max_per_user} вопроса в работе")
+
+        if self._running < self.max_concurrent and not self._queued:
+            self._running += 1
+            metrics.observe(f'{self.name}.wait', 0.0)
+        else:
+            if self._queued >= self.max_queued:
+                metrics.incr(f'{self.name}.shed')
+                raise AIQueueFull(f"в очереди к AI уже {self._queued} вопросов")
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            try:
+                await self._wait_turn(user_id, on_position)
+            finally:
+                self._release_user(user_id)
+
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        try:
+            return await work()
+        finally:
+            self._release_user(user_id)
+            self._running -= 1
+            self._wake_next()
+
+    async def _wait_turn(self, user_id: int, on_position: Optional[OnPosition]):
+        """Ждать места в очереди; место уже занято за нами, когда ожидание закончилось"""
+        waiter = _Waiter(user_id, asyncio.get_running_loop().create_future(), on_position)
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        metrics.incr(f'{self.name}.queued')
+        started = time.monotonic()
+        self._notify_positions()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Место уже выдано, но ожидающий отменен - отдаем место следующему
+                self._running -= 1
+                self._wake_next()
+            else:
+                self._remove(waiter)
+            raise
+        finally:
+            metrics.observe(f'{self.name}.wait', time.monotonic() - started)
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.user_id]
+        self._notify_positions()
+
+    def _release_user(self, user_id: int):
+        left = self._per_user[user_id] - 1
+        if left:
+            self._per_user[user_id] = left
+        else:
+            del self._per_user[user_id]
+
+    def _wake_next(self):
+        """Отдать свободные места следующим пользователям по кругу"""
+        woke = False
+        while self._running < self.max_concurrent and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queued -= 1
+            if queue:
+                # Следующий вопрос этого пользователя - после остальных пользователей
+                self._queues.move_to_end(user_id)
+            else:
+                del self._queues[user_id]
+            if waiter.future.done():
+                # Ожидающий отменен, но еще не успел убрать себя из очереди
+                continue
+            self._running += 1
+            waiter.future.set_result(None)
+            woke = True
+        if woke:
+            self._notify_positions()
+
+    def _order(self):
+        """Ожидающие в том порядке, в котором им достанутся места"""
+        queues = [list(queue) for queue in self._queues.values()]
+        for round_ in range(max(map(len, queues), default=0)):
+            for queue in queues:
+                if round_ < len(queue):
+                    yield queue[round_]
+
+    def _notify_positions(self):
+        """Сообщить ожидающим их новое место в очереди, если оно изменилось"""
+        for position, waiter in enumerate(self._order(), 1):
+            if waiter.position == position:
+                continue
+            waiter.position = position
+            if waiter.on_position is not None:
+                task = asyncio.create_task(self._notify(waiter.on_position, position))
+                self._notify_tasks.add(task)
+                task.add_done_callback(self._notify_tasks.discard)
+
+    @staticmethod
+    async def _notify(on_position: OnPosition, position: int):
+        try:
+            await on_position(position)
+        except Exception as e:
+            logger.error(f"❌ Ошибка уведомления о месте в очереди: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Загрузка очереди и счетчики"""
+        wait = metrics.timings.get(f'{self.name}.wait', {'count': 0, 'total': 0.0, 'max': 0.0})
+        return {
+            'running': self._running,
+            'queued': self._queued,
+            'users_waiting': len(self._queues),
+            'queued_total': metrics.counters[f'{self.name}.queued'],
+            'shed': metrics.counters[f'{self.name}.shed'] + metrics.counters[f'{self.name}.shed_user'],
+            'wait_avg': wait['total'] / wait['count'] if wait['count'] else 0.0,
+            'wait_max': wait['max'],
+        }
+
+
+# Общая очередь бота к AI
+ai_scheduler = AIScheduler('ai.queue', AI_MAX_CONCURRENT, AI_MAX_QUEUED, AI_MAX_PER_USER)
@@ -0,0 +1,291 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import CallbackQuery, InlineKeyboardMarkup
+
+from config import FANOUT_COALESCE_MS, FANOUT_EDITS_PER_SEC
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Чтение страницы списка: (list_id, ключ страницы) -> страница Database.get_products_page
+ReadPage = Callable[[int, Hashable], Awaitable[Dict]]
+
+# Отрисовка экрана списка: (list_id, страница) -> (текст, клавиатура)
+RenderList = Callable[[int, Dict], Awaitable[Tuple[str, InlineKeyboardMarkup]]]
+
+# Номер последнего изменения списка в журнале изменений
+LastSeq = Callable[[int], int]
+
+# События списка после номера (ListEvent) или None, если часть истории вытеснена
+Changes = Callable[[int, int], Optional[List[Any]]]
+
+# Изменения одного товара, которые можно применить к уже прочитанной странице
+_DELTA_KINDS = ('toggle', 'delete')
+
+
+def apply_changes(page: Dict, events: List[Any]) -> Optional[Dict]:
+    """Применить к странице списка события журнала; None - страницу нужно перечитать.
+
+    Отметка меняет статус товара на его месте, удаление убирает строку. Товары
+    не переезжают между страницами: экран сохраняет свои строки до следующего
+    чтения. Добавления, слияния и массовые изменения применить нельзя.
+    """
+    if any(event.is_bulk or event.kind not in _DELTA_KINDS for event in events):
+        return None
+
+    products = {product['id']: product for product in page['products']}
+    for event in events:
+        if event.product_id not in products:
+            continue
+        if event.kind == 'delete':
+            del products[event.product_id]
+        else:
+            # Статус из события, а не переключение: повторное применение ничего не меняет
+            products[event.product_id] = {**products[event.product_id], 'is_bought': event.is_bought}
+    return {**page, 'products': [products[p['id']] for p in page['products'] if p['id'] in products]}
+
+
+@dataclass
+class OpenListMessage:
+    """Сообщение с открытым списком у одного участника"""
+    chat_id: int
+    message_id: int
+    page_key: Hashable
+    # Номер последнего изменения списка, которое уже видно на экране
+    rendered_seq: int
+
+
+class ListFanout:
+    """Обновление открытых экранов общего списка у всех его участников.
+
+    Изменения списка копятся coalesce_window секунд, после чего каждое открытое
+    сообщение списка получает одну правку с итоговым состоянием - сколько бы
+    отметок ни сделала семья за это время. Экран отрисовывается один раз на
+    страницу, а не на участника. Все правки бота проходят через общий лимит
+    edits_per_second, чтобы большая семья не упиралась в ограничения Telegram.
+
+    Прочитанные страницы запоминаются вместе с номером изменения: следующая
+    рассылка применяет к ним события журнала после этого номера (отметки и
+    удаления) и не читает страницу заново. Перечитывается страница после
+    массовых изменений и когда нужная часть журнала уже вытеснена.
+    """
+
+    def __init__(self, coalesce_window: float = 1.5, edits_per_second: float = 20):
+        self.coalesce_window = coalesce_window
+        self.edit_interval = 1 / edits_per_second if edits_per_second > 0 else 0
+        self.bot: Optional[Bot] = None
+        self.read_page: Optional[ReadPage] = None
+        self.render: Optional[RenderList] = None
+        self.last_seq: Optional[LastSeq] = None
+        self.changes: Optional[Changes] = None
+        # list_id -> user_id -> сообщение: у каждого участника открыт один экран списка
+        self._open: Dict[int, Dict[int, OpenListMessage]] = {}
+        self._list_of_user: Dict[int, int] = {}
+        # list_id -> ключ страницы -> (номер изменения, страница на этот номер)
+        self._pages: Dict[int, Dict[Hashable, Tuple[int, Dict]]] = {}
+        # Отложенные рассылки по спискам
+        self._pending: Dict[int, asyncio.Task] = {}
+        self._next_edit_at = 0.0
+
+    def setup(self, bot: Bot, read_page: ReadPage, render: RenderList, last_seq: LastSeq, changes: Changes):
+        """Подключить бота, чтение и отрисовку экрана и журнал изменений (до первых изменений)"""
+        self.bot = bot
+        self.read_page = read_page
+        self.render = render
+        self.last_seq = last_seq
+        self.changes = changes
+
+    def track(self, list_id: int, user_id: int, chat_id: int, message_id: int, page_key: Hashable = None,
+              seq: Optional[int] = None):
+        """Запомнить, что у пользователя открыт экран списка в этом сообщении.
+
+        seq - номер изменения, запомненный перед чтением списка для экрана
+        (по умолчанию - текущий): более поздние изменения придут правкой.
+        """
+        self.forget(user_id)
+        if seq is None:
+            seq = self.last_seq(list_id)
+        self._open.setdefault(list_id, {})[user_id] = OpenListMessage(chat_id, message_id, page_key, seq)
+        self._list_of_user[user_id] = list_id
+
+    def forget(self, user_id: int, message_id: Optional[int] = None):
+        """Пользователь ушел с экрана списка (из сообщения message_id) - больше его не обновляем"""
+        list_id = self._list_of_user.get(user_id)
+        if list_id is None:
+            return
+        messages = self._open[list_id]
+        if message_id is not None and messages[user_id].message_id != message_id:
+            return
+
+        del self._list_of_user[user_id]
+        del messages[user_id]
+        if not messages:
+            del self._open[list_id]
+            self._pages.pop(list_id, None)
+
+    def open_count(self, list_id: int) -> int:
+        """Сколько участников сейчас смотрят список"""
+        return len(self._open.get(list_id, ()))
+
+    def list_changed(self, list_id: int):
+        """Список изменился: запланировать одну рассылку на окно изменений"""
+        if list_id not in self._open or self.bot is None:
+            return
+
+        metrics.incr('fanout.change')
+        if list_id in self._pending:
+            metrics.incr('fanout.coalesced')
+            return
+        self._pending[list_id] = asyncio.create_task(self._flush_later(list_id), name=f'fanout-{list_id}')
+
+    async def _flush_later(self, list_id: int):
+        try:
+            await asyncio.sleep(self.coalesce_window)
+        finally:
+            # Изменения после этой точки планируют следующую рассылку
+            self._pending.pop(list_id, None)
+        try:
+            with metrics.timer('fanout.flush'):
+                await self.flush(list_id)
+        except Exception as e:
+            metrics.incr('fanout.error')
+            logger.error(f"❌ Ошибка рассылки обновления списка {list_id}: {e}")
+
+    async def flush(self, list_id: int) -> int:
+        """Обновить устаревшие открытые экраны списка, вернуть число правок"""
+        last_seq = self.last_seq(list_id)
+        stale: Dict[Hashable, List[Tuple[int, OpenListMessage]]] = {}
+        for user_id, message in self._open.get(list_id, {}).items():
+            # Экран, открытый после последнего изменения, уже показывает свежие данные
+            if message.rendered_seq < last_seq:
+                stale.setdefault(message.page_key, []).append((user_id, message))
+
+        edits = 0
+        for page_key, messages in stale.items():
+            # Изменения во время отрисовки и правок достанутся следующей рассылке
+            rendered_seq = self.last_seq(list_id)
+            page = await self._page(list_id, page_key, rendered_seq)
+            text, keyboard = await self.render(list_id, page)
+            for user_id, message in messages:
+                # Пока ждали лимита, пользователь мог уйти с экрана
+                if self._open.get(list_id, {}).get(user_id) is not message:
+                    continue
+                if await self._edit(list_id, user_id, message, text, keyboard):
+                    message.rendered_seq = rendered_seq
+                    edits += 1
+
+        # Страницы, которые больше никто не смотрит, не храним
+        pages = self._pages.get(list_id)
+        if pages:
+            open_keys = {message.page_key for message in self._open.get(list_id, {}).values()}
+            for page_key in pages.keys() - open_keys:
+                del pages[page_key]
+        return edits
+
+    async def _page(self, list_id: int, page_key: Hashable, seq: int) -> Dict:
+        """Страница на номер изменения seq: прошлая страница плюс события журнала или новое чтение"""
+        pages = self._pages.get(list_id, {})
+        page = None
+        if page_key in pages:
+            page_seq, previous = pages[page_key]
+            # Между last_seq и этим вызовом нет ожиданий - событий после seq здесь нет
+            events = self.changes(list_id, page_seq)
+            if events is not None:
+                page = apply_changes(previous, events)
+
+        if page is None:
+            metrics.incr('fanout.read')
+            # Изменения во время чтения могут попасть в страницу - их повторное
+            # применение в следующей рассылке ничего не меняет
+            page = await self.read_page(list_id, page_key)
+        else:
+            metrics.incr('fanout.delta')
+
+        if list_id in self._open:
+            self._pages.setdefault(list_id, {})[page_key] = (seq, page)
+        return page
+
+    async def _wait_for_slot(self):
+        """Общий для всех списков лимит правок бота"""
+        now = time.monotonic()
+        slot = max(now, self._next_edit_at)
+        self._next_edit_at = slot + self.edit_interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _edit(self, list_id: int, user_id: int, message: OpenListMessage, text: str,
+                    keyboard: InlineKeyboardMarkup, retry: bool = True) -> bool:
+        await self._wait_for_slot()
+        try:
+            await self.bot.edit_message_text(
+                text=text, chat_id=message.chat_id, message_id=message.message_id,
+                reply_markup=keyboard, parse_mode="Markdown"
+            )
+            metrics.incr('fanout.edit')
+            return True
+
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать: сдвигаем общий лимит, чтобы остальные правки тоже ждали
+            metrics.incr('fanout.retry_after')
+            self._next_edit_at = max(self._next_edit_at, time.monotonic() + e.retry_after)
+            if retry:
+                return await self._edit(list_id, user_id, message, text, keyboard, retry=False)
+            return False
+
+        except TelegramBadRequest as e:
+            if 'message is not modified' in str(e):
+                return True
+            # Сообщение удалено или слишком старое для правки
+            self._forget_message(list_id, user_id, message)
+            return False
+
+        except TelegramForbiddenError:
+            # Пользователь заблокировал бота
+            self._forget_message(list_id, user_id, message)
+            return False
+
+    def _forget_message(self, list_id: int, user_id: int, message: OpenListMessage):
+        if self._open.get(list_id, {}).get(user_id) is message:
+            self.forget(user_id)
+
+    async def stop(self):
+        """Отменить запланированные рассылки"""
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Открытые экраны и счетчики рассылки"""
+        return {
+            'lists': len(self._open),
+            'messages': len(self._list_of_user),
+            'changes': metrics.counters['fanout.change'],
+            'coalesced': metrics.counters['fanout.coalesced'],
+            'edits': metrics.counters['fanout.edit'],
+            'reads': metrics.counters['fanout.read'],
+            'deltas': metrics.counters['fanout.delta'],
+            'retry_after': metrics.counters['fanout.retry_after'],
+        }
+
+
+async def forget_on_navigation(handler: Callable[[CallbackQuery, Dict[str, Any]], Awaitable[Any]],
+                               event: CallbackQuery, data: Dict[str, Any]) -> Any:
+    """Outer-middleware нажатий: кнопка в сообщении со списком уводит с его экрана.
+
+    Если нажатие снова показывает список, просмотр запомнит экран заново.
+    """
+    if event.message is not None:
+        list_fanout.forget(event.from_user.id, event.message.message_id)
+    return await handler(event, data)
+
+
+# Общая рассылка бота: подключается в main.py, получает изменения списков от database
+list_fanout = ListFanout(FANOUT_COALESCE_MS / 1000, FANOUT_EDITS_PER_SEC)
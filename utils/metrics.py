@@ -0,0 +1,53 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+
+class Metrics:
+    """Простые счетчики и замеры времени внутри процесса бота"""
+
+    def __init__(self):
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.timings: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1):
+        """Увеличить счетчик"""
+        self.counters[name] += value
+
+    def observe(self, name: str, seconds: float):
+        """Учесть длительность операции"""
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0}
+
+        timing['count'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Замерить длительность блока кода"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self) -> Dict:
+        """Текущие значения всех счетчиков и замеров"""
+        return {
+            'counters': dict(self.counters),
+            'timings': {
+                name: {
+                    'count': timing['count'],
+                    'avg_ms': timing['total'] / timing['count'] * 1000,
+                    'max_ms': timing['max'] * 1000,
+                }
+                for name, timing in self.timings.items()
+            },
+        }
+
+
+# Глобальный реестр метрик
+metrics = Metrics()
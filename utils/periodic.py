@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Фоновая задача бота: вызывает action раз в interval секунд до остановки.
+
+    Ошибка одного запуска логируется и не останавливает задачу, а длительность
+    каждого запуска попадает в метрики под именем задачи.
+    """
+
+    def __init__(self, name: str, interval: float, action: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.interval = interval
+        self.action = action
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Запустить задачу (повторный вызов ничего не делает)"""
+        if self.is_running:
+            return
+        self._task = asyncio.create_task(self._run(), name=self.name)
+        logger.info(f"⏰ Фоновая задача {self.name} запущена (раз в {self.interval:g} с)")
+
+    async def stop(self):
+        """Остановить задачу, дождавшись прерывания текущего запуска"""
+        if self._task is None:
+            return
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._task = None
+
+    async def run_once(self):
+        """Выполнить action сейчас, с замером и логированием ошибок"""
+        try:
+            with metrics.timer(self.name):
+                await self.action()
+        except Exception as e:
+            metrics.incr(f'{self.name}.error')
+            logger.error(f"❌ Ошибка фоновой задачи {self.name}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
@@ -1,20 +1,52 @@
 import aiohttp
 import asyncio
+import hashlib
 import ssl
 import certifi
 import re
-from typing import List, Optional, Dict
-from config import PERPLEXITY_API_KEY, PERPLEXITY_API_URL
+import json
+from typing import Awaitable, Callable, List, Optional, Dict, Tuple
+from config import (
+    PERPLEXITY_API_KEY, PERPLEXITY_API_URL, AI_CACHE_MAX_ENTRIES, AI_CACHE_PATH, AI_CACHE_MAX_PERSISTED,
+    AI_CACHE_TTL_HOURS, AI_CACHE_FRESH_TTL_HOURS, AI_MODELS, AI_MODEL_TIMEOUTS, AI_MODEL_TIMEOUT_SEC,
+    AI_HEDGE_DELAY_SEC, AI_TOTAL_BUDGET_SEC
+)
+from .metrics import metrics
+from .product_parser import UNIT_PATTERN, normalize_name, parse_product_line
+from .response_cache import ResponseCache
+from .ai_scheduler import OnPosition, ai_scheduler
+from .singleflight import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Получатель частичного ответа при потоковой генерации: весь накопленный текст
+OnPartial = Callable[[str], Awaitable[None]]
+
+# Сколько товаров списка попадает в контекст запроса (и в ключ кэша ответов)
+LIST_CONTEXT_ITEMS = 8
+
+# Пометка ответа, поток которого оборвал бюджет времени на вопрос
+TRUNCATED_NOTE = "\n\n✂️ _Ответ оборван: AI отвечал слишком долго. Спросите еще раз, чтобы получить его целиком._"
+
+# Вопросы, ответ на которые зависит от времени: кэшируются на AI_CACHE_FRESH_TTL_HOURS
+FRESH_KEYWORDS = ['сезон', 'сейчас', 'сегодня', 'цен', 'акци', 'скидк', 'новинк']
+
 
 class PerplexityClient:
     def __init__(self):
         self.api_key = PERPLEXITY_API_KEY
         self.api_url = "https://api.perplexity.ai/chat/completions"
         self.session = None
+        self.cache = ResponseCache('ai.cache', AI_CACHE_MAX_ENTRIES, AI_CACHE_PATH, AI_CACHE_MAX_PERSISTED)
+        # Одинаковые одновременные вопросы (ключ - как у кэша) идут в API один раз
+        self._in_flight = SingleFlight('ai.singleflight')
+        self._partial_listeners: Dict[str, List[OnPartial]] = {}
+        # Модели по порядку подстраховки: первая - основная, следующие - запасные
+        self.models = AI_MODELS
+        self.model_timeouts = AI_MODEL_TIMEOUTS
+        self.hedge_delay = AI_HEDGE_DELAY_SEC
+        self.total_budget = AI_TOTAL_BUDGET_SEC
 
     async def get_session(self):
         """Получить aiohttp сессию"""
@@ -30,9 +62,30 @@ class PerplexityClient:
         return self.session
 
     async def close(self):
-        """Закрыть сессию"""
+        """Закрыть сессию и файл кэша ответов"""
         if self.session and not self.session.closed:
             await self.session.close()
+        self.cache.close()
+
+    def in_flight_stats(self) -> Dict:
+        """Запросы к API и одинаковые вопросы, получившие ответ чужого запроса"""
+        return self._in_flight.stats()
+
+    @staticmethod
+    def cache_key(user_message: str, current_list: List[str] = None) -> str:
+        """Ключ ответа: нормализованный вопрос и отпечаток товаров списка из контекста запроса"""
+        question = normalize_name(user_message).strip(' ?!.,…')
+        items = sorted(normalize_name(item) for item in (current_list or [])[:LIST_CONTEXT_ITEMS])
+        fingerprint = hashlib.sha1('\n'.join(items).encode('utf-8')).hexdigest()[:16]
+        return f"{fingerprint}:{question}"
+
+    @staticmethod
+    def cache_ttl(user_message: str, intent: str) -> float:
+        """Срок жизни ответа в секундах по намерению вопроса"""
+        message_lower = user_message.lower()
+        if any(keyword in message_lower for keyword in FRESH_KEYWORDS):
+            return AI_CACHE_FRESH_TTL_HOURS * 3600
+        return AI_CACHE_TTL_HOURS.get(intent, AI_CACHE_TTL_HOURS['general']) * 3600
 
     def extract_products_from_response(self, ai_response: str) -> List[Dict[str, str]]:
         """Извлекаем продукты из ответа AI для автоматического добавления"""
@@ -40,9 +93,9 @@ class PerplexityClient:
 
         # Ищем списки продуктов в ответе
         patterns = [
-            r'[\-\*\•]\s*([А-Яа-я\s]+(?:\d+\s*(?:кг|г|л|мл|шт|штук|упак|пачка|банка|буханка)?))',
-            r'\d+\.\s*([А-Яа-я\s]+(?:\d+\s*(?:кг|г|л|мл|шт|штук|упак|пачка|банка|буханка)?))',
-            r'([А-Яа-я]+)\s*-\s*(\d+\s*(?:кг|г|л|мл|шт|штук|упак|пачка|банка))',
+            rf'[\-\*\•]\s*([А-Яа-я\s]+(?:\d+\s*(?:{UNIT_PATTERN})?))',
+            rf'\d+\.\s*([А-Яа-я\s]+(?:\d+\s*(?:{UNIT_PATTERN})?))',
+            rf'([А-Яа-я]+)\s*-\s*(\d+\s*(?:{UNIT_PATTERN}))',
         ]
 
         for pattern in patterns:
@@ -52,14 +105,7 @@ class PerplexityClient:
                     name, quantity = match
                     products.append({"name": name.strip(), "quantity": quantity.strip()})
                 else:
-                    parts = match.strip().split()
-                    if len(parts) > 1 and any(
-                            unit in parts[-1].lower() for unit in ['кг', 'г', 'л', 'мл', 'шт', 'упак']):
-                        name = ' '.join(parts[:-1])
-                        quantity = parts[-1]
-                    else:
-                        name = match.strip()
-                        quantity = '1'
+                    name, quantity = parse_product_line(match)
 
                     if name and len(name) > 2:
                         products.append({"name": name, "quantity": quantity})
@@ -76,8 +122,20 @@ class PerplexityClient:
         return unique_products[:5]
 
     async def get_smart_response(self, user_message: str, current_list: List[str] = None,
-                                 context: str = "general") -> Dict:
-        """Получить умный ответ от AI с анализом намерений"""
+                                 context: str = "general", on_partial: Optional[OnPartial] = None,
+                                 user_id: Optional[int] = None,
+                                 on_queue_position: Optional[OnPosition] = None) -> Dict:
+        """Получить умный ответ от AI с анализом намерений.
+
+        С on_partial ответ генерируется потоком, и on_partial получает накопленный
+        текст по мере прихода; продукты и намерение определяются по готовому ответу.
+        Тот же вопрос, уже заданный без on_partial, потоком не идет: присоединившийся
+        к нему вызов получит только готовый ответ. В боте поток включается для всех
+        вопросов сразу (AI_STREAM), так что это касается только смешанных вызовов.
+        Запрос к API ждет своей очереди пользователя user_id в ai_scheduler
+        (on_queue_position получает место в очереди) и при переполнении очереди
+        отклоняется AIQueueFull.
+        """
 
         if not self.api_key:
             return {
@@ -86,9 +144,53 @@ class PerplexityClient:
                 "intent": "error"
             }
 
+        # Популярные вопросы при том же списке отвечаем из кэша за миллисекунды
+        cache_key = self.cache_key(user_message, current_list)
+        with metrics.timer('ai.cache.get'):
+            cached = await self.cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"⚡ Ответ AI из кэша ({cached.get('model')}): {user_message[:50]}")
+            return {**cached, "cached": True}
+
+        # Тот же вопрос при том же списке уже задан и ждет ответа - ждем его вместе,
+        # поток ответа получают все спросившие
+        listeners = self._partial_listeners.setdefault(cache_key, [])
+        if on_partial is not None:
+            listeners.append(on_partial)
+        shared = self._in_flight.in_flight(cache_key)
+        if shared:
+            logger.info(f"🔗 Такой же вопрос уже обрабатывается, ждем его ответ: {user_message[:50]}")
+
+        async def broadcast(content: str):
+            for listener in list(listeners):
+                try:
+                    await listener(content)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка вывода частичного ответа: {e}")
+
+        try:
+            result = await self._in_flight.do(
+                cache_key,
+                lambda: ai_scheduler.run(
+                    user_id,
+                    lambda: self._ask(user_message, current_list, cache_key, broadcast if on_partial else None),
+                    on_queue_position
+                )
+            )
+        finally:
+            if on_partial is not None:
+                listeners.remove(on_partial)
+            if not listeners and not self._in_flight.in_flight(cache_key):
+                self._partial_listeners.pop(cache_key, None)
+
+        return {**result, "shared": True} if shared else result
+
+    async def _ask(self, user_message: str, current_list: Optional[List[str]], cache_key: str,
+                   on_partial: Optional[OnPartial]) -> Dict:
+        """Запрос к моделям (без кэша): ответ с продуктами и намерением или простой ответ"""
         # Формируем контекст
         if current_list and len(current_list) > 0:
-            list_context = f"Текущий список покупок: {', '.join(current_list[:8])}"
+            list_context = f"Текущий список покупок: {', '.join(current_list[:LIST_CONTEXT_ITEMS])}"
         else:
             list_context = "Список покупок пуст"
 
@@ -115,77 +217,34 @@ class PerplexityClient:
 
 СТИЛЬ: Дружелюбный, экспертный, практичный"""
 
-        # ИСПРАВЛЕНО: Возвращаем рабочие модели
-        models_to_try = [
-            "sonar-pro",  # Работала ранее
-            "sonar",  # Быстрая модель
-            "sonar-reasoning",  # Модель с рассуждениями
-            "sonar-deep-research"  # Глубокие исследования
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
         ]
 
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        answer = await self.hedged_completion(messages, on_partial)
+        if answer is not None:
+            model, ai_response, truncated = answer
 
-        session = await self.get_session()
+            # Извлекаем продукты из ответа
+            products = self.extract_products_from_response(ai_response)
 
-        for model in models_to_try:
-            try:
-                payload = {
-                    "model": model,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ],
-                    "max_tokens": 800,
-                    "temperature": 0.4,
-                    "stream": False
-                }
+            # Определяем намерение пользователя
+            intent = self.detect_intent(user_message, ai_response)
 
-                # Добавляем web_search_options для online моделей
-                if model in ["sonar", "sonar-pro", "sonar-reasoning", "sonar-deep-research"]:
-                    payload["web_search_options"] = {
-                        "search_context_size": "medium",
-                        "top_k": 3,
-                        "return_related_questions": False,
-                        "search_recency_filter": "month"
-                    }
-
-                logger.info(f"🔗 Запрос к умному AI: {model}")
-
-                async with session.post(
-                        self.api_url,
-                        json=payload,
-                        headers=headers
-                ) as response:
-
-                    if response.status == 200:
-                        result = await response.json()
-                        ai_response = result['choices'][0]['message']['content']
-
-                        # Извлекаем продукты из ответа
-                        products = self.extract_products_from_response(ai_response)
-
-                        # Определяем намерение пользователя
-                        intent = self.detect_intent(user_message, ai_response)
-
-                        logger.info(f"✅ Умный ответ от {model}, найдено продуктов: {len(products)}")
-
-                        return {
-                            "response": ai_response,
-                            "products": products,
-                            "intent": intent,
-                            "model": model
-                        }
-                    else:
-                        response_text = await response.text()
-                        logger.warning(f"❌ Ошибка {response.status} с моделью {model}: {response_text[:100]}")
-                        continue
+            logger.info(f"✅ Умный ответ от {model}, найдено продуктов: {len(products)}")
 
-            except Exception as e:
-                logger.error(f"❌ Ошибка с моделью {model}: {e}")
-                continue
+            result = {
+                "response": ai_response,
+                "products": products,
+                "intent": intent,
+                "model": model
+            }
+            if truncated:
+                # Оборванный ответ показываем (его начало пользователь уже видел), но не кэшируем
+                return {**result, "response": ai_response + TRUNCATED_NOTE, "truncated": True}
+            await self.cache.put(cache_key, result, self.cache_ttl(user_message, intent))
+            return result
 
         # ИСПРАВЛЕНО: Fallback на простые ответы
         return await self.get_simple_ai_response(user_message, current_list)
@@ -244,6 +303,193 @@ class PerplexityClient:
         else:
             return "general"
 
+    async def complete(self, model: str, messages: List[Dict], timeout: float,
+                       on_partial: Optional[OnPartial] = None) -> str:
+        """Один запрос к модели: текст ответа или исключение (ошибка HTTP, таймаут, пустой ответ).
+
+        С on_partial ответ запрашивается потоком (SSE) и передается по мере генерации.
+        """
+        payload = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": 800,
+            "temperature": 0.4,
+            "stream": on_partial is not None
+        }
+
+        # Добавляем web_search_options для online моделей
+        if model in ["sonar", "sonar-pro", "sonar-reasoning", "sonar-deep-research"]:
+            payload["web_search_options"] = {
+                "search_context_size": "medium",
+                "top_k": 3,
+                "return_related_questions": False,
+                "search_recency_filter": "month"
+            }
+
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+        session = await self.get_session()
+        logger.info(f"🔗 Запрос к умному AI: {model} (таймаут {timeout:.0f} с)")
+
+        with metrics.timer(f'ai.model.{model}'):
+            async with session.post(
+                    self.api_url,
+                    json=payload,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                if response.status != 200:
+                    response_text = await response.text()
+                    raise RuntimeError(f"HTTP {response.status}: {response_text[:100]}")
+
+                if on_partial is not None:
+                    content = await self._read_stream(response, on_partial)
+                else:
+                    result = await response.json()
+                    content = result['choices'][0]['message']['content']
+                if not content or not content.strip():
+                    raise RuntimeError("пустой ответ")
+                return content
+
+    @staticmethod
+    async def _read_stream(response: aiohttp.ClientResponse, on_partial: OnPartial) -> str:
+        """Собрать ответ из потока SSE, передавая накопленный текст после каждого фрагмента"""
+        content = ""
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8').strip()
+            # Поток - строки "data: {...}", разделенные пустыми; служебные строки пропускаем
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+
+            choice = json.loads(data)['choices'][0]
+            delta = (choice.get('delta') or {}).get('content')
+            if delta:
+                content += delta
+            elif (choice.get('message') or {}).get('content'):
+                # Часть моделей присылает в каждом событии весь текст целиком
+                content = choice['message']['content']
+            else:
+                continue
+            await on_partial(content)
+        return content
+
+    async def hedged_completion(self, messages: List[Dict],
+                                on_partial: Optional[OnPartial] = None) -> Optional[Tuple[str, str, bool]]:
+        """Ответ первой успевшей модели: (модель, текст, оборван ли) или None, если не ответила ни одна.
+
+        Сначала спрашиваем основную модель. Если за hedge_delay ответа нет или
+        запрос упал, запускаем следующую модель списка, не отменяя предыдущие.
+        Первый хороший ответ отменяет остальные запросы. Каждая модель ограничена
+        своим таймаутом, а весь вопрос - total_budget секундами.
+
+        При потоковой генерации ответом считается первый пришедший фрагмент:
+        выводится поток только этой модели, остальные запросы отменяются. Если
+        бюджет кончился посреди потока, возвращается уже выведенная часть ответа
+        с признаком обрыва - а не None, после которого ее заменил бы запасной ответ.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_budget
+        models = iter(self.models)
+        pending: Dict[asyncio.Task, str] = {}
+        next_hedge_at = deadline
+        streaming_model: Optional[str] = None
+        # (модель, текст) последнего выведенного частичного ответа
+        streamed: Optional[Tuple[str, str]] = None
+
+        def partial_for(model: str) -> Optional[OnPartial]:
+            if on_partial is None:
+                return None
+
+            async def partial(content: str):
+                nonlocal streaming_model, streamed
+                if streaming_model is None:
+                    streaming_model = model
+                    for task, other in pending.items():
+                        if other != model:
+                            task.cancel()
+                if streaming_model == model:
+                    streamed = (model, content)
+                    await on_partial(content)
+            return partial
+
+        def give_up() -> Optional[Tuple[str, str, bool]]:
+            if streamed is None:
+                return None
+            metrics.incr('ai.truncated')
+            logger.warning(f"✂️ Поток {streamed[0]} оборван, отдаем полученную часть ответа")
+            return streamed[0], streamed[1], True
+
+        def launch() -> bool:
+            nonlocal next_hedge_at
+            model = next(models, None)
+            remaining = deadline - loop.time()
+            if model is None or remaining <= 0:
+                next_hedge_at = deadline
+                return False
+
+            timeout = min(self.model_timeouts.get(model, AI_MODEL_TIMEOUT_SEC), remaining)
+            task = asyncio.create_task(
+                self.complete(model, messages, timeout, partial_for(model)), name=f'ai-{model}'
+            )
+            pending[task] = model
+            next_hedge_at = loop.time() + self.hedge_delay
+            return True
+
+        launch()
+        try:
+            while pending:
+                now = loop.time()
+                if now >= deadline:
+                    metrics.incr('ai.budget_exhausted')
+                    logger.warning(f"⏱ Бюджет запроса к AI ({self.total_budget:g} с) исчерпан")
+                    return give_up()
+
+                # Пока модель выводит ответ потоком, подстраховка не нужна
+                hedge_at = next_hedge_at if streaming_model is None else deadline
+                done, _ = await asyncio.wait(
+                    pending, timeout=max(0.0, min(hedge_at, deadline) - now),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                failed = False
+                for task in done:
+                    model = pending.pop(task)
+                    if task.cancelled():
+                        # Отменена, потому что поток начала другая модель
+                        continue
+                    try:
+                        content = task.result()
+                    except Exception as e:
+                        logger.error(f"❌ Ошибка с моделью {model}: {type(e).__name__}: {e}")
+                        if streaming_model == model:
+                            # Поток оборвался - следующая модель начнет ответ заново
+                            streaming_model = None
+                        failed = True
+                        continue
+
+                    if model != self.models[0]:
+                        metrics.incr('ai.hedge_win')
+                    return model, content, False
+
+                if failed or (streaming_model is None and loop.time() >= next_hedge_at):
+                    # Упавший запрос заменяем сразу, медленный - подстраховываем следующей моделью
+                    if launch() and not failed:
+                        metrics.incr('ai.hedge')
+                        logger.info(f"⏳ Нет ответа за {self.hedge_delay:g} с, параллельно спрашиваем запасную модель")
+            # Таймаут модели урезан до остатка бюджета: поток мог оборваться ошибкой таймаута
+            return give_up()
+
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
     # Для обратной совместимости
     async def get_shopping_suggestions(self, user_message: str, current_list: List[str] = None) -> str:
         """Простая версия для обратной совместимости"""
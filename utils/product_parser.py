@@ -0,0 +1,121 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Сколько продуктов можно добавить одним сообщением
+MAX_BULK_PRODUCTS = 300
+
+# Написание единицы -> (единица хранения, множитель). Масса хранится в граммах,
+# объем в миллилитрах, поэтому "2 кг" и "500 г" одного товара складываются в SQL
+UNIT_ALIASES = {
+    'кг': ('г', 1000), 'килограмм': ('г', 1000), 'килограмма': ('г', 1000), 'килограммов': ('г', 1000),
+    'г': ('г', 1), 'гр': ('г', 1), 'грамм': ('г', 1), 'грамма': ('г', 1), 'граммов': ('г', 1),
+    'л': ('мл', 1000), 'литр': ('мл', 1000), 'литра': ('мл', 1000), 'литров': ('мл', 1000),
+    'мл': ('мл', 1),
+    'шт': ('шт', 1), 'штука': ('шт', 1), 'штуки': ('шт', 1), 'штук': ('шт', 1),
+    'упак': ('упак', 1), 'упаковка': ('упак', 1), 'упаковки': ('упак', 1), 'упаковок': ('упак', 1),
+    'пачка': ('пачка', 1), 'пачки': ('пачка', 1), 'пачек': ('пачка', 1),
+    'банка': ('банка', 1), 'банки': ('банка', 1), 'банок': ('банка', 1),
+    'бутылка': ('бутылка', 1), 'бутылки': ('бутылка', 1), 'бутылок': ('бутылка', 1),
+    'буханка': ('буханка', 1), 'буханки': ('буханка', 1), 'буханок': ('буханка', 1),
+}
+
+# Все написания единиц, длинные первыми - в таком порядке их можно подставлять в регулярные выражения
+UNITS = sorted(UNIT_ALIASES, key=len, reverse=True)
+UNIT_PATTERN = '|'.join(UNITS)
+
+# Количество: число, единица или число с единицей ("2", "кг", "2,5 кг", "500г", "3 шт.")
+_QUANTITY = re.compile(r'^(\d+(?:[.,]\d+)?)?\s*([^\W\d_]+)?\.?$')
+
+# Разделители позиций: перевод строки, точка с запятой и запятая,
+# если это не десятичная запятая внутри числа ("2,5 кг")
+_SEPARATORS = re.compile(r'[\n;]+|(?<!\d),|,(?!\d)')
+
+# Маркеры списков при вставке: "- молоко", "• хлеб", "1. яйца", "2) сыр"
+_LIST_MARKER = re.compile(r'^\s*(?:[-–—•*]|\d+[.)])\s+')
+
+
+def _is_number(word: str) -> bool:
+    return word.replace(',', '.').replace('.', '').isdigit()
+
+
+def _has_unit(word: str) -> bool:
+    match = _QUANTITY.match(word.lower())
+    return bool(match and match.group(2) in UNIT_ALIASES)
+
+
+def parse_quantity(quantity: str) -> Tuple[Optional[float], Optional[str]]:
+    """Количество в единицах хранения: "2 кг" -> (2000.0, 'г'), "3" -> (3.0, 'шт').
+
+    Для текста, который не удается разобрать ("пара", "на ужин"), возвращает (None, None).
+    """
+    match = _QUANTITY.match(quantity.strip().lower())
+    if not match or not any(match.groups()):
+        return None, None
+
+    number, unit_word = match.groups()
+    amount = float(number.replace(',', '.')) if number else 1.0
+    if unit_word is None:
+        return amount, 'шт'
+
+    if unit_word not in UNIT_ALIASES:
+        return None, None
+    unit, factor = UNIT_ALIASES[unit_word]
+    return amount * factor, unit
+
+
+def normalize_name(name: str) -> str:
+    """Ключ названия для поиска дубликатов: без регистра, ё -> е, одиночные пробелы"""
+    return ' '.join(name.casefold().replace('ё', 'е').split())
+
+
+def format_amount(amount: float, unit: str) -> str:
+    """Количество для показа: крупные граммы и миллилитры переводятся в кг и л"""
+    if unit == 'г' and amount >= 1000:
+        amount, unit = amount / 1000, 'кг'
+    elif unit == 'мл' and amount >= 1000:
+        amount, unit = amount / 1000, 'л'
+
+    return f"{amount:.3f}".rstrip('0').rstrip('.') + f" {unit}"
+
+
+def parse_product_line(product_text: str) -> Tuple[str, str]:
+    """Разделить строку вида "Яблоки 1 кг" на название и количество"""
+    product_text = product_text.strip()
+    words = product_text.split()
+    product_name = product_text
+    quantity = '1'
+
+    if len(words) > 1:
+        last_word = words[-1].lower()
+
+        if _has_unit(last_word):
+            if len(words) >= 2 and _is_number(words[-2]):
+                quantity = f"{words[-2]} {words[-1]}"
+                product_name = ' '.join(words[:-2])
+            else:
+                quantity = words[-1]
+                product_name = ' '.join(words[:-1])
+        elif _is_number(last_word):
+            quantity = words[-1]
+            product_name = ' '.join(words[:-1])
+
+    if not product_name.strip():
+        product_name = product_text
+        quantity = '1'
+
+    return product_name, quantity
+
+
+def parse_product_list(text: str) -> List[Dict[str, str]]:
+    """Разобрать вставленный список (по строкам или через запятую) за один проход"""
+    products = []
+
+    for line in _SEPARATORS.split(text):
+        line = _LIST_MARKER.sub('', line).strip()
+        if not line:
+            continue
+
+        name, quantity = parse_product_line(line)
+        products.append({'name': name, 'quantity': quantity})
+
+    return products
@@ -0,0 +1,71 @@
+import logging
+import time
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram не принимает сообщения длиннее 4096 символов
+MAX_MESSAGE_LENGTH = 4000
+
+
+class ProgressiveMessage:
+    """Сообщение-заглушка, которое дописывается по мере генерации ответа AI.
+
+    Частичный текст выводится без разметки (незакрытая разметка ломает правку)
+    и не чаще раза в interval секунд: Telegram ограничивает частоту правок
+    в одном чате. Готовый ответ с разметкой и клавиатурой ставит finish().
+    """
+
+    def __init__(self, message: Message, interval: float = 1.0, prefix: str = ""):
+        self.message = message
+        self.interval = interval
+        self.prefix = prefix
+        self.started = time.monotonic()
+        self._last_edit = 0.0
+        self._first_shown = False
+
+    @property
+    def streaming(self) -> bool:
+        """На заглушке уже показан частичный ответ"""
+        return self._first_shown
+
+    async def update(self, text: str):
+        """Показать накопленный текст, если с прошлой правки прошло interval секунд"""
+        now = time.monotonic()
+        if now - self._last_edit < self.interval:
+            return
+        self._last_edit = now
+
+        if not self._first_shown:
+            self._first_shown = True
+            # Время до первого видимого текста - главный выигрыш потоковой генерации
+            metrics.observe('ai.stream.first_text', now - self.started)
+
+        visible = self.prefix + text
+        if len(visible) > MAX_MESSAGE_LENGTH:
+            visible = visible[:MAX_MESSAGE_LENGTH] + "…"
+        try:
+            await self.message.edit_text(visible + " ▌", parse_mode=None)
+            metrics.incr('ai.stream.edit')
+        except TelegramRetryAfter as e:
+            # Следующая правка - не раньше, чем разрешит Telegram
+            self._last_edit = now + e.retry_after
+        except TelegramBadRequest as e:
+            logger.debug(f"Правка частичного ответа пропущена: {e}")
+
+    async def finish(self, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None,
+                     parse_mode: Optional[str] = "Markdown"):
+        """Заменить заглушку готовым ответом"""
+        try:
+            await self.message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        except TelegramBadRequest as e:
+            if 'message is not modified' in str(e):
+                return
+            # Разметку ответа AI Telegram разобрать не смог - показываем текст как есть
+            logger.warning(f"⚠️ Ответ показан без разметки: {e}")
+            await self.message.edit_text(text, reply_markup=reply_markup, parse_mode=None)
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _PersistentTier:
+    """Ответы в отдельном файле SQLite: переживают перезапуск бота.
+
+    Одно соединение sqlite3 под замком; вызовы идут из пула потоков через
+    asyncio.to_thread, чтобы диск не задерживал цикл событий.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode = WAL')
+        self._db.execute('PRAGMA synchronous = NORMAL')
+        self._db.execute('''
+                         CREATE TABLE IF NOT EXISTS ai_responses
+                         (
+                             key        TEXT PRIMARY KEY,
+                             value      TEXT NOT NULL,
+                             expires_at REAL NOT NULL,
+                             stored_at  REAL NOT NULL
+                         )
+                         ''')
+        self._db.execute('CREATE INDEX IF NOT EXISTS idx_ai_responses_expires ON ai_responses (expires_at)')
+        self._db.commit()
+        self.prune()
+
+    def get(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._lock:
+            row = self._db.execute(
+                'SELECT expires_at, value FROM ai_responses WHERE key = ? AND expires_at > ?',
+                (key, time.time())
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def put(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO ai_responses (key, value, expires_at, stored_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), expires_at, time.time())
+            )
+            self._db.commit()
+
+    def prune(self) -> int:
+        """Удалить истекшие ответы и самые старые сверх max_entries"""
+        with self._lock:
+            removed = self._db.execute('DELETE FROM ai_responses WHERE expires_at <= ?', (time.time(),)).rowcount
+            removed += self._db.execute(
+                'DELETE FROM ai_responses WHERE key IN '
+                '(SELECT key FROM ai_responses ORDER BY stored_at DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            ).rowcount
+            self._db.commit()
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """Кэш ответов AI со сроком жизни: LRU в памяти и, если задан path, копия в SQLite.
+
+    Промах памяти проверяет файл и поднимает найденный ответ обратно в память.
+    Файл открывается при первом обращении; если он недоступен, кэш работает
+    только в памяти. Попадания обоих уровней и промахи считаются в метриках
+    под именем name.
+    """
+
+    def __init__(self, name: str, max_entries: int = 500, path: Optional[str] = None,
+                 max_persisted: int = 5000, prune_every: int = 100):
+        self.name = name
+        self.max_entries = max(1, max_entries)
+        self._entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self.path = path
+        self.max_persisted = max_persisted
+        self._persistent: Optional[_PersistentTier] = None
+        self._open_lock = threading.Lock()
+        self._prune_every = max(1, prune_every)
+        self._writes = 0
+
+    def _tier(self) -> Optional[_PersistentTier]:
+        """Уровень SQLite (открывается в потоке при первом обращении)"""
+        with self._open_lock:
+            if self._persistent is None and self.path:
+                try:
+                    self._persistent = _PersistentTier(self.path, self.max_persisted)
+                except Exception as e:
+                    logger.error(f"❌ Кэш ответов AI в {self.path} недоступен, работаем только в памяти: {e}")
+                    self.path = None
+            return self._persistent
+
+    def _persisted_get(self, key: str) -> Optional[Tuple[float, Any]]:
+        tier = self._tier()
+        return tier.get(key) if tier else None
+
+    def _persisted_put(self, key: str, value: Any, expires_at: float, prune: bool):
+        tier = self._tier()
+        if tier:
+            tier.put(key, value, expires_at)
+            if prune:
+                tier.prune()
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Ответ из кэша или None, если его нет или срок жизни истек"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                metrics.incr(f'{self.name}.hit')
+                return entry[1]
+            del self._entries[key]
+
+        if self.path:
+            try:
+                entry = await asyncio.to_thread(self._persisted_get, key)
+            except Exception as e:
+                logger.error(f"❌ Ошибка чтения кэша ответов AI: {e}")
+                entry = None
+            if entry is not None:
+                self._remember(key, *entry)
+                metrics.incr(f'{self.name}.hit_persistent')
+                return entry[1]
+
+        metrics.incr(f'{self.name}.miss')
+        return None
+
+    async def put(self, key: str, value: Any, ttl: float):
+        """Сохранить ответ на ttl секунд"""
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, value)
+
+        if self.path:
+            self._writes += 1
+            try:
+                await asyncio.to_thread(
+                    self._persisted_put, key, value, expires_at, self._writes % self._prune_every == 0
+                )
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи кэша ответов AI: {e}")
+
+    def _remember(self, key: str, expires_at: float, value: Any):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.incr(f'{self.name}.eviction')
+
+    def clear(self):
+        """Очистить уровень в памяти"""
+        self._entries.clear()
+
+    def close(self):
+        if self._persistent is not None:
+            self._persistent.close()
+            self._persistent = None
+
+    def stats(self) -> Dict[str, int]:
+        """Счетчики попаданий и промахов"""
+        return {
+            'size': len(self._entries),
+            'hits': metrics.counters[f'{self.name}.hit'],
+            'persistent_hits': metrics.counters[f'{self.name}.hit_persistent'],
+            'misses': metrics.counters[f'{self.name}.miss'],
+            'evictions': metrics.counters[f'{self.name}.eviction'],
+        }
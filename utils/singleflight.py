@@ -0,0 +1,66 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from .metrics import metrics
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных вызовов.
+
+    Первый вызов с ключом выполняет работу, а вызовы с тем же ключом, пришедшие
+    до ее окончания, ждут тот же результат (или ту же ошибку). Если первый вызов
+    отменен, ожидающие не отменяются вместе с ним: первый из них выполняет свою
+    работу заново, остальные ждут уже его. Выполненные и сэкономленные вызовы
+    считаются в метриках под именем name.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        """Результат work() для key: свой или уже выполняющегося вызова"""
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.incr(f'{self.name}.shared')
+            try:
+                # Отмена ожидающего не должна отменять общий вызов
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # Отменен не этот вызов, а первый - выполняем работу сами
+                if not future.cancelled() or asyncio.current_task().cancelling():
+                    raise
+                metrics.incr(f'{self.name}.retry')
+                return await self.do(key, work)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        metrics.incr(f'{self.name}.call')
+        try:
+            result = await work()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Ошибку получат ожидающие; если их нет, asyncio не должен о ней предупреждать
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Выполненные и сэкономленные вызовы"""
+        return {
+            'in_flight': len(self._calls),
+            'calls': metrics.counters[f'{self.name}.call'],
+            'shared': metrics.counters[f'{self.name}.shared'],
+        }